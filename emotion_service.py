@@ -0,0 +1,502 @@
+"""
+EduSense AI - Emotion Service
+================================================================================
+Backend analisis emosi untuk sample wajah hasil analisis video.
+
+BACKEND (pilih via EMOTION_BACKEND):
+------------------------------------
+- remote : API eksternal (HF Space). Dijalankan di proses API.
+           * Satu httpx.AsyncClient bersama (keep-alive) untuk seluruh task.
+           * Request paralel dengan batas konkurensi (Semaphore).
+           * Circuit Breaker: endpoint yang gagal berturut-turut tidak dipanggil
+             lagi sampai masa backoff (eksponensial) habis, lalu dicoba satu probe.
+- local  : Model ONNX Runtime di CPU, dijalankan DI DALAM worker process
+           dengan batch seluruh crop sekaligus. Tidak butuh jaringan.
+- none   : Analisis emosi dinonaktifkan.
+
+URL endpoint remote bisa diarahkan ke stub lokal (lihat helpers/emotion_stub_server.py)
+melalui environment variable EMOTION_API_URL.
+================================================================================
+"""
+
+import os
+import abc
+import time
+import asyncio
+import logging
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import cv2
+import httpx
+import numpy as np
+
+logger = logging.getLogger("EduSenseCore.Emotion")
+
+# ==============================================================================
+# KONFIGURASI (Override via Environment Variable)
+# ==============================================================================
+
+# Backend aktif: 'remote', 'local', atau 'none'
+EMOTION_BACKEND = os.getenv("EMOTION_BACKEND", "remote").lower()
+
+EMOTION_API_URL = os.getenv("EMOTION_API_URL", "https://risetkami-risetkami.hf.space/predict_face")
+EMOTION_MAX_CONCURRENCY = int(os.getenv("EMOTION_MAX_CONCURRENCY", "8"))
+EMOTION_TIMEOUT_SECONDS = float(os.getenv("EMOTION_TIMEOUT_SECONDS", "2.0"))
+
+# Circuit Breaker
+EMOTION_BREAKER_FAILURES = int(os.getenv("EMOTION_BREAKER_FAILURES", "5"))        # Gagal berturut-turut sebelum OPEN
+EMOTION_BREAKER_BACKOFF_S = float(os.getenv("EMOTION_BREAKER_BACKOFF_S", "5"))     # Backoff awal
+EMOTION_BREAKER_MAX_BACKOFF_S = float(os.getenv("EMOTION_BREAKER_MAX_BACKOFF_S", "300"))
+
+# Backend lokal (ONNX Runtime, CPU)
+EMOTION_ONNX_MODEL_PATH = os.getenv("EMOTION_ONNX_MODEL_PATH", os.path.join("models_ai", "emotion.onnx"))
+# Urutan label sesuai output model (default: urutan kelas FER-2013)
+EMOTION_ONNX_LABELS = [
+    label.strip() for label in
+    os.getenv("EMOTION_ONNX_LABELS", "angry,disgust,fear,happy,sad,surprise,neutral").split(",")
+]
+# Normalisasi input: 'unit' = piksel / 255, 'none' = piksel mentah 0-255
+EMOTION_ONNX_NORMALIZE = os.getenv("EMOTION_ONNX_NORMALIZE", "unit").lower()
+EMOTION_ONNX_THREADS = int(os.getenv("EMOTION_ONNX_THREADS", "1"))
+
+DEFAULT_EMOTION = "neutral"
+
+
+# ==============================================================================
+# IMAGE UTILS
+# ==============================================================================
+
+def compress_image_to_bytes(image_cv: np.ndarray, max_size: int = 224, quality: int = 60) -> bytes:
+    """
+    Fungsi utilitas untuk mengompresi gambar OpenCV (Numpy Array) menjadi bytes JPEG.
+    Digunakan sebelum mengirim gambar ke API Eksternal untuk menghemat bandwidth network.
+
+    Args:
+        image_cv (np.ndarray): Gambar input dalam format BGR.
+        max_size (int): Ukuran dimensi maksimum (lebar/tinggi).
+        quality (int): Kualitas kompresi JPEG (0-100).
+
+    Returns:
+        bytes: Data gambar terkompresi.
+    """
+    try:
+        h, w = image_cv.shape[:2]
+        # Resize logic jika gambar terlalu besar
+        if max(h, w) > max_size:
+            scale = max_size / max(h, w)
+            new_w, new_h = int(w * scale), int(h * scale)
+            image_cv = cv2.resize(image_cv, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        
+        # Encoding ke format JPG
+        success, encoded_img = cv2.imencode('.jpg', image_cv, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        if not success:
+            logger.warning("Image Utils: Failed to encode image.")
+            return b""
+        return encoded_img.tobytes()
+    except Exception as e:
+        logger.error(f"Image Utils: Error compressing image - {e}")
+        return b""
+
+
+# ==============================================================================
+# CIRCUIT BREAKER
+# ==============================================================================
+
+class CircuitBreaker:
+    """
+    Circuit breaker sederhana tiga state.
+
+    - CLOSED    : Semua request diizinkan. Kegagalan dihitung.
+    - OPEN      : Semua request ditolak sampai backoff habis.
+    - HALF_OPEN : Satu request probe diizinkan. Sukses -> CLOSED,
+                  gagal -> OPEN lagi dengan backoff dua kali lipat.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = EMOTION_BREAKER_FAILURES,
+        base_backoff: float = EMOTION_BREAKER_BACKOFF_S,
+        max_backoff: float = EMOTION_BREAKER_MAX_BACKOFF_S
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = base_backoff
+        self.open_until = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """True jika request boleh dikirim sekarang."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() < self.open_until:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        # HALF_OPEN: hanya satu probe
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Emotion: Circuit CLOSED, endpoint kembali normal.")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state == self.HALF_OPEN:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+            self.state = self.OPEN
+            self.open_until = time.monotonic() + self.backoff
+            self._probe_in_flight = False
+            logger.warning(f"Emotion: Circuit OPEN selama {self.backoff:.0f}s ({self.failures} kegagalan).")
+
+    def release(self):
+        """Request selesai tanpa hasil (misal dibatalkan): lepas slot probe tanpa mengubah state."""
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, object]:
+        """Status breaker untuk endpoint health/diagnostik."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in_seconds": max(0.0, round(self.open_until - time.monotonic(), 1)) if self.state == self.OPEN else 0.0
+        }
+
+
+# ==============================================================================
+# EMOTION CLIENT
+# ==============================================================================
+
+class EmotionClient:
+    """
+    Client asynchronous untuk API emosi eksternal.
+
+    Dibuat sekali saat startup (start()) dan ditutup saat shutdown (close()).
+    Semua task analisis berbagi koneksi keep-alive yang sama.
+    """
+
+    def __init__(
+        self,
+        url: str = EMOTION_API_URL,
+        max_concurrency: int = EMOTION_MAX_CONCURRENCY,
+        timeout: float = EMOTION_TIMEOUT_SECONDS,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.url = url
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def predict(self, filename: str, payload: bytes) -> Optional[str]:
+        """
+        Prediksi emosi satu gambar JPEG.
+
+        Returns:
+            str | None: Label emosi, atau None jika gagal / circuit sedang OPEN.
+        """
+        if not payload or self._client is None:
+            return None
+
+        async with self._semaphore:
+            # Cek breaker SETELAH dapat slot agar request yang antre ikut berhenti saat OPEN
+            if not self.breaker.allow():
+                return None
+            try:
+                response = await self._client.post(
+                    self.url, files={'file': (filename, payload, 'image/jpeg')}
+                )
+            except asyncio.CancelledError:
+                # Probe yang dibatalkan tidak boleh mengunci breaker di HALF_OPEN
+                self.breaker.release()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.debug(f"Emotion: Request gagal untuk {filename} - {e}")
+                return None
+
+        if response.status_code == 200:
+            self.breaker.record_success()
+            try:
+                return response.json().get('predicted', DEFAULT_EMOTION)
+            except ValueError:
+                return None
+
+        # 5xx / 429 menandakan service bermasalah; 4xx lain adalah masalah input
+        if response.status_code >= 500 or response.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return None
+
+    async def predict_many(self, items: Dict[Hashable, Tuple[str, bytes]]) -> Dict[Hashable, str]:
+        """
+        Prediksi emosi untuk banyak sample secara paralel.
+
+        Args:
+            items (dict): { key : (filename, jpeg_bytes) }
+
+        Returns:
+            dict: { key : label_emosi } hanya untuk prediksi yang berhasil.
+        """
+        if not items:
+            return {}
+
+        keys = list(items.keys())
+        results = await asyncio.gather(
+            *(self.predict(*items[k]) for k in keys), return_exceptions=True
+        )
+        return {
+            k: r for k, r in zip(keys, results)
+            if isinstance(r, str)
+        }
+
+
+# ==============================================================================
+# EMOTION BACKENDS
+# ==============================================================================
+
+class EmotionBackend(abc.ABC):
+    """
+    Interface backend emosi. Setiap backend wajib mengimplementasikan predict_batch().
+
+    - runs_in_worker = True  : predict_batch() dipanggil di worker process
+                               setelah frame loop selesai (sinkron, CPU).
+    - runs_in_worker = False : predict_many() dipanggil di proses API (async).
+    """
+
+    name = "base"
+    runs_in_worker = False
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    def predict_batch(self, crops: List[np.ndarray]) -> List[Optional[str]]:
+        """Prediksi sinkron untuk banyak crop wajah BGR (urutan hasil = urutan crop)."""
+
+    async def predict_many(self, crops: Dict[Hashable, np.ndarray]) -> Dict[Hashable, str]:
+        """
+        Prediksi emosi untuk banyak crop wajah BGR.
+
+        Returns:
+            dict: { key : label_emosi } hanya untuk prediksi yang berhasil.
+        """
+        keys = list(crops.keys())
+        labels = await asyncio.to_thread(self.predict_batch, [crops[k] for k in keys])
+        return {k: label for k, label in zip(keys, labels) if label}
+
+    async def predict_encoded(self, payloads: Dict[Hashable, bytes]) -> Dict[Hashable, str]:
+        """
+        Prediksi emosi dari crop yang sudah di-encode JPEG (lihat video_engine.CropSink).
+        Default: decode lalu predict_many; backend remote mengirim bytes apa adanya.
+        """
+        crops = {}
+        for key, payload in payloads.items():
+            crop = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR) if payload else None
+            if crop is not None:
+                crops[key] = crop
+        return await self.predict_many(crops) if crops else {}
+
+    def status(self) -> Dict[str, object]:
+        return {"backend": self.name}
+
+
+class DisabledEmotionBackend(EmotionBackend):
+    """Backend 'none': analisis emosi dimatikan."""
+
+    name = "none"
+
+    def predict_batch(self, crops: List[np.ndarray]) -> List[Optional[str]]:
+        return [None] * len(crops)
+
+    async def predict_many(self, crops: Dict[Hashable, np.ndarray]) -> Dict[Hashable, str]:
+        return {}
+
+    async def predict_encoded(self, payloads: Dict[Hashable, bytes]) -> Dict[Hashable, str]:
+        return {}
+
+
+class RemoteEmotionBackend(EmotionBackend):
+    """Backend 'remote': kompres crop ke JPEG lalu kirim paralel lewat EmotionClient."""
+
+    name = "remote"
+
+    def __init__(self, client: Optional[EmotionClient] = None):
+        self.client = client or EmotionClient()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.client.start()
+
+    def predict_batch(self, crops: List[np.ndarray]) -> List[Optional[str]]:
+        """
+        Versi sinkron untuk pemanggil di thread lain (misal asyncio.to_thread):
+        request tetap dikirim lewat client bersama di event loop API.
+        """
+        if self._loop is None or self._loop.is_closed():
+            return [None] * len(crops)
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            raise RuntimeError("predict_batch memblokir event loop; gunakan predict_many")
+
+        valid = {i: crop for i, crop in enumerate(crops) if crop is not None and crop.size > 0}
+        labels = asyncio.run_coroutine_threadsafe(self.predict_many(valid), self._loop).result()
+        return [labels.get(i) for i in range(len(crops))]
+
+    async def close(self):
+        await self.client.close()
+
+    async def predict_many(self, crops: Dict[Hashable, np.ndarray]) -> Dict[Hashable, str]:
+        payloads = {
+            key: (f"{key}.jpg", compress_image_to_bytes(crop))
+            for key, crop in crops.items()
+        }
+        return await self.client.predict_many(payloads)
+
+    async def predict_encoded(self, payloads: Dict[Hashable, bytes]) -> Dict[Hashable, str]:
+        # Bytes JPEG dari CropSink dipakai ulang tanpa encode kedua
+        return await self.client.predict_many({
+            key: (f"{key}.jpg", payload) for key, payload in payloads.items() if payload
+        })
+
+    def status(self) -> Dict[str, object]:
+        return {"backend": self.name, **self.client.breaker.snapshot()}
+
+
+class LocalOnnxEmotionBackend(EmotionBackend):
+    """
+    Backend 'local': klasifikasi emosi dengan ONNX Runtime (CPU).
+
+    Bentuk input dibaca dari model (N, C, H, W). C = 1 -> grayscale, C = 3 -> RGB.
+    Semua crop diproses dalam satu session.run jika dimensi batch dinamis.
+    """
+
+    name = "local"
+    runs_in_worker = True
+
+    def __init__(
+        self,
+        model_path: str = EMOTION_ONNX_MODEL_PATH,
+        labels: Optional[List[str]] = None,
+        intra_op_threads: int = EMOTION_ONNX_THREADS
+    ):
+        import onnxruntime as ort
+
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = max(1, intra_op_threads)
+        self.session = ort.InferenceSession(
+            model_path, sess_options=sess_options, providers=['CPUExecutionProvider']
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        _, channels, height, width = model_input.shape
+        self.channels = channels if isinstance(channels, int) else 3
+        self.height = height if isinstance(height, int) else 64
+        self.width = width if isinstance(width, int) else 64
+        self.batchable = not isinstance(model_input.shape[0], int) or model_input.shape[0] != 1
+        self.labels = labels or EMOTION_ONNX_LABELS
+        logger.info(f"Emotion: Model lokal dimuat dari {model_path} ({self.channels}x{self.height}x{self.width})")
+
+    def _preprocess(self, crop: np.ndarray) -> np.ndarray:
+        img = cv2.resize(crop, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        if self.channels == 1:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)[None, :, :]
+        else:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).transpose(2, 0, 1)
+        img = img.astype(np.float32)
+        if EMOTION_ONNX_NORMALIZE == "unit":
+            img /= 255.0
+        return img
+
+    def predict_batch(self, crops: List[np.ndarray]) -> List[Optional[str]]:
+        valid = [i for i, c in enumerate(crops) if c is not None and c.size > 0]
+        results: List[Optional[str]] = [None] * len(crops)
+        if not valid:
+            return results
+
+        blob = np.stack([self._preprocess(crops[i]) for i in valid])
+        try:
+            if self.batchable:
+                logits = self.session.run(None, {self.input_name: blob})[0]
+            else:
+                logits = np.vstack([self.session.run(None, {self.input_name: blob[i:i + 1]})[0] for i in range(len(blob))])
+        except Exception as e:
+            logger.error(f"Emotion: Inferensi lokal gagal - {e}")
+            return results
+
+        for i, class_idx in zip(valid, np.argmax(logits.reshape(len(valid), -1), axis=1)):
+            results[i] = self.labels[class_idx] if class_idx < len(self.labels) else DEFAULT_EMOTION
+        return results
+
+
+class WorkerEmotionBackend(DisabledEmotionBackend):
+    """Penanda di proses API: prediksi dilakukan oleh backend lokal di worker process."""
+
+    name = "local"
+    runs_in_worker = True
+
+
+def create_emotion_backend(name: str = EMOTION_BACKEND, in_worker: bool = False) -> Optional[EmotionBackend]:
+    """
+    Factory backend emosi berdasarkan konfigurasi.
+
+    Args:
+        name (str): 'remote', 'local', atau 'none'.
+        in_worker (bool): True jika dipanggil dari worker process.
+
+    Returns:
+        EmotionBackend | None: Di worker, hanya backend yang runs_in_worker yang dibuat
+        (None untuk backend lain). Backend lokal yang gagal dimuat diganti 'none'.
+    """
+    if name == "local":
+        if not in_worker:
+            return WorkerEmotionBackend()
+        try:
+            return LocalOnnxEmotionBackend()
+        except Exception as e:
+            logger.error(f"Emotion: Gagal memuat backend lokal, emosi dinonaktifkan - {e}")
+            return None
+    if in_worker:
+        return None
+    if name == "none":
+        return DisabledEmotionBackend()
+    return RemoteEmotionBackend()
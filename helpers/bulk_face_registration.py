@@ -22,6 +22,16 @@ from pathlib import Path
 import numpy as np
 import cv2
 from insightface.app import FaceAnalysis
+
+from video_engine import (
+    INSIGHTFACE_MODEL_NAME,
+    INSIGHTFACE_MODULES,
+    INSIGHTFACE_REQUIRED_MODULES,
+    VIDEO_CASCADE_ENABLED,
+    VIDEO_CASCADE_LIGHT_MODEL,
+    create_light_recognizer,
+    light_face_embedding,
+)
 from pydantic import BaseModel, Field
 from passlib.context import CryptContext
 
@@ -145,15 +155,26 @@ class BulkFaceProcessor:
         """
         self.db_session = db_session
         
-        # Initialize InsightFace model (buffalo_l)
-        print("🔄 Loading InsightFace model (buffalo_l)...")
+        # Initialize InsightFace model (INSIGHTFACE_MODEL_NAME, same as the API/workers), only the whitelisted modules
+        # (default: detection + recognition; landmark/genderage are not used here)
+        missing = [m for m in INSIGHTFACE_REQUIRED_MODULES if m not in INSIGHTFACE_MODULES]
+        if missing:
+            raise ValueError(f"INSIGHTFACE_MODULES must include {', '.join(missing)}")
+        print(f"🔄 Loading InsightFace model ({INSIGHTFACE_MODEL_NAME}, modules: {', '.join(INSIGHTFACE_MODULES)})...")
         self.face_app = FaceAnalysis(
-            name='buffalo_l',
-            providers=['CPUExecutionProvider']  # Use GPU if available
+            name=INSIGHTFACE_MODEL_NAME,
+            providers=['CPUExecutionProvider'],  # Use GPU if available
+            allowed_modules=INSIGHTFACE_MODULES
         )
         self.face_app.prepare(ctx_id=0, det_size=(640, 640))
         print("✅ InsightFace model loaded successfully")
         
+        # Light recognition model for cascade mode (Mahasiswa.embedding_light)
+        self.light_rec_model = None
+        if VIDEO_CASCADE_ENABLED:
+            print(f"🔄 Loading cascade light model ({VIDEO_CASCADE_LIGHT_MODEL})...")
+            self.light_rec_model = create_light_recognizer(providers=['CPUExecutionProvider'])
+        
         # Supported image formats
         self.supported_formats = {'.jpg', '.jpeg', '.png', '.bmp'}
     
@@ -196,6 +217,7 @@ class BulkFaceProcessor:
             Dict dengan keys: 
                 - faces_detected: jumlah wajah terdeteksi
                 - embedding: numpy array embedding (jika 1 wajah)
+                - embedding_light: embedding model ringan cascade (jika aktif)
                 - error: pesan error (jika ada)
         """
         try:
@@ -234,9 +256,15 @@ class BulkFaceProcessor:
                 face = faces[0]
                 embedding = face.normed_embedding  # 512-dimensional vector
                 
+                # Same alignment (kps) as the main model; BGR like video frames
+                embedding_light = None
+                if self.light_rec_model is not None:
+                    embedding_light = light_face_embedding(self.light_rec_model, img, face)
+                
                 return {
                     'faces_detected': 1,
                     'embedding': embedding,
+                    'embedding_light': embedding_light,
                     'error': None
                 }
         
@@ -247,7 +275,28 @@ class BulkFaceProcessor:
                 'error': f'Processing error: {str(e)}'
             }
     
-    async def save_to_database(self, nim: str, embedding: np.ndarray) -> Tuple[bool, str]:
+    async def _save_light_embedding(self, nim: str, embedding_light_list: Optional[list]):
+        """
+        Write Mahasiswa.embedding_light (cascade mode only). The column is not mapped
+        to the ORM, so it is written with a Core UPDATE; requires
+        helpers/migrate_light_embedding.py on existing databases.
+        """
+        if embedding_light_list is None:
+            return
+        from models import Mahasiswa
+        from sqlalchemy import update
+        
+        table = Mahasiswa.__table__
+        await self.db_session.execute(
+            update(table).where(table.c.nim == nim).values(embedding_light=embedding_light_list)
+        )
+    
+    async def save_to_database(
+        self,
+        nim: str,
+        embedding: np.ndarray,
+        embedding_light: Optional[np.ndarray] = None
+    ) -> Tuple[bool, str]:
         """
         Save or update mahasiswa record with face embedding AND create user account.
         
@@ -263,6 +312,7 @@ class BulkFaceProcessor:
         Args:
             nim: Student ID
             embedding: Face embedding vector (512-dim)
+            embedding_light: Light-model embedding for cascade recognition (optional)
             
         Returns:
             Tuple[bool, str]: (success, operation_type)
@@ -275,6 +325,7 @@ class BulkFaceProcessor:
             
             # Convert numpy array to list for pgvector
             embedding_list = embedding.tolist()
+            embedding_light_list = embedding_light.tolist() if embedding_light is not None else None
             
             # Generate password
             plain_password = generate_default_password(nim)
@@ -289,6 +340,7 @@ class BulkFaceProcessor:
                 # UPDATE EXISTING RECORD
                 # Update embedding only (user already exists)
                 mahasiswa.embedding_data = embedding_list
+                await self._save_light_embedding(nim, embedding_light_list)
                 await self.db_session.commit()
                 print(f"  ✏️  Updated embedding for NIM: {nim}")
                 return True, 'updated'
@@ -320,6 +372,8 @@ class BulkFaceProcessor:
                     embedding_data=embedding_list
                 )
                 self.db_session.add(new_mahasiswa)
+                await self.db_session.flush()
+                await self._save_light_embedding(nim, embedding_light_list)
                 
                 # Step 4: COMMIT TRANSACTION (Atomic - both or none)
                 await self.db_session.commit()
@@ -432,7 +486,9 @@ class BulkFaceProcessor:
                 
                 else:
                     # SUCCESS - AI validation passed, CREATE user + Save embedding (ATOMIC)
-                    db_success, operation_type = await self.save_to_database(nim, embedding)
+                    db_success, operation_type = await self.save_to_database(
+                        nim, embedding, detection_result.get('embedding_light')
+                    )
                     
                     if db_success:
                         success_count += 1
@@ -0,0 +1,43 @@
+"""
+Stub Server API Emosi (Pengujian Lokal)
+=======================================
+Meniru endpoint /predict_face milik HF Space agar EmotionClient bisa diuji
+tanpa koneksi internet, termasuk skenario lambat dan error (circuit breaker).
+
+Cara pakai:
+    uvicorn emotion_stub_server:app --port 9000
+    EMOTION_API_URL=http://127.0.0.1:9000/predict_face uvicorn main:app
+
+Konfigurasi via environment variable:
+    STUB_LATENCY_S    : Delay setiap response (detik)
+    STUB_FAILURE_RATE : Probabilitas response 503 (0.0 - 1.0)
+"""
+import os
+import random
+import asyncio
+from fastapi import FastAPI, UploadFile, File
+from fastapi.responses import JSONResponse
+
+# ================= KONFIGURASI =================
+STUB_LATENCY_S = float(os.getenv("STUB_LATENCY_S", "0.2"))
+STUB_FAILURE_RATE = float(os.getenv("STUB_FAILURE_RATE", "0.0"))
+LABELS = ["happy", "neutral", "sad", "surprise", "angry"]
+
+app = FastAPI(title="Emotion API Stub")
+stats = {"requests": 0, "failures": 0}
+
+@app.post("/predict_face")
+async def predict_face(file: UploadFile = File(...)):
+    stats["requests"] += 1
+    await file.read()
+    await asyncio.sleep(STUB_LATENCY_S)
+
+    if random.random() < STUB_FAILURE_RATE:
+        stats["failures"] += 1
+        return JSONResponse({"error": "stub failure"}, status_code=503)
+
+    return {"predicted": random.choice(LABELS)}
+
+@app.get("/stats")
+async def get_stats():
+    return stats
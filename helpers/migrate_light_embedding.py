@@ -0,0 +1,81 @@
+"""
+Migration script untuk galeri cascade recognition (Mahasiswa.embedding_light).
+Base.metadata.create_all tidak menambah kolom baru ke tabel yang sudah ada,
+sehingga script ini perlu dijalankan sekali pada database existing.
+
+Foto registrasi tidak disimpan server, sehingga embedding model ringan untuk
+mahasiswa lama diisi dari direktori foto (penamaan sama dengan ZIP bulk registration):
+
+    python helpers/migrate_light_embedding.py                      # kolom saja
+    python helpers/migrate_light_embedding.py --photos foto_mhs/   # kolom + backfill
+
+Cascade hanya dipakai untuk jadwal yang SEMUA kandidatnya punya embedding_light;
+jadwal dengan mahasiswa tanpa embedding_light dianalisis dengan model utama saja.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import argparse
+import cv2
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import text, select, update
+from database import DATABASE_URL
+from models import Mahasiswa
+
+async def migrate_light_embedding(photos_dir=None):
+    engine = create_async_engine(DATABASE_URL, echo=True)
+
+    async with engine.begin() as conn:
+        print("\n🔄 Step 1: Adding embedding_light to mahasiswa...")
+        await conn.execute(text("""
+            ALTER TABLE mahasiswa
+            ADD COLUMN IF NOT EXISTS embedding_light vector(512)
+        """))
+        print("   ✅ Column embedding_light ready")
+
+    if photos_dir:
+        await backfill_light_embedding(engine, photos_dir)
+
+    await engine.dispose()
+    print("\n✅ Migration completed successfully!")
+
+async def backfill_light_embedding(engine, photos_dir):
+    from video_engine import create_face_app, create_light_recognizer, light_face_embedding, VIDEO_CASCADE_LIGHT_MODEL
+    from quantize_face_models import list_images, nim_from_filename, largest_face
+
+    print(f"\n🔄 Step 2: Backfill embedding_light ({VIDEO_CASCADE_LIGHT_MODEL}) dari {photos_dir}...")
+    face_app = create_face_app(providers=['CPUExecutionProvider'], int8_dir="")
+    light_rec = create_light_recognizer(providers=['CPUExecutionProvider'])
+
+    async with engine.begin() as conn:
+        registered = set((await conn.execute(
+            select(Mahasiswa.nim).where(Mahasiswa.embedding_data.isnot(None))
+        )).scalars().all())
+
+        updated = skipped = 0
+        for path in list_images(photos_dir, 0):
+            nim = nim_from_filename(path)
+            img = cv2.imread(path)
+            face = largest_face(face_app.get(img)) if img is not None and nim in registered else None
+            if face is None:
+                skipped += 1
+                continue
+            emb_light = light_face_embedding(light_rec, img, face)
+            table = Mahasiswa.__table__
+            await conn.execute(
+                update(table).where(table.c.nim == nim).values(embedding_light=emb_light.tolist())
+            )
+            updated += 1
+        print(f"   ✅ {updated} mahasiswa diperbarui, {skipped} foto dilewati (NIM tidak terdaftar / tanpa wajah)")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("CASCADE LIGHT EMBEDDING MIGRATION SCRIPT")
+    print("="*60)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", help="Direktori foto registrasi untuk backfill embedding_light")
+    args = parser.parse_args()
+    asyncio.run(migrate_light_embedding(args.photos))
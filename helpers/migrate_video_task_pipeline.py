@@ -0,0 +1,56 @@
+"""
+Migration script untuk kolom pipeline analisis video pada tabel video_tasks.
+Base.metadata.create_all tidak menambah kolom baru ke tabel yang sudah ada,
+sehingga script ini perlu dijalankan sekali pada database existing.
+
+Kolom:
+- checkpoint_data : Checkpoint analisis (frame terakhir + agregat parsial) untuk resume
+- profile_data    : Durasi & jumlah per tahap pipeline (decode, detection, ..., db_commit)
+- content_hash    : SHA-256 file video untuk deduplikasi upload ulang per jadwal
+- early_exit      : Mode fast attendance & titik berhenti analisis
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy import text
+from database import DATABASE_URL
+
+# (tabel, kolom, tipe SQL)
+NEW_COLUMNS = [
+    ("video_tasks", "checkpoint_data", "JSON"),
+    ("video_tasks", "profile_data", "JSON"),
+    ("video_tasks", "content_hash", "VARCHAR(64)"),
+    ("video_tasks", "early_exit", "JSON"),
+]
+
+async def migrate_video_task_pipeline():
+    engine = create_async_engine(DATABASE_URL, echo=True)
+    
+    async with engine.begin() as conn:
+        for step, (table, column, sql_type) in enumerate(NEW_COLUMNS, 1):
+            print(f"\n🔄 Step {step}: Adding {column} to {table}...")
+            await conn.execute(text(f"""
+                ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS {column} {sql_type}
+            """))
+            print(f"   ✅ Column {column} ready")
+        
+        print("\n🔄 Creating index on video_tasks (jadwal_id, content_hash)...")
+        await conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_video_tasks_jadwal_content_hash
+            ON video_tasks (jadwal_id, content_hash)
+        """))
+        print("   ✅ Index ready")
+    
+    await engine.dispose()
+    print("\n✅ Migration completed successfully!")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("VIDEO TASK PIPELINE MIGRATION SCRIPT")
+    print("="*60)
+    asyncio.run(migrate_video_task_pipeline())
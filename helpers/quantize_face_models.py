@@ -0,0 +1,345 @@
+"""
+Kuantisasi INT8 Model InsightFace (Deployment CPU)
+==================================================
+Membuat varian INT8 model deteksi (SCRFD) dan recognition (ArcFace) dari model
+pack, lalu memvalidasi drift embedding terhadap FP32 sebelum dipakai produksi.
+
+Cara pakai:
+    # 1. Kuantisasi (static = dikalibrasi dengan foto wajah, dynamic = tanpa kalibrasi)
+    python helpers/quantize_face_models.py quantize --images foto_kalibrasi/ --out models_ai/buffalo_l_int8
+
+    # 2. Validasi: cosine drift FP32 vs INT8 + kecocokan identifikasi terhadap galeri terdaftar
+    python helpers/quantize_face_models.py validate --images foto_validasi/ --out models_ai/buffalo_l_int8
+
+    # 3. Aktifkan di server
+    INSIGHTFACE_INT8_DIR=models_ai/buffalo_l_int8 uvicorn main:app
+
+Foto validasi sebaiknya dinamai dengan NIM (format sama dengan ZIP bulk registration,
+misal A11.2025.16442.jpg) agar skor genuine terhadap embedding galeri ikut dihitung.
+Exit code 1 jika validasi gagal (drift melebihi batas / identifikasi berubah).
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from video_engine import (
+    create_face_app,
+    match_embedding,
+    BatchedFaceAnalyzer,
+    INSIGHTFACE_MODEL_NAME,
+)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp'}
+
+# Sama dengan FACE_SIMILARITY_THRESHOLD di main.py
+DEFAULT_THRESHOLD = 0.50
+
+
+# ================= DATA =================
+
+def list_images(image_dir: str, limit: int) -> List[str]:
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, files in os.walk(image_dir)
+        for name in files
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    )
+    return paths[:limit] if limit > 0 else paths
+
+
+def nim_from_filename(path: str) -> str:
+    """Aturan penamaan sama dengan BulkFaceProcessor.extract_nim_from_filename."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for part in stem.split('_'):
+        if 'A11.' in part.upper():
+            return part.upper()
+    return stem
+
+
+def largest_face(faces: list):
+    if not faces:
+        return None
+    return max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
+
+
+def aligned_crop(face_app, img: np.ndarray, face) -> np.ndarray:
+    from insightface.utils import face_align
+    rec = face_app.models['recognition']
+    return face_align.norm_crop(img, landmark=face.kps, image_size=rec.input_size[0])
+
+
+def collect_calibration_inputs(image_paths: List[str]) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """
+    Input kalibrasi per model, dipreproses persis seperti saat inferensi:
+    - detection  : frame di-letterbox ke det_size
+    - recognition: crop wajah 112x112 yang sudah di-align (deteksi FP32)
+    """
+    face_app = create_face_app(providers=['CPUExecutionProvider'], int8_dir="")
+    analyzer = BatchedFaceAnalyzer(face_app)
+    det, rec = face_app.det_model, face_app.models['recognition']
+
+    det_inputs, rec_inputs = [], []
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            print(f"   ⚠️ Skip (tidak bisa dibaca): {path}")
+            continue
+        det_img, _ = analyzer._letterbox(img)
+        det_inputs.append(cv2.dnn.blobFromImage(
+            det_img, 1.0 / det.input_std, analyzer.input_size,
+            (det.input_mean, det.input_mean, det.input_mean), swapRB=True
+        ))
+        face = largest_face(face_app.get(img))
+        if face is not None:
+            crop = aligned_crop(face_app, img, face)
+            rec_inputs.append(cv2.dnn.blobFromImage(
+                crop, 1.0 / rec.input_std, rec.input_size,
+                (rec.input_mean, rec.input_mean, rec.input_mean), swapRB=True
+            ))
+    return det_inputs, rec_inputs
+
+
+class BlobCalibrationReader:
+    """CalibrationDataReader ONNX Runtime dari list blob (1, 3, H, W)."""
+
+    def __init__(self, input_name: str, blobs: List[np.ndarray]):
+        self.input_name = input_name
+        self.blobs = iter(blobs)
+
+    def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+        blob = next(self.blobs, None)
+        return None if blob is None else {self.input_name: blob}
+
+    def rewind(self):
+        pass
+
+
+# ================= QUANTIZE =================
+
+def quantize_models(args):
+    from onnxruntime.quantization import (
+        quantize_dynamic, quantize_static, QuantType, QuantFormat, CalibrationMethod
+    )
+
+    os.makedirs(args.out, exist_ok=True)
+    face_app = create_face_app(providers=['CPUExecutionProvider'], int8_dir="")
+    modules = [m for m in args.modules.split(",") if m in face_app.models]
+
+    calib = {}
+    if args.mode == "static":
+        image_paths = list_images(args.images, args.max_images)
+        print(f"\n🔄 Menyiapkan data kalibrasi dari {len(image_paths)} foto...")
+        det_inputs, rec_inputs = collect_calibration_inputs(image_paths)
+        calib = {"detection": det_inputs, "recognition": rec_inputs}
+        print(f"   ✅ detection: {len(det_inputs)} frame, recognition: {len(rec_inputs)} wajah")
+
+    for taskname in modules:
+        model = face_app.models[taskname]
+        src = model.model_file
+        dst = os.path.join(args.out, os.path.basename(src))
+        print(f"\n🔄 {taskname}: {src} -> {dst} ({args.mode})")
+
+        if args.mode == "dynamic":
+            quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+        else:
+            if not calib[taskname]:
+                print(f"   ❌ Tidak ada data kalibrasi untuk {taskname}, dilewati")
+                continue
+            prepared = dst + ".prep.onnx"
+            try:
+                from onnxruntime.quantization.shape_inference import quant_pre_process
+                quant_pre_process(src, prepared)
+            except Exception as e:
+                print(f"   ⚠️ quant_pre_process gagal, pakai model asli - {e}")
+                prepared = src
+            quantize_static(
+                prepared, dst,
+                BlobCalibrationReader(model.session.get_inputs()[0].name, calib[taskname]),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+            if prepared != src and os.path.exists(prepared):
+                os.remove(prepared)
+
+        size_src, size_dst = os.path.getsize(src), os.path.getsize(dst)
+        print(f"   ✅ {size_src / 1e6:.1f} MB -> {size_dst / 1e6:.1f} MB")
+
+    print(f"\n✅ Selesai. Jalankan 'validate' sebelum mengaktifkan INSIGHTFACE_INT8_DIR={args.out}")
+
+
+# ================= VALIDATE =================
+
+async def load_gallery() -> Tuple[List[str], Optional[np.ndarray]]:
+    """Embedding terdaftar (FP32) dari tabel mahasiswa, dinormalisasi L2 seperti di main.py."""
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from database import DATABASE_URL
+    from models import Mahasiswa
+
+    engine = create_async_engine(DATABASE_URL)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(
+            select(Mahasiswa.nim, Mahasiswa.embedding_data).where(Mahasiswa.embedding_data.isnot(None))
+        )).all()
+    await engine.dispose()
+
+    ids, vectors = [], []
+    for nim, embedding_val in rows:
+        emb = np.array(embedding_val, dtype=np.float32)
+        ids.append(nim)
+        vectors.append(emb / np.linalg.norm(emb))
+    return ids, (np.array(vectors) if vectors else None)
+
+
+def cosine(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def bbox_iou(a: np.ndarray, b: np.ndarray) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def describe(values: List[float]) -> str:
+    if not values:
+        return "-"
+    arr = np.array(values)
+    return f"mean {arr.mean():.4f} | p5 {np.percentile(arr, 5):.4f} | min {arr.min():.4f}"
+
+
+def validate_models(args):
+    image_paths = list_images(args.images, args.max_images)
+    print(f"\n🔄 Memuat model FP32 & INT8 ({args.out})...")
+    fp32_app = create_face_app(providers=['CPUExecutionProvider'], int8_dir="")
+    int8_app = create_face_app(providers=['CPUExecutionProvider'], int8_dir=args.out)
+    rec32, rec8 = fp32_app.models['recognition'], int8_app.models['recognition']
+
+    known_ids, known_matrix = [], None
+    if not args.no_gallery:
+        known_ids, known_matrix = asyncio.run(load_gallery())
+        print(f"   ✅ Galeri: {len(known_ids)} embedding terdaftar")
+
+    rec_drift, e2e_drift, det_iou = [], [], []
+    genuine32, genuine8 = [], []
+    det_count_mismatch = id_total = id_changed = flipped = 0
+
+    print(f"\n🔄 Validasi {len(image_paths)} foto...")
+    for path in image_paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        faces32 = fp32_app.get(img)
+        face32 = largest_face(faces32)
+        if face32 is None:
+            continue
+
+        # Recognition saja: crop identik, hanya model ArcFace yang berbeda
+        crop = aligned_crop(fp32_app, img, face32)
+        emb32 = rec32.get_feat(crop).flatten()
+        rec_drift.append(cosine(emb32, rec8.get_feat(crop).flatten()))
+
+        # End-to-end: deteksi + alignment + recognition INT8
+        faces8 = int8_app.get(img)
+        if len(faces8) != len(faces32):
+            det_count_mismatch += 1
+        if not faces8:
+            continue
+        face8 = max(faces8, key=lambda f: bbox_iou(face32.bbox, f.bbox))
+        det_iou.append(bbox_iou(face32.bbox, face8.bbox))
+        e2e_drift.append(cosine(face32.embedding, face8.embedding))
+
+        if known_matrix is not None:
+            nim32, score32 = match_embedding(known_matrix, known_ids, face32.embedding, args.threshold)
+            nim8, score8 = match_embedding(known_matrix, known_ids, face8.embedding, args.threshold)
+            id_total += 1
+            if nim32 != nim8:
+                id_changed += 1
+                # Khusus: lolos threshold di FP32 tetapi tidak di INT8 (atau sebaliknya)
+                if (nim32 == "Unknown") != (nim8 == "Unknown"):
+                    flipped += 1
+
+            nim = nim_from_filename(path)
+            if nim in known_ids:
+                row = known_matrix[known_ids.index(nim)]
+                genuine32.append(cosine(face32.embedding, row))
+                genuine8.append(cosine(face8.embedding, row))
+
+    print("\n" + "=" * 60)
+    print(f"Model pack            : {INSIGHTFACE_MODEL_NAME}")
+    print(f"Cosine FP32 vs INT8   : recognition {describe(rec_drift)}")
+    print(f"                        end-to-end  {describe(e2e_drift)}")
+    print(f"IoU bbox deteksi      : {describe(det_iou)}")
+    print(f"Jumlah wajah berbeda  : {det_count_mismatch} foto")
+    if id_total:
+        print(f"Identifikasi berubah  : {id_changed}/{id_total} (lintas threshold {args.threshold}: {flipped})")
+    if genuine32:
+        print(f"Skor genuine galeri   : FP32 {describe(genuine32)}")
+        print(f"                        INT8 {describe(genuine8)}")
+        below = sum(1 for s32, s8 in zip(genuine32, genuine8) if s32 > args.threshold >= s8)
+        print(f"Genuine jatuh < thr   : {below}/{len(genuine32)}")
+    print("=" * 60)
+
+    failures = []
+    if not rec_drift:
+        failures.append("tidak ada wajah yang bisa divalidasi")
+    elif np.percentile(rec_drift, 5) < args.min_cosine:
+        failures.append(f"p5 cosine recognition < {args.min_cosine}")
+    if id_changed > args.max_id_changes:
+        failures.append(f"{id_changed} identifikasi berubah (maks {args.max_id_changes})")
+
+    if failures:
+        print(f"\n❌ INT8 TIDAK LOLOS: {'; '.join(failures)}")
+        sys.exit(1)
+    print(f"\n✅ INT8 lolos. Aktifkan dengan INSIGHTFACE_INT8_DIR={args.out}")
+
+
+# ================= CLI =================
+
+def main():
+    parser = argparse.ArgumentParser(description="Kuantisasi & validasi INT8 model InsightFace")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("quantize", "validate"):
+        p = sub.add_parser(name)
+        p.add_argument("--images", required=(name == "validate"), help="Direktori foto wajah (kalibrasi / validasi)")
+        p.add_argument("--out", default=os.path.join("models_ai", f"{INSIGHTFACE_MODEL_NAME}_int8"))
+        p.add_argument("--max-images", type=int, default=300)
+
+    q = sub.choices["quantize"]
+    q.add_argument("--mode", choices=("static", "dynamic"), default="static")
+    q.add_argument("--modules", default="detection,recognition")
+
+    v = sub.choices["validate"]
+    v.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    v.add_argument("--min-cosine", type=float, default=0.98, help="Batas p5 cosine FP32 vs INT8 (recognition)")
+    v.add_argument("--max-id-changes", type=int, default=0)
+    v.add_argument("--no-gallery", action="store_true", help="Lewati perbandingan dengan galeri database")
+
+    args = parser.parse_args()
+    if args.command == "quantize":
+        if args.mode == "static" and not args.images:
+            parser.error("--images wajib untuk kuantisasi static (data kalibrasi)")
+        quantize_models(args)
+    else:
+        validate_models(args)
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("INSIGHTFACE INT8 QUANTIZATION")
+    print("=" * 60)
+    main()
@@ -41,19 +41,24 @@ CHANGELOG (v6.0.0):
 
 import os
 import cv2
+import signal
+import glob
 import uuid
 import time
-import httpx
+import hashlib
 import shutil
 import logging
 import asyncio
 import aiofiles
+import threading
+import multiprocessing
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta, date
 from typing import List, Optional, Union, Dict, Any, Tuple
 from collections import defaultdict
 from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 
 # --- FASTAPI CORE & UTILITIES ---
 from fastapi import (
@@ -61,7 +66,6 @@ from fastapi import (
     UploadFile, 
     File, 
     Form, 
-    BackgroundTasks, 
     Depends, 
     HTTPException, 
     status, 
@@ -84,22 +88,11 @@ from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 
-# --- AI & COMPUTER VISION LIBRARIES ---
-try:
-    from insightface.app import FaceAnalysis
-except ImportError as e:
-    print(f"CRITICAL ERROR: Failed to import InsightFace. {e}")
-    # Dummy class to prevent IDE errors during development without GPU
-    class FaceAnalysis:
-        def __init__(self, **kwargs): pass
-        def prepare(self, **kwargs): pass
-        def get(self, img): return []
-
 # --- DATABASE DRIVERS & ORM ---
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import joinedload, selectinload
-from sqlalchemy import desc, update, delete, func, and_, or_
+from sqlalchemy import desc, insert, update, delete, case, func, and_, or_, inspect
 from sqlalchemy.exc import (
     IntegrityError, 
     SQLAlchemyError, 
@@ -120,6 +113,34 @@ from models import (
     KelasEnrollment,  # For student class enrollment
     StudentClass  # NEW: Student class groups (A11.4109, etc)
 )
+from video_engine import (
+    init_analysis_worker,
+    run_video_analysis_job,
+    VIDEO_WORKER_COUNT,
+    WORKER_MSG_PROGRESS,
+    WORKER_MSG_CHECKPOINT,
+    WORKER_MSG_STARTED,
+    upload_marker_path,
+    is_streamable_upload,
+    StageProfiler,
+    FaceSessionPool,
+    AnalysisCancelled,
+    cancel_marker_path,
+    plan_video_segments,
+    merge_segment_results,
+    room_roi,
+    VIDEO_ROOM_ROI,
+    create_light_recognizer,
+    light_face_embedding,
+    VIDEO_CASCADE_ENABLED,
+    VIDEO_CASCADE_LIGHT_MODEL,
+    INSIGHTFACE_MODEL_NAME,
+    VIDEO_SEGMENT_PARALLEL
+)
+from emotion_service import (
+    EmotionBackend,
+    create_emotion_backend
+)
 from auth_utils import (
     get_password_hash, 
     verify_password, 
@@ -243,9 +264,14 @@ async def add_process_time_header(request: Request, call_next):
     return response
 
 # Konstanta Konfigurasi AI & Eksternal
-API_EMOTION_URL = "https://risetkami-risetkami.hf.space/predict_face"
 FACE_SIMILARITY_THRESHOLD = 0.50  # Ambang batas kemiripan wajah (Cosine Similarity)
-VIDEO_PROCESSING_FRAME_SKIP = 30  # Skip frame untuk optimasi (Analisis per 1 detik jika FPS=30)
+VIDEO_PROCESSING_FRAME_SKIP = int(os.getenv("VIDEO_PROCESSING_FRAME_SKIP", "30"))  # Interval frame kandidat (1 detik jika FPS=30)
+# Identifikasi hanya terhadap mahasiswa enrolled di jadwal ('jadwal') atau seluruh kampus ('global')
+VIDEO_IDENTIFY_SCOPE = os.getenv("VIDEO_IDENTIFY_SCOPE", "jadwal").lower()
+VIDEO_IDENTIFY_GLOBAL_FALLBACK = os.getenv("VIDEO_IDENTIFY_GLOBAL_FALLBACK", "false").lower() == "true"  # Wajah tak dikenal dicek ke galeri global (tamu)
+# Batas tunggu (detik) job analisis yang sedang berjalan berhenti saat shutdown sebelum worker di-terminate
+VIDEO_SHUTDOWN_GRACE_S = float(os.getenv("VIDEO_SHUTDOWN_GRACE_S", "15"))
+VIDEO_STREAM_MIN_BYTES = int(os.getenv("VIDEO_STREAM_MIN_BYTES", str(4 * 1024 * 1024)))  # Byte minimal sebelum analisis streaming dimulai
 
 # ==============================================================================
 # [SECTION 2] GLOBAL STATE MANAGEMENT (SINGLETON CACHE)
@@ -260,8 +286,33 @@ class SystemStateManager:
         # Cache status upload video (Task ID -> Status Dict)
         self.tasks_db: Dict[str, Dict[str, Any]] = {}
         
-        # Instance Model InsightFace (Berat, hanya load sekali saat startup)
-        self.face_app: Optional[FaceAnalysis] = None 
+        # Pool Instance Model InsightFace (Berat, hanya load sekali saat startup)
+        # Checkout/return per request agar inferensi konkuren tidak berebut satu session
+        self.face_pool: Optional[FaceSessionPool] = None 
+        
+        # === WORKER POOL ANALISIS VIDEO ===
+        # Process pool (tiap worker memegang session InsightFace sendiri)
+        self.analysis_pool: Optional[ProcessPoolExecutor] = None
+        # Antrian Task ID yang menunggu worker
+        self.analysis_queue: Optional[asyncio.Queue] = None
+        # Parameter job per Task ID (tidak diekspos lewat /status)
+        self.pending_jobs: Dict[str, Dict[str, Any]] = {}
+        # Sesi streaming upload yang sudah dibuat tapi body-nya belum dikirim
+        self.pending_uploads: Dict[str, Dict[str, Any]] = {}
+        # Progress per segmen untuk task yang diproses segment-parallel (Task ID -> [pct])
+        self.segment_progress: Dict[str, List[int]] = {}
+        # Backend analisis emosi (remote API / ONNX lokal di worker / none), lihat EMOTION_BACKEND
+        self.emotion_backend: EmotionBackend = create_emotion_backend()
+        
+        # Channel progress & checkpoint dari worker process -> proses API
+        self.progress_queue = None
+        # Sinyal shutdown ke worker process (job berjalan berhenti di batas batch berikutnya)
+        self.worker_stop_event = None
+        # PID worker process (dilaporkan initializer lewat progress_queue)
+        self.worker_pids: set = set()
+        self.dispatcher_tasks: List[asyncio.Task] = []
+        # Event loop utama (dipakai thread listener untuk menjadwalkan simpan checkpoint)
+        self.event_loop: Optional[asyncio.AbstractEventLoop] = None
         
         # List NIM Mahasiswa (Indexing untuk pencarian cepat)
         self.known_ids: List[str] = []
@@ -269,6 +320,14 @@ class SystemStateManager:
         # Matrix Vector Wajah (Numpy Array) untuk kalkulasi jarak cosine super cepat
         self.known_matrix: Optional[np.ndarray] = None 
         
+        # Galeri model ringan untuk cascade recognition (Mahasiswa.embedding_light)
+        self.known_ids_light: List[str] = []
+        self.known_matrix_light: Optional[np.ndarray] = None
+        # Model recognition ringan di proses API (embedding_light saat registrasi)
+        self.light_rec_model = None
+        # True jika kolom mahasiswa.embedding_light ada (helpers/migrate_light_embedding.py)
+        self.light_column_ready = False
+        
         # Metadata Status Sistem
         self.system_status: str = "STARTING"
         self.start_time: datetime = datetime.now()
@@ -316,6 +375,29 @@ class SystemStateManager:
             
         self.tasks_db[task_id].update(payload)
 
+    def update_upload_progress(self, task_id: str, upload_progress: Optional[int], bytes_received: Optional[int] = None):
+        """
+        Update progress upload (streaming ingest) tanpa mengubah status analisis.
+        upload_progress None = ukuran total tidak diketahui (tanpa Content-Length / chunked),
+        client menampilkan progress indeterminate dengan upload_bytes sebagai info.
+        """
+        task = self.tasks_db.setdefault(task_id, {})
+        task["upload_progress"] = upload_progress
+        if bytes_received is not None:
+            task["upload_bytes"] = bytes_received
+
+    def combined_progress(self, task_id: str, analysis_progress: int) -> int:
+        """
+        Progress gabungan upload + analisis.
+        Selama upload berjalan, worker melaporkan progress terhadap bagian file yang
+        sudah diterima, sehingga progress total = analisis x upload. Jika ukuran upload
+        tidak diketahui, progress analisis dipakai apa adanya (maks 99 sampai upload selesai).
+        """
+        upload_progress = self.tasks_db.get(task_id, {}).get("upload_progress", 100)
+        if upload_progress is None:
+            return min(analysis_progress, 99)
+        return int(analysis_progress * upload_progress / 100)
+
 # Inisialisasi State Global
 state = SystemStateManager()
 
@@ -421,77 +503,6 @@ class EnrollmentBulkSchema(BaseModel):
 # [SECTION 5] UTILITY & HELPER FUNCTIONS
 # ==============================================================================
 
-def compress_image_to_bytes(image_cv: np.ndarray, max_size: int = 224, quality: int = 60) -> bytes:
-    """
-    Fungsi utilitas untuk mengompresi gambar OpenCV (Numpy Array) menjadi bytes JPEG.
-    Digunakan sebelum mengirim gambar ke API Eksternal untuk menghemat bandwidth network.
-
-    Args:
-        image_cv (np.ndarray): Gambar input dalam format BGR.
-        max_size (int): Ukuran dimensi maksimum (lebar/tinggi).
-        quality (int): Kualitas kompresi JPEG (0-100).
-
-    Returns:
-        bytes: Data gambar terkompresi.
-    """
-    try:
-        h, w = image_cv.shape[:2]
-        # Resize logic jika gambar terlalu besar
-        if max(h, w) > max_size:
-            scale = max_size / max(h, w)
-            new_w, new_h = int(w * scale), int(h * scale)
-            image_cv = cv2.resize(image_cv, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        
-        # Encoding ke format JPG
-        success, encoded_img = cv2.imencode('.jpg', image_cv, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
-        if not success:
-            logger.warning("Image Utils: Failed to encode image.")
-            return b""
-        return encoded_img.tobytes()
-    except Exception as e:
-        logger.error(f"Image Utils: Error compressing image - {e}")
-        return b""
-
-def identify_face_fast(embedding: np.ndarray) -> tuple:
-    """
-    Algoritma pencarian wajah berkinerja tinggi menggunakan Operasi Matriks (Vectorization).
-    
-    Logic:
-    1. Normalisasi vector input.
-    2. Hitung Dot Product antara input vector dengan SEMUA vector di database sekaligus.
-    3. Ambil nilai maksimum (kemiripan tertinggi).
-    4. Bandingkan dengan Threshold.
-
-    Complexity: O(1) effective with Hardware Acceleration (NumPy).
-
-    Returns:
-        tuple: (NIM_Found, Similarity_Score) atau ("Unknown", 0.0)
-    """
-    # Cek ketersediaan database wajah
-    if state.known_matrix is None or len(state.known_ids) == 0:
-        return "Unknown", 0.0
-
-    try:
-        # Normalisasi L2 pada vector input
-        norm_emb = embedding / np.linalg.norm(embedding)
-        
-        # Matrix Multiplication (Dot Product) -> Cosine Similarity
-        # Shape: (N_Database, 512) dot (512,) -> (N_Database,)
-        scores = np.dot(state.known_matrix, norm_emb)
-        
-        # Cari index dengan score tertinggi
-        best_idx = np.argmax(scores)
-        max_score = scores[best_idx]
-        
-        # Cek apakah score memenuhi ambang batas (Threshold)
-        if max_score > FACE_SIMILARITY_THRESHOLD:
-            return state.known_ids[best_idx], float(max_score)
-        
-        return "Unknown", 0.0
-    except Exception as e:
-        logger.error(f"AI Module: Critical error in face identification - {e}")
-        return "Error", 0.0
-
 async def reload_face_database_async():
     """
     Fungsi Async untuk memuat ulang data vektor wajah dari Database PostgreSQL ke RAM.
@@ -502,17 +513,23 @@ async def reload_face_database_async():
     
     temp_ids = []
     temp_vectors = []
+    temp_light_ids = []
+    temp_light_vectors = []
     
     try:
         async with AsyncSessionLocal() as db:
             # Mengambil hanya data yang memiliki embedding (wajah terdaftar)
-            stmt = select(Mahasiswa.nim, Mahasiswa.embedding_data).where(
-                Mahasiswa.embedding_data.isnot(None)
-            )
+            columns = [Mahasiswa.nim, Mahasiswa.embedding_data]
+            # Kolom embedding_light hanya dibaca jika cascade aktif DAN kolomnya sudah dimigrasi
+            if VIDEO_CASCADE_ENABLED and state.light_column_ready:
+                columns.append(Mahasiswa.__table__.c.embedding_light)
+            stmt = select(*columns).where(Mahasiswa.embedding_data.isnot(None))
             result = await db.execute(stmt)
             rows = result.all()
             
-            for nim, embedding_val in rows:
+            for row in rows:
+                nim, embedding_val = row[0], row[1]
+                light_val = row[2] if len(row) > 2 else None
                 try:
                     # Konversi List float -> Numpy Array Float32
                     emb_array = np.array(embedding_val, dtype=np.float32)
@@ -522,6 +539,12 @@ async def reload_face_database_async():
                     
                     temp_ids.append(nim)
                     temp_vectors.append(norm_vec)
+                    
+                    # Galeri cascade (model ringan), opsional per mahasiswa
+                    if light_val is not None:
+                        light_array = np.array(light_val, dtype=np.float32)
+                        temp_light_ids.append(nim)
+                        temp_light_vectors.append(light_array / np.linalg.norm(light_array))
                 except Exception as inner_e:
                     logger.warning(f"Database: Data wajah korup untuk NIM {nim} - {inner_e}")
 
@@ -530,10 +553,17 @@ async def reload_face_database_async():
             state.known_ids = temp_ids
             state.known_matrix = np.array(temp_vectors)
             state.last_reload = datetime.now()
-            logger.info(f"✅ Database: Berhasil memuat {len(temp_ids)} profil wajah.")
+            state.known_ids_light = temp_light_ids
+            state.known_matrix_light = np.array(temp_light_vectors) if temp_light_vectors else None
+            logger.info(
+                f"✅ Database: Berhasil memuat {len(temp_ids)} profil wajah "
+                f"({len(temp_light_ids)} dengan embedding cascade)."
+            )
         else:
             state.known_ids = []
             state.known_matrix = None
+            state.known_ids_light = []
+            state.known_matrix_light = None
             logger.warning("⚠️ Database: Tidak ada data wajah yang ditemukan.")
             
     except Exception as e:
@@ -551,6 +581,7 @@ async def startup_event_handler():
     1. Inisialisasi koneksi database dan skema.
     2. Load Model AI ke GPU/CPU.
     3. Load data wajah ke memori.
+    4. Menyalakan worker pool analisis video & melanjutkan task yang terputus.
     """
     logger.info("🚀 EduSense AI Server Starting Up...")
     state.system_status = "INITIALIZING"
@@ -560,6 +591,10 @@ async def startup_event_handler():
         async with engine.begin() as conn:
             # Create tables if not exist (SQLAlchemy)
             await conn.run_sync(Base.metadata.create_all)
+            # create_all tidak menambah kolom ke tabel lama: cek kolom galeri cascade
+            state.light_column_ready = await conn.run_sync(
+                lambda sync_conn: "embedding_light" in {c["name"] for c in inspect(sync_conn).get_columns("mahasiswa")}
+            )
         logger.info("✅ Database: Koneksi berhasil dan skema terverifikasi.")
     except Exception as e:
         logger.critical(f"❌ Database: Koneksi Gagal - {e}")
@@ -569,17 +604,37 @@ async def startup_event_handler():
     # 2. AI Model Initialization
     try:
         logger.info("⏳ AI: Memuat Model InsightFace... (Ini mungkin memakan waktu)")
-        # PENTING: Gunakan buffalo_l (sama dengan bulk registration) untuk kompatibilitas embedding
-        # buffalo_sc memiliki dimensi embedding berbeda dengan buffalo_l
-        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-        state.face_app = FaceAnalysis(name='buffalo_l', providers=providers)
-        state.face_app.prepare(ctx_id=0, det_size=(640, 640))
-        logger.info("✅ AI: Model InsightFace (buffalo_l) Siap.")
+        # PENTING: Model harus sama dengan worker video & bulk registration (INSIGHTFACE_MODEL_NAME)
+        # agar embedding registrasi dan pencocokan berada di ruang yang sama
+        state.face_pool = FaceSessionPool(model_name=INSIGHTFACE_MODEL_NAME)
+        logger.info(
+            f"✅ AI: Model InsightFace ({INSIGHTFACE_MODEL_NAME}) Siap. "
+            f"{state.face_pool.size} session x {state.face_pool.intra_op_threads} thread."
+        )
     except Exception as e:
         logger.critical(f"❌ AI: Gagal memuat model - {e}")
     
+    if VIDEO_CASCADE_ENABLED and not state.light_column_ready:
+        logger.error(
+            "❌ AI: Kolom mahasiswa.embedding_light belum ada, cascade dinonaktifkan. "
+            "Jalankan helpers/migrate_light_embedding.py."
+        )
+    elif VIDEO_CASCADE_ENABLED:
+        try:
+            state.light_rec_model = create_light_recognizer()
+            logger.info(f"✅ AI: Model cascade ringan ({VIDEO_CASCADE_LIGHT_MODEL}) Siap.")
+        except Exception as e:
+            logger.error(f"❌ AI: Gagal memuat model cascade ringan, registrasi tanpa embedding_light - {e}")
+    
     # 3. Data Preload
     await reload_face_database_async()
+    
+    # 4. Worker Pool Analisis Video
+    await state.emotion_backend.start()
+    start_video_analysis_workers()
+    
+    # 5. Lanjutkan task yang terputus (server restart / crash)
+    await resume_unfinished_tasks()
     state.system_status = "RUNNING"
 
 @app.on_event("shutdown")
@@ -587,6 +642,8 @@ async def shutdown_event_handler():
     """Handler saat aplikasi dimatikan (Cleanup Resources)."""
     logger.info("🛑 EduSense Server Shutting Down...")
     state.system_status = "STOPPED"
+    await stop_video_analysis_workers()
+    await state.emotion_backend.close()
     # Close any open connections or files here if needed
 
 # ==============================================================================
@@ -605,7 +662,12 @@ async def health_check():
         "uptime": str(uptime),
         "version": app.version,
         "active_tasks": len(state.tasks_db),
+        "queued_analyses": state.analysis_queue.qsize() if state.analysis_queue else 0,
+        "analysis_workers": VIDEO_WORKER_COUNT if state.analysis_pool else 0,
+        "face_sessions": state.face_pool.stats() if state.face_pool else None,
         "loaded_faces": len(state.known_ids),
+        "loaded_faces_light": len(state.known_ids_light),
+        "emotion_service": state.emotion_backend.status(),
         "last_db_reload": state.last_reload
     }
 
@@ -724,230 +786,668 @@ async def update_user_password(
 # [SECTION 9] VIDEO PROCESSING ENGINE (BACKGROUND WORKER)
 # ==============================================================================
 
-async def background_video_analyzer(task_id: str, file_path: str, dosen_username: str, jadwal_id: int):
+async def background_video_analyzer(
+    task_id: str, 
+    file_path: str, 
+    dosen_username: str, 
+    jadwal_id: int, 
+    resume: Optional[Dict[str, Any]] = None,
+    streaming: bool = False,
+    fast_attendance: bool = False
+):
     """
     Worker utama untuk memproses video absensi.
-    Dijalankan di background thread agar tidak memblokir API Utama.
+    Frame loop dijalankan di worker process (state.analysis_pool) agar inferensi
+    tidak berebut CPU/GIL dengan request handling di proses API.
+    
+    Jika `resume` diisi (VideoTask.checkpoint_data), frame loop dilanjutkan dari
+    frame checkpoint dengan agregat deteksi sebelumnya.
+    Jika `streaming`, file masih di-upload dan worker membaca byte yang sudah diterima.
+    Jika `fast_attendance`, frame loop berhenti lebih awal saat seluruh roster sudah
+    terlihat VIDEO_EARLY_EXIT_SIGHTINGS kali atau tidak ada identitas baru.
     
     Workflow:
-    1. Buka Video -> Loop Frame
+    1. Kirim job ke worker process -> Loop Frame
     2. Deteksi Wajah (InsightFace) -> Identifikasi NIM
     3. Simpan Sample Wajah
     4. Analisis Emosi (API Eksternal)
     5. Update Database LogAbsensi dengan logika Strict Binding (Jadwal ID)
     """
     logger.info(f"🎬 [Task {task_id}] Memulai analisis video untuk Jadwal ID: {jadwal_id}")
-    state.update_task(task_id, "processing", 0)
+    state.update_task(task_id, "processing", state.combined_progress(task_id, resume.get('progress', 0) if resume else 0))
+    # File video dipertahankan jika task terputus saat shutdown agar bisa di-resume
+    keep_file = False
+    profiler = StageProfiler()
+    task_started = time.perf_counter()
     
-    async with httpx.AsyncClient() as http_client:
-        try:
-            # Buka Video Resource
-            cap = cv2.VideoCapture(file_path)
-            if not cap.isOpened():
-                raise RuntimeError("Gagal membuka file video. Format mungkin tidak didukung.")
-
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            fps = cap.get(cv2.CAP_PROP_FPS) or 30
-            
-            # Konfigurasi Sampling Frame (Skip frame untuk performa)
-            # Analisis 1 frame setiap 1.5 detik
-            frame_interval = int(fps * 1.5) 
-            current_frame_idx = 0
-            
-            # Buffer Data Sementara
-            # Struktur: { NIM : { 'count': int, 'emosi': { 'happy': 2, ... }, 'sample': str_path } }
-            detected_students = defaultdict(lambda: {'count': 0, 'emosi': defaultdict(int), 'sample': None})
+    try:
+        # --- ROSTER JADWAL & INDEKS IDENTIFIKASI ---
+        enrolled_nims = await load_jadwal_roster(jadwal_id)
+        known_ids, known_matrix = build_identification_index(enrolled_nims)
+        light_ids, light_matrix, light_complete = build_light_index(known_ids)
+        use_fallback = VIDEO_IDENTIFY_GLOBAL_FALLBACK and known_matrix is not state.known_matrix
+        logger.info(f"[Task {task_id}] Indeks identifikasi: {len(known_ids)} embedding (galeri global: {len(state.known_ids)})")
+        detect_roi = await load_room_roi(jadwal_id)
+        
+        # --- VIDEO LOOP (WORKER PROCESS) ---
+        job = {
+            "task_id": task_id,
+            "file_path": file_path,
+            "frame_skip": VIDEO_PROCESSING_FRAME_SKIP,
+            "known_ids": known_ids,
+            "known_matrix": known_matrix,
+            "fallback_ids": state.known_ids if use_fallback else None,
+            "fallback_matrix": state.known_matrix if use_fallback else None,
+            "threshold": FACE_SIMILARITY_THRESHOLD,
+            "crop_dir": DIRECTORY_CONFIG["CROP_FACE"],
+            "crop_url_prefix": "/hasil_crop",
+            "resume": resume,
+            "streaming": streaming,
+            "detect_roi": detect_roi,
+            # Cascade recognition: galeri model ringan untuk kandidat yang sama dengan known_ids
+            "light_ids": light_ids,
+            "light_matrix": light_matrix,
+            "light_complete": light_complete,
+            # Roster = mahasiswa enrolled yang punya embedding (yang lain tidak mungkin terlihat)
+            "early_exit": {
+                "roster": sorted(set(known_ids) & enrolled_nims) if enrolled_nims else []
+            } if fast_attendance else None,
+        }
+        # Video panjang dibagi per segmen ke beberapa worker (kecuali streaming / fast attendance / resume,
+        # yang butuh pemrosesan berurutan)
+        segment_plan = None
+        if VIDEO_SEGMENT_PARALLEL and VIDEO_WORKER_COUNT > 1 and not (streaming or fast_attendance or resume):
+            segment_plan = await asyncio.to_thread(
+                plan_video_segments, file_path, VIDEO_PROCESSING_FRAME_SKIP, VIDEO_WORKER_COUNT
+            )
+        
+        if segment_plan and len(segment_plan['segments']) > 1:
+            scan_result = await run_segmented_analysis(task_id, job, segment_plan)
+        else:
+            loop = asyncio.get_running_loop()
+            scan_result = await loop.run_in_executor(state.analysis_pool, run_video_analysis_job, job)
+        profiler.merge(scan_result.get('profile'))
+        logger.info(
+            f"[Task {task_id}] Frame loop selesai: {scan_result['frames_sampled']} frame sampel "
+            f"(decode: {scan_result['decode_mode']})"
+        )
+        
+        # Buffer Data Sementara
+        # Struktur: { NIM : { 'count': int, 'emosi': { 'happy': 2, ... }, 'sample': str_path } }
+        detected_students = defaultdict(lambda: {'count': 0, 'emosi': defaultdict(int), 'sample': None})
+        
+        # JPEG sample dari worker (di-encode sekali, sudah tertulis di disk)
+        sample_jpegs = {}
+        for nim_result, scan_meta in scan_result['detected'].items():
+            detected_students[nim_result]['count'] = scan_meta['count']
+            detected_students[nim_result]['sample'] = scan_meta['sample']
+            if scan_meta.get('jpeg'):
+                sample_jpegs[nim_result] = scan_meta['jpeg']
+        
+        # Analisis Emosi (Opsional & Fault Tolerant)
+        # Backend lokal sudah dijalankan di worker; backend remote dipanggil paralel di sini.
+        # Gagal / circuit OPEN -> emosi dilewati, proses utama tetap jalan
+        if scan_result.get('emotion_in_worker'):
+            # Segment-parallel: satu label per segmen tempat mahasiswa terlihat
+            for nim_result, meta in scan_result['detected'].items():
+                for emotion in meta.get('emotions') or ([meta['emotion']] if meta.get('emotion') else []):
+                    detected_students[nim_result]['emosi'][emotion] += 1
+        else:
+            with profiler.stage('emotion', len(sample_jpegs)):
+                emotions = await state.emotion_backend.predict_encoded(sample_jpegs)
+            for nim_result, emotion in emotions.items():
+                detected_students[nim_result]['emosi'][emotion] += 1
+        
+        # Dibatalkan setelah frame loop selesai: jangan tulis absensi
+        if os.path.exists(cancel_marker_path(file_path)):
+            raise AnalysisCancelled(f"Task {task_id} dibatalkan")
+        
+        # --- DATABASE UPDATE (TRANSACTIONAL) ---
+        logger.info(f"💾 [Task {task_id}] Menyimpan hasil analisis ke Database...")
+        logger.info(f"[Task {task_id}] Total mahasiswa terdeteksi di video: {len(detected_students)}")
+        
+        db_started = time.perf_counter()
+        async with AsyncSessionLocal() as db_session:
+            # 1. Update Task Status -> Completed
+            task_query = await db_session.execute(select(VideoTask).where(VideoTask.task_id == task_id))
+            task_obj = task_query.scalars().first()
+            if task_obj:
+                task_obj.status = "completed"
+                task_obj.checkpoint_data = None
+                if fast_attendance:
+                    task_obj.early_exit = {"enabled": True, **(scan_result.get('early_exit') or {})}
             
-            # --- VIDEO LOOP ---
-            while True:
-                # Update Progress ke Cache (untuk polling frontend)
-                if total_frames > 0:
-                    progress_pct = min(int((current_frame_idx / total_frames) * 100), 99)
-                    state.update_task(task_id, "processing", progress_pct)
-                
-                # Seek & Read Frame
-                cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame_idx)
-                ret, frame = cap.read()
-                
-                if not ret: break # End of Video
-                
-                # --- AI INFERENCE ---
-                # Jalankan di thread pool agar loop async tidak terblokir (CPU Bound Operation)
-                faces = await asyncio.to_thread(state.face_app.get, frame)
-                
-                for face in faces:
-                    # Identifikasi Wajah (Vector Search)
-                    nim_result, score_result = identify_face_fast(face.embedding)
-                    
-                    if nim_result != "Unknown":
-                        # Mahasiswa Teridentifikasi!
-                        detected_students[nim_result]['count'] += 1
-                        
-                        # --- POST-PROCESSING ---
-                        # 1. Simpan Sample Foto (Hanya jika belum punya sample terbaik)
-                        if detected_students[nim_result]['sample'] is None:
-                            b = face.bbox.astype(int)
-                            x1, y1 = max(0, b[0]), max(0, b[1])
-                            x2, y2 = min(frame.shape[1], b[2]), min(frame.shape[0], b[3])
-                            
-                            face_crop = frame[y1:y2, x1:x2]
-                            
-                            if face_crop.size > 0:
-                                filename = f"{task_id}_{nim_result}_{current_frame_idx}.jpg"
-                                save_fullpath = os.path.join(DIRECTORY_CONFIG["CROP_FACE"], filename)
-                                cv2.imwrite(save_fullpath, face_crop)
-                                
-                                detected_students[nim_result]['sample'] = f"/hasil_crop/{filename}"
-
-                                # 2. Analisis Emosi (Opsional & Fault Tolerant)
-                                try:
-                                    img_payload = compress_image_to_bytes(face_crop)
-                                    response = await http_client.post(
-                                        API_EMOTION_URL, 
-                                        files={'file': (filename, img_payload, 'image/jpeg')}, 
-                                        timeout=2.0 # Fast timeout
-                                    )
-                                    if response.status_code == 200:
-                                        data = response.json()
-                                        emotion = data.get('predicted', 'neutral')
-                                        detected_students[nim_result]['emosi'][emotion] += 1
-                                except Exception:
-                                    # Fail silently untuk emosi, jangan hentikan proses utama
-                                    pass
-
-                # Lompat ke frame berikutnya
-                current_frame_idx += frame_interval
-                if current_frame_idx >= total_frames: break
+            # 2-3. Enrollment jadwal sudah dimuat sebelum frame loop (load_jadwal_roster)
             
-            cap.release()
+            # 4. Proses Log Absensi (Smart Upsert with Strict Session + Enrollment Check)
+            # Set-based: 1 SELECT log existing + 1 INSERT multi-row + 1 UPDATE (CASE) per task
+            today_date = datetime.now().date()
+            skipped_count = 0
             
-            # --- DATABASE UPDATE (TRANSACTIONAL) ---
-            logger.info(f"💾 [Task {task_id}] Menyimpan hasil analisis ke Database...")
-            logger.info(f"[Task {task_id}] Total mahasiswa terdeteksi di video: {len(detected_students)}")
+            # Validasi enrollment: skip jika enrollment filtering aktif DAN mahasiswa tidak enrolled
+            valid_students = {}
+            for nim, meta in detected_students.items():
+                if enrolled_nims is not None and nim not in enrolled_nims:
+                    logger.info(f"[Task {task_id}] Skipping NIM {nim} - tidak terdaftar di kelas ini")
+                    skipped_count += 1
+                    continue
+                valid_students[nim] = meta
             
-            async with AsyncSessionLocal() as db_session:
-                # 1. Update Task Status -> Completed
-                task_query = await db_session.execute(select(VideoTask).where(VideoTask.task_id == task_id))
-                task_obj = task_query.scalars().first()
-                if task_obj:
-                    task_obj.status = "completed"
-                
-                # 2. Get student_class_id dari Jadwal untuk filtering enrollment
-                jadwal_query = await db_session.execute(select(Jadwal).where(Jadwal.jadwal_id == jadwal_id))
-                jadwal_obj = jadwal_query.scalars().first()
-                
-                if not jadwal_obj:
-                    logger.warning(f"[Task {task_id}] Jadwal tidak ditemukan")
-                    state.update_task(task_id, "failed", error="Jadwal tidak ditemukan")
-                    return
-                
-                # 3. Get list of enrolled students untuk validasi (HANYA jika student_class_id ada)
-                enrolled_nims = None
-                if jadwal_obj.student_class_id:
-                    enrolled_query = await db_session.execute(
-                        select(KelasEnrollment.nim).where(
-                            KelasEnrollment.student_class_id == jadwal_obj.student_class_id
-                        )
+            # Cek Data Existing Hari Ini PADA JADWAL INI (satu query untuk semua NIM)
+            # Ini mencegah 'Pergaulan Bebas' Data (Absen lintas kelas)
+            existing_logs: Dict[str, Any] = {}
+            if valid_students:
+                log_stmt = select(LogAbsensi.log_id, LogAbsensi.nim, LogAbsensi.metode).where(
+                    and_(
+                        LogAbsensi.nim.in_(list(valid_students.keys())),
+                        LogAbsensi.jadwal_id == jadwal_id, # Strict Filter
+                        func.date(LogAbsensi.waktu_absen) == today_date
                     )
-                    enrolled_nims = set([row[0] for row in enrolled_query.fetchall()])
-                    logger.info(f"[Task {task_id}] Mahasiswa enrolled di kelas ini: {len(enrolled_nims)}")
-                else:
-                    logger.warning(f"[Task {task_id}] Jadwal tidak memiliki student_class_id, skip enrollment filtering")
-                
-                # 4. Proses Log Absensi (Smart Upsert with Strict Session + Enrollment Check)
-                today_date = datetime.now().date()
-                skipped_count = 0
-                processed_count = 0
+                ).order_by(LogAbsensi.log_id)
+                for row in (await db_session.execute(log_stmt)).all():
+                    existing_logs.setdefault(row.nim, row)
+            
+            new_rows = []
+            increments = {}
+            for nim, meta in valid_students.items():
+                existing_log = existing_logs.get(nim)
                 
-                for nim, meta in detected_students.items():
-                    # Validasi enrollment: skip jika enrollment filtering aktif DAN mahasiswa tidak enrolled
-                    if enrolled_nims is not None and nim not in enrolled_nims:
-                        logger.info(f"[Task {task_id}] Skipping NIM {nim} - tidak terdaftar di kelas ini")
-                        skipped_count += 1
-                        continue
+                if not existing_log:
+                    # CASE A: Belum absen di kelas ini -> Insert Baru
                     # Tentukan emosi dominan
                     dominant_emotion = "Neutral"
                     if meta['emosi']:
                         dominant_emotion = max(meta['emosi'], key=meta['emosi'].get)
-                    
-                    # Cek Data Existing Hari Ini PADA JADWAL INI
-                    # Ini mencegah 'Pergaulan Bebas' Data (Absen lintas kelas)
-                    log_stmt = select(LogAbsensi).where(
-                        and_(
-                            LogAbsensi.nim == nim, 
-                            LogAbsensi.jadwal_id == jadwal_id, # Strict Filter
-                            func.date(LogAbsensi.waktu_absen) == today_date
-                        )
+                    new_rows.append({
+                        "task_id": task_id,
+                        "nim": nim,
+                        "jadwal_id": jadwal_id, # KUNCI PENTING
+                        "waktu_absen": func.now(),
+                        "metode": "AI_VIDEO",
+                        "jumlah_muncul": meta['count'],
+                        "emosi_dominan": dominant_emotion,
+                        "bukti_foto": meta['sample'],
+                        "is_disputed": False
+                    })
+                elif existing_log.metode == "AI_VIDEO":
+                    # CASE B: Sudah absen -> Update Statistik
+                    # Hanya update jika metode sebelumnya juga AI
+                    increments[existing_log.log_id] = meta['count']
+            
+            if new_rows:
+                await db_session.execute(insert(LogAbsensi).values(new_rows))
+            if increments:
+                await db_session.execute(
+                    update(LogAbsensi)
+                    .where(LogAbsensi.log_id.in_(list(increments.keys())))
+                    .values(
+                        jumlah_muncul=func.coalesce(LogAbsensi.jumlah_muncul, 0)
+                        + case(increments, value=LogAbsensi.log_id, else_=0)
                     )
-                    existing_log = (await db_session.execute(log_stmt)).scalars().first()
-                    
-                    if not existing_log:
-                        # CASE A: Belum absen di kelas ini -> Insert Baru
-                        new_log = LogAbsensi(
-                            task_id=task_id,
-                            nim=nim,
-                            jadwal_id=jadwal_id, # KUNCI PENTING
-                            waktu_absen=func.now(),
-                            metode="AI_VIDEO",
-                            jumlah_muncul=meta['count'],
-                            emosi_dominan=dominant_emotion,
-                            bukti_foto=meta['sample'],
-                            is_disputed=False
-                        )
-                        db_session.add(new_log)
-                        processed_count += 1
-                        logger.info(f"[Task {task_id}] Insert log baru untuk NIM {nim}")
-                    else:
-                        # CASE B: Sudah absen -> Update Statistik
-                        # Hanya update jika metode sebelumnya juga AI
-                        if existing_log.metode == "AI_VIDEO":
-                            existing_log.jumlah_muncul += meta['count']
-                            processed_count += 1
-                            logger.info(f"[Task {task_id}] Update log existing untuk NIM {nim}")
-                            # Bisa update emosi jika perlu
-                            # existing_log.bukti_foto = meta['sample'] 
-                
-                await db_session.commit()
-                logger.info(f"[Task {task_id}] Database commit successful. Total processed: {processed_count}")
+                    .execution_options(synchronize_session=False)
+                )
+            processed_count = len(new_rows) + len(increments)
+            logger.info(f"[Task {task_id}] Log absensi: {len(new_rows)} insert, {len(increments)} update")
+            
+            await db_session.commit()
+            logger.info(f"[Task {task_id}] Database commit successful. Total processed: {processed_count}")
+        profiler.add('db_commit', time.perf_counter() - db_started, len(detected_students))
+        
+        # Simpan profil tahap pipeline (dipakai /status & /admin/video-tasks/profile)
+        profiler.add('total', time.perf_counter() - task_started)
+        profile = profiler.snapshot()
+        await save_task_profile(task_id, profile)
+
+        # Finalisasi State
+        state.update_task(task_id, "completed", 100)
+        state.tasks_db[task_id]["profile"] = profile
+        if scan_result.get('early_exit'):
+            state.tasks_db[task_id]["early_exit"] = scan_result['early_exit']
+        enrolled_detected = processed_count
+        logger.info(f"✅ [Task {task_id}] Selesai. {enrolled_detected} mahasiswa berhasil diproses (skipped: {skipped_count}).")
+
+    except asyncio.CancelledError:
+        # Server shutdown: status tetap 'processing' di DB, dilanjutkan saat startup berikutnya
+        logger.warning(f"⏸️ [Task {task_id}] Analisis terputus, akan dilanjutkan dari checkpoint terakhir.")
+        keep_file = True
+        raise
 
-            # Finalisasi State
-            state.update_task(task_id, "completed", 100)
-            enrolled_detected = processed_count
-            logger.info(f"✅ [Task {task_id}] Selesai. {enrolled_detected} mahasiswa berhasil diproses (skipped: {skipped_count}).")
+    except AnalysisCancelled:
+        logger.info(f"🛑 [Task {task_id}] Analisis dibatalkan oleh user.")
+        await finalize_cancelled_task(task_id)
 
-        except Exception as e:
-            logger.error(f"❌ [Task {task_id}] Error Processing Video: {e}")
-            state.update_task(task_id, "failed", error=str(e))
-            
-            # Mark as Failed in DB
-            async with AsyncSessionLocal() as db_err:
-                task_q = await db_err.execute(select(VideoTask).where(VideoTask.task_id == task_id))
-                t_obj = task_q.scalars().first()
-                if t_obj:
-                    t_obj.status = "failed"
-                    await db_err.commit()
+    except Exception as e:
+        logger.error(f"❌ [Task {task_id}] Error Processing Video: {e}")
+        state.update_task(task_id, "failed", error=str(e))
+        
+        # Mark as Failed in DB
+        async with AsyncSessionLocal() as db_err:
+            task_q = await db_err.execute(select(VideoTask).where(VideoTask.task_id == task_id))
+            t_obj = task_q.scalars().first()
+            if t_obj:
+                t_obj.status = "failed"
+                await db_err.commit()
 
-        finally:
-            # Cleanup File Sementara
-            if os.path.exists(file_path):
+    finally:
+        # Cleanup File Sementara
+        if not keep_file and os.path.exists(file_path):
+            try:
+                os.remove(file_path)
+                logger.info(f"🧹 [Task {task_id}] File temp dihapus.")
+            except Exception: pass
+        # Penanda upload dipertahankan saat shutdown (resume mendeteksi upload streaming yang terputus)
+        markers = [cancel_marker_path(file_path)] + ([] if keep_file else [upload_marker_path(file_path)])
+        for marker in markers:
+            if os.path.exists(marker):
                 try:
-                    os.remove(file_path)
-                    logger.info(f"🧹 [Task {task_id}] File temp dihapus.")
+                    os.remove(marker)
                 except Exception: pass
 
+async def run_segmented_analysis(task_id: str, job: Dict[str, Any], plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Jalankan satu job per segmen (plan_video_segments) secara paralel di process pool
+    lalu gabungkan agregatnya (merge_segment_results).
+    """
+    segments = plan['segments']
+    logger.info(f"[Task {task_id}] Segment-parallel: {len(segments)} segmen ({plan['decode_mode']})")
+    
+    segment_jobs = [
+        {
+            **job,
+            "decode_plan": (plan['decode_mode'], plan['frame_interval']),
+            "segment": {"index": i, "start": start, "end": end},
+            "sample_suffix": f"_s{i}",
+        }
+        for i, (start, end) in enumerate(segments)
+    ]
+    
+    loop = asyncio.get_running_loop()
+    state.segment_progress[task_id] = [0] * len(segments)
+    futures = [loop.run_in_executor(state.analysis_pool, run_video_analysis_job, j) for j in segment_jobs]
+    try:
+        results = await asyncio.gather(*futures)
+    except Exception:
+        # Hentikan segmen lain lewat penanda .cancel dan tunggu sampai semuanya berhenti
+        # sebelum file video dihapus oleh background_video_analyzer
+        open(cancel_marker_path(job['file_path']), 'w').close()
+        await asyncio.gather(*futures, return_exceptions=True)
+        raise
+    finally:
+        state.segment_progress.pop(task_id, None)
+    
+    merged = merge_segment_results(results)
+    # Sample segmen yang kalah skor kualitas tidak dipakai sebagai bukti
+    for url in merged.pop('discarded_samples'):
+        crop_path = os.path.join(job['crop_dir'], os.path.basename(url))
+        if os.path.exists(crop_path):
+            os.remove(crop_path)
+    return merged
+
+async def finalize_cancelled_task(task_id: str):
+    """Tandai task 'cancelled' (memory & DB) dan hapus crop wajah milik task."""
+    state.update_task(task_id, "cancelled", state.tasks_db.get(task_id, {}).get("progress", 0))
+    
+    for crop_path in glob.glob(os.path.join(DIRECTORY_CONFIG["CROP_FACE"], f"{task_id}_*.jpg")):
+        try:
+            os.remove(crop_path)
+        except OSError: pass
+    
+    async with AsyncSessionLocal() as db_session:
+        await db_session.execute(
+            update(VideoTask)
+            .where(VideoTask.task_id == task_id)
+            .values(status="cancelled", checkpoint_data=None)
+        )
+        await db_session.commit()
+
+async def load_jadwal_roster(jadwal_id: int) -> Optional[set]:
+    """
+    Ambil NIM mahasiswa enrolled di student_class jadwal.
+    
+    Returns:
+        set | None: None jika jadwal tidak memiliki student_class_id (tanpa filter enrollment).
+    
+    Raises:
+        ValueError: Jadwal tidak ditemukan.
+    """
+    async with AsyncSessionLocal() as db_session:
+        jadwal_obj = (await db_session.execute(select(Jadwal).where(Jadwal.jadwal_id == jadwal_id))).scalars().first()
+        if not jadwal_obj:
+            raise ValueError("Jadwal tidak ditemukan")
+        
+        if not jadwal_obj.student_class_id:
+            logger.warning(f"Jadwal {jadwal_id} tidak memiliki student_class_id, skip enrollment filtering")
+            return None
+        
+        enrolled_query = await db_session.execute(
+            select(KelasEnrollment.nim).where(
+                KelasEnrollment.student_class_id == jadwal_obj.student_class_id
+            )
+        )
+        enrolled_nims = set([row[0] for row in enrolled_query.fetchall()])
+        logger.info(f"Jadwal {jadwal_id}: {len(enrolled_nims)} mahasiswa enrolled")
+        return enrolled_nims
+
+async def load_room_roi(jadwal_id: int) -> Optional[Tuple[float, float, float, float]]:
+    """ROI deteksi untuk ruang jadwal (Kelas.kode_ruang -> VIDEO_ROOM_ROI), None = seluruh frame."""
+    if not VIDEO_ROOM_ROI:
+        return None
+    async with AsyncSessionLocal() as db_session:
+        kode_ruang = (await db_session.execute(
+            select(Kelas.kode_ruang)
+            .join(Jadwal, Jadwal.kelas_id == Kelas.kelas_id)
+            .where(Jadwal.jadwal_id == jadwal_id)
+        )).scalar()
+    roi = room_roi(kode_ruang)
+    if roi:
+        logger.info(f"Jadwal {jadwal_id}: ROI deteksi ruang {kode_ruang} = {roi}")
+    return roi
+
+def build_identification_index(enrolled_nims: Optional[set]) -> Tuple[List[str], Optional[np.ndarray]]:
+    """
+    Sub-indeks galeri wajah untuk satu jadwal: hanya baris milik mahasiswa enrolled.
+    Dot product per wajah turun dari N_kampus ke N_kelas, dan mahasiswa kelas lain
+    tidak bisa 'merebut' argmax. Kembali ke galeri global jika scope 'global',
+    tidak ada data enrollment, atau tidak ada mahasiswa enrolled yang punya embedding.
+    """
+    if VIDEO_IDENTIFY_SCOPE != "jadwal" or enrolled_nims is None or state.known_matrix is None:
+        return state.known_ids, state.known_matrix
+    
+    rows = [i for i, nim in enumerate(state.known_ids) if nim in enrolled_nims]
+    if not rows:
+        return state.known_ids, state.known_matrix
+    return [state.known_ids[i] for i in rows], state.known_matrix[rows]
+
+def build_light_index(known_ids: List[str]) -> Tuple[List[str], Optional[np.ndarray], bool]:
+    """
+    Galeri model ringan (cascade) untuk kandidat yang sama dengan indeks identifikasi job.
+    
+    Returns:
+        tuple: (light_ids, light_matrix, complete). complete=True jika semua kandidat
+        punya embedding_light; worker hanya memakai cascade jika complete (selain itu
+        mahasiswa tanpa embedding_light bisa diterima sebagai mahasiswa lain).
+    """
+    if not VIDEO_CASCADE_ENABLED or state.known_matrix_light is None:
+        return [], None, False
+    
+    candidates = set(known_ids)
+    rows = [i for i, nim in enumerate(state.known_ids_light) if nim in candidates]
+    if not rows:
+        return [], None, False
+    light_ids = [state.known_ids_light[i] for i in rows]
+    return light_ids, state.known_matrix_light[rows], candidates <= set(light_ids)
+
+async def save_task_profile(task_id: str, profile: Dict[str, Any]):
+    """Simpan profil tahap pipeline ke VideoTask.profile_data."""
+    try:
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                update(VideoTask).where(VideoTask.task_id == task_id).values(profile_data=profile)
+            )
+            await db_session.commit()
+    except Exception as e:
+        logger.warning(f"[Task {task_id}] Gagal menyimpan profil - {e}")
+
+async def save_task_checkpoint(task_id: str, checkpoint: Dict[str, Any]):
+    """Simpan checkpoint frame loop ke VideoTask (hanya selama task masih 'processing')."""
+    try:
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                update(VideoTask)
+                .where(and_(VideoTask.task_id == task_id, VideoTask.status == "processing"))
+                .values(checkpoint_data=checkpoint)
+            )
+            await db_session.commit()
+    except Exception as e:
+        logger.warning(f"[Task {task_id}] Gagal menyimpan checkpoint - {e}")
+
+def _progress_listener():
+    """
+    Thread pembaca pesan dari worker process.
+    - progress   : diteruskan ke SystemStateManager.update_task
+    - checkpoint : disimpan ke DB lewat event loop utama
+    """
+    while True:
+        item = state.progress_queue.get()
+        if item is None:
+            break
+        kind, task_id, payload = item
+        if kind == WORKER_MSG_STARTED:
+            state.worker_pids.add(payload)
+            continue
+        # Abaikan pesan terlambat jika task sudah selesai/gagal/dibatalkan
+        current = state.tasks_db.get(task_id, {}).get("status")
+        if current in ("completed", "failed", "cancelling", "cancelled"):
+            continue
+        if kind == WORKER_MSG_PROGRESS:
+            status_name, progress, segment = payload
+            segments = state.segment_progress.get(task_id)
+            if segment is not None and segments is not None:
+                # Progress task segment-parallel = rata-rata progress seluruh segmen
+                segments[segment] = progress
+                progress = int(sum(segments) / len(segments))
+            state.update_task(task_id, status_name, state.combined_progress(task_id, progress))
+        elif kind == WORKER_MSG_CHECKPOINT and state.event_loop is not None:
+            asyncio.run_coroutine_threadsafe(save_task_checkpoint(task_id, payload), state.event_loop)
+
+async def video_analysis_dispatcher(slot: int):
+    """
+    Consumer antrian analisis. Mengambil Task ID dari state.analysis_queue
+    dan menjalankan background_video_analyzer (frame loop di worker process).
+    """
+    while True:
+        task_id = await state.analysis_queue.get()
+        try:
+            job_args = state.pending_jobs.pop(task_id, None)
+            if job_args is None:
+                continue
+            await background_video_analyzer(task_id, **job_args)
+        except Exception as e:
+            logger.error(f"Dispatcher {slot}: Task {task_id} gagal - {e}")
+        finally:
+            state.analysis_queue.task_done()
+
+def start_video_analysis_workers():
+    """Membuat process pool, thread progress listener, dan dispatcher antrian."""
+    try:
+        state.event_loop = asyncio.get_running_loop()
+        mp_context = multiprocessing.get_context("spawn")
+        state.progress_queue = mp_context.Queue()
+        state.worker_stop_event = mp_context.Event()
+        # Bagi core CPU secara merata antar worker agar session ONNX tidak oversubscribe
+        intra_op_threads = max(1, (os.cpu_count() or 1) // VIDEO_WORKER_COUNT)
+        state.analysis_pool = ProcessPoolExecutor(
+            max_workers=VIDEO_WORKER_COUNT,
+            mp_context=mp_context,
+            initializer=init_analysis_worker,
+            initargs=(state.progress_queue, intra_op_threads, state.worker_stop_event)
+        )
+        threading.Thread(target=_progress_listener, name="progress-listener", daemon=True).start()
+        
+        state.analysis_queue = asyncio.Queue()
+        state.dispatcher_tasks = [
+            asyncio.create_task(video_analysis_dispatcher(i)) for i in range(VIDEO_WORKER_COUNT)
+        ]
+        logger.info(f"✅ AI: {VIDEO_WORKER_COUNT} worker analisis video siap ({intra_op_threads} thread/worker).")
+    except Exception as e:
+        logger.critical(f"❌ AI: Gagal membuat worker pool - {e}")
+        state.analysis_pool = None
+
+async def stop_video_analysis_workers():
+    """
+    Menghentikan dispatcher dan process pool saat shutdown.
+    
+    shutdown(cancel_futures=True) hanya membatalkan job yang belum mulai. Job yang sedang
+    berjalan dihentikan lewat worker_stop_event (dicek worker di setiap batch & saat menunggu
+    upload streaming), tanpa checkpoint baru. Worker yang tidak berhenti dalam
+    VIDEO_SHUTDOWN_GRACE_S detik di-terminate (PID dari WORKER_MSG_STARTED). Task tetap 'processing' di DB dan
+    resume_unfinished_tasks melanjutkannya dari checkpoint terakhir saat startup berikutnya.
+    """
+    for t in state.dispatcher_tasks:
+        t.cancel()
+    state.dispatcher_tasks = []
+    if state.worker_stop_event is not None:
+        state.worker_stop_event.set()
+    if state.analysis_pool is not None:
+        pool, state.analysis_pool = state.analysis_pool, None
+        shutdown = asyncio.ensure_future(asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True))
+        try:
+            await asyncio.wait_for(asyncio.shield(shutdown), VIDEO_SHUTDOWN_GRACE_S)
+        except asyncio.TimeoutError:
+            logger.warning(f"Worker tidak berhenti dalam {VIDEO_SHUTDOWN_GRACE_S}s, di-terminate.")
+            for pid in state.worker_pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except (ProcessLookupError, PermissionError):
+                    pass
+            try:
+                await asyncio.wait_for(shutdown, 5)
+            except asyncio.TimeoutError:
+                logger.error("Process pool analisis belum tertutup setelah terminate.")
+        state.worker_pids.clear()
+    if state.progress_queue is not None:
+        state.progress_queue.put(None)
+
+async def resume_unfinished_tasks():
+    """
+    Masukkan kembali task berstatus 'processing' (terputus oleh restart/crash) ke antrian.
+    Task dilanjutkan dari checkpoint_data; jika file video sudah hilang, task ditandai gagal.
+    Job yang dihentikan stop_video_analysis_workers saat shutdown juga melanjutkan dari sini
+    (frame setelah checkpoint terakhir dianalisis ulang).
+    """
+    if state.analysis_pool is None:
+        return
+    try:
+        async with AsyncSessionLocal() as db_session:
+            result = await db_session.execute(
+                select(VideoTask)
+                .where(VideoTask.status == "processing")
+                .order_by(VideoTask.created_at)
+            )
+            unfinished = result.scalars().all()
+            
+            for task in unfinished:
+                file_path = os.path.join(DIRECTORY_CONFIG["TEMP_VIDEO"], f"{task.task_id}.mp4")
+                if os.path.exists(upload_marker_path(file_path)):
+                    # Streaming upload terputus di tengah jalan: file tidak lengkap
+                    for path in (file_path, upload_marker_path(file_path)):
+                        if os.path.exists(path):
+                            os.remove(path)
+                if not os.path.exists(file_path):
+                    task.status = "failed"
+                    task.checkpoint_data = None
+                    state.update_task(task.task_id, "failed", error="File video tidak ditemukan setelah restart")
+                    logger.warning(f"[Task {task.task_id}] File temp hilang, task ditandai gagal.")
+                    continue
+                
+                checkpoint = task.checkpoint_data or None
+                state.update_task(task.task_id, "queued", checkpoint.get('progress', 0) if checkpoint else 0)
+                state.pending_jobs[task.task_id] = {
+                    "file_path": file_path,
+                    "dosen_username": task.dosen_username,
+                    "jadwal_id": task.jadwal_id,
+                    "resume": checkpoint,
+                    "fast_attendance": bool((task.early_exit or {}).get("enabled"))
+                }
+                await state.analysis_queue.put(task.task_id)
+                logger.info(
+                    f"🔁 [Task {task.task_id}] Dilanjutkan "
+                    f"dari frame {checkpoint.get('next_frame', 0) if checkpoint else 0}."
+                )
+            
+            await db_session.commit()
+    except Exception as e:
+        logger.error(f"❌ Resume task gagal - {e}")
+
+async def enqueue_video_task(
+    db: AsyncSession,
+    task_id: str,
+    dosen_username: str,
+    jadwal_id: int,
+    filename: str,
+    file_path: str,
+    streaming: bool = False,
+    content_hash: Optional[str] = None,
+    fast_attendance: bool = False
+):
+    """Simpan VideoTask (status 'processing') lalu masukkan Task ID ke antrian worker."""
+    new_task = VideoTask(
+        task_id=task_id, 
+        dosen_username=dosen_username, 
+        jadwal_id=jadwal_id, # Bind to Jadwal
+        filename=filename, 
+        status="processing",
+        content_hash=content_hash,
+        early_exit={"enabled": True} if fast_attendance else None
+    )
+    db.add(new_task)
+    await db.commit()
+    
+    # Inisialisasi Status di Memory Cache
+    state.update_task(task_id, "queued", 0)
+    
+    state.pending_jobs[task_id] = {
+        "file_path": file_path,
+        "dosen_username": dosen_username,
+        "jadwal_id": jadwal_id,
+        "streaming": streaming,
+        "fast_attendance": fast_attendance
+    }
+    await state.analysis_queue.put(task_id)
+
+async def find_duplicate_task(
+    db: AsyncSession, jadwal_id: int, content_hash: str, fast_attendance: bool = False
+) -> Optional[VideoTask]:
+    """
+    Cari task untuk file yang sama (SHA-256) pada jadwal yang sama dengan mode yang
+    sama (fast attendance / analisis penuh) yang masih berjalan atau sudah selesai.
+    Hasil fast attendance berhenti lebih awal sehingga tidak boleh dipakai untuk
+    analisis penuh (dan sebaliknya). Task gagal/dibatalkan tidak dihitung, termasuk
+    task 'processing' yang sedang dibatalkan (status 'cancelling' / penanda .cancel)
+    karena hasilnya tidak akan pernah tersedia.
+    """
+    stmt = select(VideoTask).where(
+        and_(
+            VideoTask.jadwal_id == jadwal_id,
+            VideoTask.content_hash == content_hash,
+            VideoTask.status.in_(["processing", "completed"])
+        )
+    ).order_by(desc(VideoTask.created_at))
+    for task in (await db.execute(stmt)).scalars().all():
+        if bool((task.early_exit or {}).get("enabled")) != fast_attendance:
+            continue
+        if task.status == "processing":
+            if state.tasks_db.get(task.task_id, {}).get("status") in ("cancelling", "cancelled"):
+                continue
+            file_path = os.path.join(DIRECTORY_CONFIG["TEMP_VIDEO"], f"{task.task_id}.mp4")
+            if os.path.exists(cancel_marker_path(file_path)):
+                continue
+        return task
+    return None
+
+def duplicate_task_response(task: VideoTask) -> Dict[str, Any]:
+    """Response /analyze/ untuk upload ulang: arahkan client ke task yang sudah ada."""
+    status = state.tasks_db.get(task.task_id, {}).get("status") or task.status
+    return {
+        "task_id": task.task_id,
+        "message": "Video yang sama sudah pernah diunggah untuk jadwal ini. Menggunakan hasil analisis sebelumnya.",
+        "status": status,
+        "duplicate": True
+    }
+
 @app.post("/analyze/", dependencies=[Depends(allow_dosen)], tags=["Dosen"])
 async def endpoint_analyze_video(
-    bg: BackgroundTasks, 
     file: UploadFile = File(...), 
     jadwal_id: int = Form(...), # Parameter Wajib: Jadwal ID
+    fast_attendance: bool = Form(False), # Opsional: berhenti saat seluruh roster sudah teridentifikasi
     user: dict = Depends(get_current_user), 
     db: AsyncSession = Depends(get_db)
 ):
     """
     Endpoint untuk Dosen mengupload video kelas dan memicu analisis AI.
-    Video akan diproses secara asynchronous (Background Task).
+    Video akan diproses secara asynchronous oleh worker pool analisis.
     """
-    if state.face_app is None:
+    if state.analysis_pool is None:
         raise HTTPException(
             status_code=503, 
             detail="Model AI sedang loading atau tidak tersedia. Coba sesaat lagi."
@@ -973,31 +1473,30 @@ async def endpoint_analyze_video(
     task_id = str(uuid.uuid4())
     temp_file_path = os.path.join(DIRECTORY_CONFIG["TEMP_VIDEO"], f"{task_id}.mp4")
     
-    # Simpan File (Async I/O)
+    # Simpan File (Async I/O) sambil menghitung hash isi file
+    hasher = hashlib.sha256()
     try:
         async with aiofiles.open(temp_file_path, 'wb') as out_file:
             while chunk := await file.read(1024 * 1024): # 1MB Chunks
+                hasher.update(chunk)
                 await out_file.write(chunk)
     except Exception as e:
         logger.error(f"File upload error: {e}")
         raise HTTPException(500, "Gagal menyimpan file video ke server.")
-
-    # Simpan Task Metadata ke DB
-    new_task = VideoTask(
-        task_id=task_id, 
-        dosen_username=username_login, 
-        jadwal_id=jadwal_id, # Bind to Jadwal
-        filename=file.filename, 
-        status="processing"
+    content_hash = hasher.hexdigest()
+
+    # Upload ulang file yang sama untuk jadwal yang sama -> pakai task yang sudah ada
+    duplicate = await find_duplicate_task(db, jadwal_id, content_hash, fast_attendance)
+    if duplicate:
+        os.remove(temp_file_path)
+        logger.info(f"♻️ Upload duplikat untuk jadwal {jadwal_id}, memakai task {duplicate.task_id}")
+        return duplicate_task_response(duplicate)
+
+    # Simpan Task Metadata ke DB & masukkan ke Antrian Worker
+    await enqueue_video_task(
+        db, task_id, username_login, jadwal_id, file.filename, temp_file_path,
+        content_hash=content_hash, fast_attendance=fast_attendance
     )
-    db.add(new_task)
-    await db.commit()
-    
-    # Inisialisasi Status di Memory Cache
-    state.update_task(task_id, "queued", 0)
-    
-    # Trigger Background Worker
-    bg.add_task(background_video_analyzer, task_id, temp_file_path, username_login, jadwal_id)
     
     return {
         "task_id": task_id, 
@@ -1005,15 +1504,252 @@ async def endpoint_analyze_video(
         "status": "queued"
     }
 
+@app.post("/analyze/stream", dependencies=[Depends(allow_dosen)], tags=["Dosen"])
+async def endpoint_analyze_stream_create(
+    jadwal_id: int = Form(...),
+    filename: str = Form(...),
+    fast_attendance: bool = Form(False),
+    user: dict = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Langkah 1 streaming ingest: buat sesi upload dan dapatkan Task ID.
+    Client lalu mengirim body video mentah ke PUT /analyze/stream/{task_id}
+    dan bisa langsung polling /status/{task_id} selama upload berjalan.
+    """
+    if state.analysis_pool is None:
+        raise HTTPException(
+            status_code=503, 
+            detail="Model AI sedang loading atau tidak tersedia. Coba sesaat lagi."
+        )
+    
+    jadwal = (await db.execute(select(Jadwal).where(Jadwal.jadwal_id == jadwal_id))).scalars().first()
+    if not jadwal:
+        raise HTTPException(404, "Jadwal tidak ditemukan")
+    
+    username_login = user.get('username') or user.get('sub')
+    if jadwal.dosen_username != username_login:
+        raise HTTPException(403, "Anda tidak memiliki izin untuk mengupload video ke jadwal ini.")
+    
+    task_id = str(uuid.uuid4())
+    state.pending_uploads[task_id] = {
+        "dosen_username": username_login,
+        "jadwal_id": jadwal_id,
+        "filename": filename,
+        "fast_attendance": fast_attendance
+    }
+    state.update_task(task_id, "uploading", 0)
+    state.update_upload_progress(task_id, 0)
+    # Pemilik disimpan di tasks_db: entri pending_uploads dihapus saat body mulai dikirim (PUT)
+    state.tasks_db[task_id]["dosen_username"] = username_login
+    
+    return {
+        "task_id": task_id,
+        "upload_url": f"/analyze/stream/{task_id}",
+        "status": "uploading"
+    }
+
+@app.put("/analyze/stream/{task_id}", dependencies=[Depends(allow_dosen)], tags=["Dosen"])
+async def endpoint_analyze_stream_upload(
+    task_id: str,
+    request: Request,
+    user: dict = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Langkah 2 streaming ingest: terima body video mentah (application/octet-stream).
+    
+    Untuk container yang bisa dibaca parsial (fragmented MP4, MKV/WebM, MPEG-TS),
+    analisis dimulai setelah VIDEO_STREAM_MIN_BYTES diterima sehingga upload dan
+    analisis berjalan bersamaan. Format lain dianalisis setelah upload selesai.
+    """
+    upload = state.pending_uploads.get(task_id)
+    if upload is None:
+        raise HTTPException(404, "Sesi upload tidak ditemukan")
+    
+    username_login = user.get('username') or user.get('sub')
+    if upload["dosen_username"] != username_login:
+        raise HTTPException(403, "Anda tidak memiliki izin untuk sesi upload ini.")
+    del state.pending_uploads[task_id]
+    
+    temp_file_path = os.path.join(DIRECTORY_CONFIG["TEMP_VIDEO"], f"{task_id}.mp4")
+    marker_path = upload_marker_path(temp_file_path)
+    total_bytes = int(request.headers.get("content-length") or 0)
+    received = 0
+    unflushed = 0
+    head = b""
+    started = False
+    hasher = hashlib.sha256()
+    
+    cancelled = False
+    
+    open(marker_path, 'w').close()
+    try:
+        async with aiofiles.open(temp_file_path, 'wb') as out_file:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                if state.tasks_db.get(task_id, {}).get("status") in ("cancelling", "cancelled"):
+                    cancelled = True
+                    break
+                await out_file.write(chunk)
+                hasher.update(chunk)
+                received += len(chunk)
+                unflushed += len(chunk)
+                if len(head) < 64 * 1024:
+                    head += chunk[:64 * 1024 - len(head)]
+                
+                # Flush per 1MB agar decoder di worker melihat byte terbaru
+                if unflushed >= 1024 * 1024:
+                    await out_file.flush()
+                    unflushed = 0
+                state.update_upload_progress(
+                    task_id, min(int(received * 100 / total_bytes), 99) if total_bytes else None, received
+                )
+                
+                if not started and received >= VIDEO_STREAM_MIN_BYTES and is_streamable_upload(upload["filename"], head):
+                    await out_file.flush()
+                    await enqueue_video_task(
+                        db, task_id, upload["dosen_username"], upload["jadwal_id"],
+                        upload["filename"], temp_file_path, streaming=True,
+                        fast_attendance=upload["fast_attendance"]
+                    )
+                    started = True
+                    logger.info(f"📡 [Task {task_id}] Analisis streaming dimulai setelah {received} byte")
+    except Exception as e:
+        logger.error(f"[Task {task_id}] Streaming upload error: {e}")
+        # Worker (jika sudah jalan) akan gagal karena file hilang dan menandai task 'failed'
+        for path in (marker_path, temp_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        state.update_task(task_id, "failed", error="Upload video terputus")
+        raise HTTPException(500, "Gagal menerima file video.")
+    
+    if cancelled:
+        if started:
+            # Analisis sudah dimulai: StreamingFrameSource/worker berhenti lewat penanda .cancel
+            # (dicek sebelum penanda upload & file), lalu background_video_analyzer menghapus
+            # file temp, penanda, dan crop. Di sini hanya penanda upload yang dilepas.
+            if os.path.exists(marker_path):
+                os.remove(marker_path)
+            return {"task_id": task_id, "status": "cancelling", "streamed": started}
+        for path in (marker_path, temp_file_path):
+            if os.path.exists(path):
+                os.remove(path)
+        state.update_task(task_id, "cancelled", 0)
+        return {"task_id": task_id, "status": "cancelled", "streamed": started}
+    
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+    state.update_upload_progress(task_id, 100, received)
+    
+    if received == 0:
+        os.remove(temp_file_path)
+        state.update_task(task_id, "failed", error="File video kosong")
+        raise HTTPException(400, "File video kosong")
+    
+    content_hash = hasher.hexdigest()
+    if not started:
+        duplicate = await find_duplicate_task(db, upload["jadwal_id"], content_hash, upload["fast_attendance"])
+        if duplicate:
+            os.remove(temp_file_path)
+            # Client yang sudah polling Task ID sesi ini diarahkan ke task yang ada
+            state.update_task(task_id, "duplicate", 100)
+            state.tasks_db[task_id]["duplicate_of"] = duplicate.task_id
+            return duplicate_task_response(duplicate)
+        await enqueue_video_task(
+            db, task_id, upload["dosen_username"], upload["jadwal_id"],
+            upload["filename"], temp_file_path, content_hash=content_hash,
+            fast_attendance=upload["fast_attendance"]
+        )
+    else:
+        # Analisis sudah berjalan sebelum hash lengkap: simpan hash untuk dedup upload berikutnya
+        await db.execute(update(VideoTask).where(VideoTask.task_id == task_id).values(content_hash=content_hash))
+        await db.commit()
+    
+    return {
+        "task_id": task_id,
+        "message": "Video berhasil diunggah. Analisis berjalan di background.",
+        "status": state.tasks_db.get(task_id, {}).get("status", "queued"),
+        "streamed": started
+    }
+
+@app.delete("/analyze/{task_id}", dependencies=[Depends(allow_dosen)], tags=["Dosen"])
+async def endpoint_cancel_analysis(
+    task_id: str,
+    user: dict = Depends(get_current_user), 
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Membatalkan analisis video.
+    - Masih di antrian      : dihapus dari antrian, langsung 'cancelled'.
+    - Sedang dianalisis     : worker berhenti di batas sampel berikutnya ('cancelling' -> 'cancelled').
+    - Streaming belum mulai : upload dihentikan.
+    File temp & crop wajah task dibersihkan.
+    """
+    username_login = user.get('username') or user.get('sub')
+    
+    def is_owner(owner: str) -> bool:
+        return owner == username_login or user.get('role') == 'kaprodi'
+    
+    # A. Sesi streaming yang body-nya belum dikirim
+    upload = state.pending_uploads.get(task_id)
+    if upload is not None:
+        if not is_owner(upload["dosen_username"]):
+            raise HTTPException(403, "Anda tidak memiliki izin untuk membatalkan task ini.")
+        del state.pending_uploads[task_id]
+        state.update_task(task_id, "cancelled", 0)
+        return {"task_id": task_id, "status": "cancelled"}
+    
+    task = (await db.execute(select(VideoTask).where(VideoTask.task_id == task_id))).scalars().first()
+    current = state.tasks_db.get(task_id, {}).get("status")
+    
+    # B. Streaming upload berjalan tetapi analisis belum dimulai (belum ada VideoTask)
+    if task is None:
+        if current != "uploading":
+            raise HTTPException(404, "Task tidak ditemukan")
+        if not is_owner(state.tasks_db.get(task_id, {}).get("dosen_username")):
+            raise HTTPException(403, "Anda tidak memiliki izin untuk membatalkan task ini.")
+        state.update_task(task_id, "cancelled", 0)
+        return {"task_id": task_id, "status": "cancelled"}
+    
+    if not is_owner(task.dosen_username):
+        raise HTTPException(403, "Anda tidak memiliki izin untuk membatalkan task ini.")
+    if (current or task.status) in ("completed", "failed", "cancelled"):
+        raise HTTPException(409, f"Task sudah berstatus '{current or task.status}'")
+    
+    file_path = os.path.join(DIRECTORY_CONFIG["TEMP_VIDEO"], f"{task_id}.mp4")
+    
+    # C. Masih di antrian: dispatcher akan melewati Task ID ini
+    if state.pending_jobs.pop(task_id, None) is not None:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        await finalize_cancelled_task(task_id)
+        return {"task_id": task_id, "status": "cancelled"}
+    
+    # D. Sedang dianalisis: pembatalan kooperatif lewat penanda di samping file video
+    open(cancel_marker_path(file_path), 'w').close()
+    state.update_task(task_id, "cancelling", state.tasks_db.get(task_id, {}).get("progress", 0))
+    return {"task_id": task_id, "status": "cancelling"}
+
 @app.get("/status/{task_id}", dependencies=[Depends(allow_dosen)], tags=["Dosen"])
-async def endpoint_get_task_status(task_id: str):
+async def endpoint_get_task_status(task_id: str, db: AsyncSession = Depends(get_db)):
     """
     Long-polling endpoint untuk mengecek status analisis video.
+    Task yang sudah tidak ada di memory (misal setelah restart) dibaca dari DB.
     """
     task_info = state.tasks_db.get(task_id)
-    if not task_info:
+    if task_info:
+        return task_info
+    
+    task = (await db.execute(select(VideoTask).where(VideoTask.task_id == task_id))).scalars().first()
+    if not task:
         return {"status": "not_found", "progress": 0}
-    return task_info
+    return {
+        "status": task.status,
+        "progress": 100 if task.status == "completed" else (task.checkpoint_data or {}).get("progress", 0),
+        "profile": task.profile_data
+    }
 
 # ==============================================================================
 # [SECTION 10] DOSEN & CLASS MANAGEMENT (STRICT SESSION LOGIC)
@@ -1489,6 +2225,56 @@ async def get_upload_history(
 # [SECTION 11] KAPRODI & ADMIN MANAGEMENT
 # ==============================================================================
 
+@app.get("/admin/video-tasks/profile", dependencies=[Depends(allow_kaprodi)], tags=["Admin"])
+async def admin_list_task_profiles(limit: int = 20, db: AsyncSession = Depends(get_db)):
+    """
+    Profil tahap pipeline untuk task analisis terbaru beserta rata-ratanya.
+    Dipakai untuk melihat tahap mana yang melambat tanpa profiler di production.
+    """
+    limit = max(1, min(limit, 200))
+    stmt = select(VideoTask)\
+        .where(VideoTask.profile_data.isnot(None))\
+        .order_by(desc(VideoTask.created_at)).limit(limit)
+    tasks = (await db.execute(stmt)).scalars().all()
+    
+    totals = StageProfiler()
+    for task in tasks:
+        totals.merge(task.profile_data)
+    average = {
+        name: {
+            "seconds": round(stage["seconds"] / len(tasks), 3),
+            "count": round(stage["count"] / len(tasks), 1)
+        }
+        for name, stage in totals.snapshot().items()
+    } if tasks else {}
+    
+    return {
+        "tasks": [
+            {
+                "task_id": task.task_id,
+                "jadwal_id": task.jadwal_id,
+                "status": task.status,
+                "created_at": task.created_at,
+                "profile": task.profile_data
+            }
+            for task in tasks
+        ],
+        "average": average
+    }
+
+@app.get("/admin/video-tasks/{task_id}/profile", dependencies=[Depends(allow_kaprodi)], tags=["Admin"])
+async def admin_get_task_profile(task_id: str, db: AsyncSession = Depends(get_db)):
+    """Profil tahap pipeline untuk satu task analisis."""
+    task = (await db.execute(select(VideoTask).where(VideoTask.task_id == task_id))).scalars().first()
+    if not task:
+        raise HTTPException(404, "Task tidak ditemukan")
+    return {
+        "task_id": task.task_id,
+        "status": task.status,
+        "created_at": task.created_at,
+        "profile": task.profile_data
+    }
+
 @app.get("/admin/jadwal", dependencies=[Depends(allow_dosen)], tags=["Admin"])
 async def get_all_schedules(
     user: dict = Depends(get_current_user),
@@ -2560,14 +3346,22 @@ async def register_face_endpoint(
     [AUTO-LINK] Otomatis membuat akun User jika belum ada untuk mencegah error relasi.
     Password akan di-hash dengan bcrypt sebelum disimpan.
     """
-    if state.face_app is None: raise HTTPException(503, "AI belum siap")
+    if state.face_pool is None: raise HTTPException(503, "AI belum siap")
     
     content = await file.read()
     img = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
-    faces = state.face_app.get(img)
+    try:
+        # Inferensi di thread terpisah dengan session pinjaman dari pool
+        faces = await state.face_pool.run(lambda face_app: face_app.get(img))
+    except TimeoutError:
+        raise HTTPException(503, "Server AI sedang sibuk. Coba sesaat lagi.")
     if not faces: raise HTTPException(400, "Wajah tidak terdeteksi")
     
     emb = faces[0].embedding / np.linalg.norm(faces[0].embedding)
+    # Embedding model ringan untuk cascade (alignment dari deteksi yang sama)
+    emb_light = None
+    if state.light_rec_model is not None:
+        emb_light = await asyncio.to_thread(light_face_embedding, state.light_rec_model, img, faces[0])
     
     # 1. Cek User Account
     user_q = await db.execute(select(Users).where(Users.username == nim))
@@ -2599,6 +3393,15 @@ async def register_face_endpoint(
         existing.user_id = user_obj.user_id # Ensure Link
     else:
         db.add(Mahasiswa(nim=nim, user_id=user_obj.user_id, embedding_data=emb.tolist()))
+    
+    if state.light_column_ready:
+        # Embedding lama model ringan tidak lagi sesuai dengan foto baru (NULL jika cascade mati)
+        await db.flush()
+        mahasiswa_table = Mahasiswa.__table__
+        await db.execute(
+            update(mahasiswa_table).where(mahasiswa_table.c.nim == nim)
+            .values(embedding_light=emb_light.tolist() if emb_light is not None else None)
+        )
         
     await db.commit()
     await reload_face_database_async()
@@ -28,10 +28,16 @@ class Mahasiswa(Base):
     
     # Vector Wajah (512 dimensi untuk InsightFace)
     embedding_data = Column(Vector(512))
+    # Vector wajah model ringan (buffalo_sc) untuk cascade recognition (VIDEO_CASCADE_ENABLED).
+    # Tidak di-map ke ORM (lihat __mapper_args__): database lama tanpa kolom ini tetap bisa
+    # dipakai selama cascade mati. Baca/tulis lewat Core (Mahasiswa.__table__), hanya jika kolom ada.
+    embedding_light = Column(Vector(512))
 
     # Relasi agar bisa memanggil mhs.user.full_name
     user = relationship("Users", backref="data_mahasiswa")
 
+    __mapper_args__ = {"exclude_properties": ["embedding_light"]}
+
 # ==========================================
 # 3. TABEL KELAS (Mata Kuliah)
 # ==========================================
@@ -114,8 +120,23 @@ class VideoTask(Base):
     jadwal_id = Column(Integer, ForeignKey("jadwal.jadwal_id"), nullable=True)
     
     filename = Column(String)
-    status = Column(String, default="processing") # processing, completed, failed
+    status = Column(String, default="processing") # processing, completed, failed, cancelled
     is_closed = Column(Boolean, default=False)  # Menandai apakah kelas sudah ditutup dosen
+    
+    # Checkpoint analisis untuk resume setelah server restart
+    # { 'next_frame': int, 'progress': int, 'frames_sampled': int, 'detected': { NIM: {'count', 'sample'} } }
+    checkpoint_data = Column(JSON, nullable=True)
+    
+    # SHA-256 isi file video (deduplikasi upload ulang per jadwal)
+    content_hash = Column(String(64), nullable=True, index=True)
+    
+    # Mode "fast attendance": { 'enabled': bool, 'reason': str, 'frame': int, 'time_s': float, 'progress': int }
+    # reason/frame/time_s terisi jika analisis berhenti sebelum akhir video
+    early_exit = Column(JSON, nullable=True)
+    
+    # Profil durasi per tahap pipeline analisis
+    # { 'decode': {'seconds': float, 'count': int}, 'detection': {...}, ..., 'total': {...} }
+    profile_data = Column(JSON, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Relasi untuk mengambil info matkul dari task
@@ -0,0 +1,2339 @@
+"""
+EduSense AI - Video Processing Engine
+================================================================================
+Komponen pipeline analisis video yang dipakai oleh `background_video_analyzer`
+di main.py.
+
+Modul ini sengaja TIDAK bergantung pada FastAPI maupun database agar bisa
+di-import secara ringan (misalnya oleh worker atau script helper).
+
+KOMPONEN:
+---------
+[1] Decode Strategy     : Sequential grab/retrieve, Keyframe-only, Seek
+    Adaptive Sampling   : Lewati frame statis berdasarkan selisih thumbnail
+    Streaming Ingest    : Decode file yang masih di-upload (fMP4 / MKV / MPEG-TS)
+[2] Face Model Factory  : Pembuatan instance InsightFace per proses/worker
+    Face Session Pool   : K instance InsightFace dengan checkout/return (proses API)
+[3] Batched Inference   : Deteksi multi-frame & ArcFace dalam satu panggilan ONNX
+    Face Tracker        : Tracking IoU/centroid untuk melewati recognition berulang
+    Frame Prefetcher    : Thread decoder (decode + sampling + letterbox) -> antrian terbatas
+    Detection Layout    : det_size sesuai resolusi / tiling overlap + ROI per ruang
+[4] Worker Process      : Frame loop analisis video (dijalankan di process pool)
+    Checkpoint / Resume : Snapshot progress berkala agar task bisa dilanjutkan
+    Cancellation        : Berhenti di batas sampel berikutnya jika ada penanda .cancel
+    Early Exit          : Berhenti saat roster lengkap / tidak ada identitas baru
+    Segment Parallel    : Satu video dibagi per segmen ke beberapa worker lalu digabung
+    Stage Profiler      : Durasi & jumlah per tahap pipeline (disimpan per VideoTask)
+    Crop Sink           : Encode JPEG sekali + writer disk di thread background
+    Sample Quality      : Pilih crop bukti terbaik per mahasiswa (ukuran, skor, tajam, frontal)
+    Quality Gate        : Buang wajah kecil / skor rendah / blur sebelum recognition
+    Cascade Recognition : Model ringan dulu, model berat hanya untuk wajah ambigu
+================================================================================
+"""
+
+import os
+import json
+import math
+import time
+import queue
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from emotion_service import create_emotion_backend, compress_image_to_bytes
+
+logger = logging.getLogger("EduSenseCore.VideoEngine")
+
+# ==============================================================================
+# KONFIGURASI (Override via Environment Variable)
+# ==============================================================================
+
+# Strategi decode frame: 'auto', 'sequential', 'keyframe', atau 'seek'
+VIDEO_DECODE_MODE = os.getenv("VIDEO_DECODE_MODE", "auto").lower()
+
+# GOP fallback jika probing gagal (x264 default keyint = 250)
+VIDEO_DEFAULT_GOP = int(os.getenv("VIDEO_DEFAULT_GOP", "250"))
+
+# Batas jumlah paket yang dibaca saat probing GOP (tanpa decode)
+VIDEO_GOP_PROBE_PACKETS = int(os.getenv("VIDEO_GOP_PROBE_PACKETS", "1500"))
+
+# Sampling adaptif: frame kandidat diambil setiap VIDEO_PROCESSING_FRAME_SKIP frame (min interval),
+# tetapi hanya dianalisis jika scene berubah, atau jika sudah VIDEO_SAMPLE_MAX_INTERVAL_S detik berlalu.
+VIDEO_ADAPTIVE_SAMPLING = os.getenv("VIDEO_ADAPTIVE_SAMPLING", "true").lower() == "true"
+VIDEO_SAMPLE_MAX_INTERVAL_S = float(os.getenv("VIDEO_SAMPLE_MAX_INTERVAL_S", "10"))
+# Rata-rata selisih absolut grayscale (0-255) pada thumbnail agar frame dianggap berubah
+VIDEO_SCENE_CHANGE_THRESHOLD = float(os.getenv("VIDEO_SCENE_CHANGE_THRESHOLD", "4.0"))
+VIDEO_SCENE_THUMB_WIDTH = 64
+
+# Model pack InsightFace (harus sama dengan bulk registration agar embedding kompatibel)
+INSIGHTFACE_MODEL_NAME = os.getenv("INSIGHTFACE_MODEL_NAME", "buffalo_l")
+INSIGHTFACE_PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']
+INSIGHTFACE_DET_SIZE = (640, 640)
+# Whitelist modul model pack yang dimuat (taskname ONNX InsightFace). Default hanya yang dipakai:
+# bbox/kps (detection) + embedding (recognition). Tambahkan landmark_2d_106, landmark_3d_68,
+# genderage jika dibutuhkan; setiap modul tambahan dijalankan untuk SETIAP wajah oleh FaceAnalysis.get.
+INSIGHTFACE_MODULES = [
+    m.strip() for m in os.getenv("INSIGHTFACE_MODULES", "detection,recognition").split(",") if m.strip()
+]
+# Modul wajib (divalidasi create_face_app): bbox/kps untuk alignment & embedding untuk identifikasi
+INSIGHTFACE_REQUIRED_MODULES = ("detection", "recognition")
+# Varian INT8 (CPU): direktori berisi file ONNX terkuantisasi dengan nama sama dengan model pack
+# (dibuat & divalidasi oleh helpers/quantize_face_models.py). Kosong = FP32.
+INSIGHTFACE_INT8_DIR = os.getenv("INSIGHTFACE_INT8_DIR", "")
+INSIGHTFACE_INT8_MODULES = [
+    m.strip() for m in os.getenv("INSIGHTFACE_INT8_MODULES", "detection,recognition").split(",") if m.strip()
+]
+
+# Cascade recognition: model ringan dulu, model berat (INSIGHTFACE_MODEL_NAME) hanya untuk wajah ambigu.
+# Butuh galeri kedua model (Mahasiswa.embedding_light, lihat helpers/migrate_light_embedding.py).
+# Cascade hanya dipakai jika SEMUA kandidat job punya embedding ringan; mahasiswa yang tidak ada di
+# galeri ringan bisa "diterima" sebagai mahasiswa lain, jadi job dengan galeri tidak lengkap memakai model berat saja.
+VIDEO_CASCADE_ENABLED = os.getenv("VIDEO_CASCADE_ENABLED", "false").lower() == "true"
+VIDEO_CASCADE_LIGHT_MODEL = os.getenv("VIDEO_CASCADE_LIGHT_MODEL", "buffalo_sc")
+# Terima hasil model ringan jika skor top-1 >= ACCEPT dan selisih top-1 vs top-2 >= MARGIN
+VIDEO_CASCADE_ACCEPT_SCORE = float(os.getenv("VIDEO_CASCADE_ACCEPT_SCORE", "0.55"))
+VIDEO_CASCADE_MARGIN = float(os.getenv("VIDEO_CASCADE_MARGIN", "0.15"))
+# Langsung Unknown jika top-1 < REJECT (hanya tanpa galeri fallback global; 0 = nonaktif)
+VIDEO_CASCADE_REJECT_SCORE = float(os.getenv("VIDEO_CASCADE_REJECT_SCORE", "0.15"))
+
+# Geometri deteksi untuk video beresolusi tinggi:
+#   'fixed' : seluruh frame di-resize ke INSIGHTFACE_DET_SIZE (perilaku lama)
+#   'auto'  : det_size mengikuti resolusi sumber (kelipatan 32, maks VIDEO_DETECT_MAX_SIZE)
+#   'tiled' : jendela VIDEO_DETECT_TILE_SIZE yang saling overlap + satu view penuh, NMS antar tile
+VIDEO_DETECT_MODE = os.getenv("VIDEO_DETECT_MODE", "fixed").lower()
+VIDEO_DETECT_MAX_SIZE = int(os.getenv("VIDEO_DETECT_MAX_SIZE", "1280"))
+VIDEO_DETECT_TILE_SIZE = int(os.getenv("VIDEO_DETECT_TILE_SIZE", "640"))
+VIDEO_DETECT_TILE_OVERLAP = float(os.getenv("VIDEO_DETECT_TILE_OVERLAP", "0.2"))
+# ROI deteksi per ruang (Kelas.kode_ruang), JSON pecahan frame [x0, y0, x1, y1]
+# contoh: {"H.3.1": [0.0, 0.3, 1.0, 1.0]}
+VIDEO_ROOM_ROI_RAW = os.getenv("VIDEO_ROOM_ROI", "")
+
+# Batching inferensi: jumlah frame sampel per batch deteksi (1 = deteksi per frame, tanpa batch)
+FACE_BATCH_SIZE = int(os.getenv("FACE_BATCH_SIZE", "8"))
+# Batas waktu tunggu pengumpulan batch sebelum di-flush (milidetik)
+FACE_BATCH_MAX_LATENCY_MS = int(os.getenv("FACE_BATCH_MAX_LATENCY_MS", "2000"))
+# Pipeline decode -> inferensi: jumlah frame sampel yang di-prefetch thread decoder (0 = tanpa thread)
+VIDEO_PREFETCH_FRAMES = int(os.getenv("VIDEO_PREFETCH_FRAMES", str(2 * FACE_BATCH_SIZE)))
+# Batas tunggu thread decoder berhenti saat job selesai/dibatalkan (thread daemon, tidak memblokir worker)
+VIDEO_PREFETCH_CLOSE_TIMEOUT_S = float(os.getenv("VIDEO_PREFETCH_CLOSE_TIMEOUT_S", "5"))
+
+# Batas crop wajah per panggilan ONNX recognition (membatasi memori blob)
+FACE_REC_MAX_BATCH = int(os.getenv("FACE_REC_MAX_BATCH", "128"))
+
+# Tracking: lewati recognition untuk wajah yang sudah teridentifikasi pada track yang sama
+VIDEO_TRACKING_ENABLED = os.getenv("VIDEO_TRACKING_ENABLED", "true").lower() == "true"
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", "0.3"))
+TRACK_MAX_CENTROID_SHIFT = float(os.getenv("TRACK_MAX_CENTROID_SHIFT", "0.5"))  # Relatif terhadap lebar wajah
+TRACK_MAX_MISSES = int(os.getenv("TRACK_MAX_MISSES", "3"))                      # Frame sampel sebelum track dibuang
+TRACK_REVERIFY_INTERVAL = int(os.getenv("TRACK_REVERIFY_INTERVAL", "10"))        # K frame sampel antar verifikasi ulang
+TRACK_CONFIRM_SCORE = float(os.getenv("TRACK_CONFIRM_SCORE", "0.65"))
+TRACK_CONFIRM_HITS = int(os.getenv("TRACK_CONFIRM_HITS", "2"))
+
+# Jumlah worker process analisis video (0 = otomatis dari jumlah core)
+VIDEO_WORKER_COUNT = int(os.getenv("VIDEO_WORKER_COUNT", "0")) or max(1, min(4, (os.cpu_count() or 2) // 2))
+
+# Pool session InsightFace di proses API (/register/ dll). 0 = otomatis
+FACE_SESSION_POOL_SIZE = int(os.getenv("FACE_SESSION_POOL_SIZE", "0")) or max(1, min(4, (os.cpu_count() or 2) // 4))
+# Batas thread intra-op per session pool (0 = bagi rata core CPU antar session)
+FACE_SESSION_INTRA_OP_THREADS = int(os.getenv("FACE_SESSION_INTRA_OP_THREADS", "0"))
+# Batas tunggu checkout session (detik) sebelum request ditolak
+FACE_SESSION_CHECKOUT_TIMEOUT_S = float(os.getenv("FACE_SESSION_CHECKOUT_TIMEOUT_S", "30"))
+
+# Streaming ingest (analisis sambil upload): container yang bisa di-decode secara parsial
+VIDEO_STREAM_EXTENSIONS = ('.mkv', '.webm', '.ts', '.mts', '.m2ts')
+# Jeda polling saat decoder sudah mengejar byte yang diterima
+VIDEO_STREAM_POLL_S = float(os.getenv("VIDEO_STREAM_POLL_S", "1.0"))
+# Upload dianggap putus jika file tidak bertambah selama N detik
+VIDEO_STREAM_STALL_TIMEOUT_S = float(os.getenv("VIDEO_STREAM_STALL_TIMEOUT_S", "120"))
+
+# Crop wajah: di-encode JPEG SEKALI, bytes yang sama ditulis ke disk & dikirim ke Emotion API
+VIDEO_CROP_MAX_SIZE = int(os.getenv("VIDEO_CROP_MAX_SIZE", "224"))
+VIDEO_CROP_JPEG_QUALITY = int(os.getenv("VIDEO_CROP_JPEG_QUALITY", "85"))
+# Batas antrian writer background (frame loop menunggu jika penuh)
+VIDEO_CROP_WRITE_QUEUE = int(os.getenv("VIDEO_CROP_WRITE_QUEUE", "64"))
+
+# Skor kualitas sample bukti: sisi wajah (px) & varians Laplacian yang dianggap "penuh"
+VIDEO_SAMPLE_REF_SIZE = int(os.getenv("VIDEO_SAMPLE_REF_SIZE", "112"))
+VIDEO_SAMPLE_SHARPNESS_REF = float(os.getenv("VIDEO_SAMPLE_SHARPNESS_REF", "150"))
+
+# Quality gate antara deteksi dan recognition: wajah di bawah ambang ini tidak di-embed sama sekali
+VIDEO_GATE_MIN_FACE_PX = int(os.getenv("VIDEO_GATE_MIN_FACE_PX", "24"))           # Sisi pendek bbox (px)
+VIDEO_GATE_MIN_DET_SCORE = float(os.getenv("VIDEO_GATE_MIN_DET_SCORE", "0.6"))
+VIDEO_GATE_MIN_SHARPNESS = float(os.getenv("VIDEO_GATE_MIN_SHARPNESS", "15"))     # Varians Laplacian 64x64 (0 = nonaktif)
+
+# Early exit ("fast attendance", opt-in per upload): berhenti jika seluruh roster sudah
+# terlihat N kali, atau tidak ada identitas baru selama jendela waktu video tertentu
+VIDEO_EARLY_EXIT_SIGHTINGS = int(os.getenv("VIDEO_EARLY_EXIT_SIGHTINGS", "3"))
+VIDEO_EARLY_EXIT_IDLE_S = float(os.getenv("VIDEO_EARLY_EXIT_IDLE_S", "600"))  # 0 = nonaktif
+
+# Segment-parallel: video panjang dibagi ke beberapa worker (segmen selaras keyframe & grid sampel)
+VIDEO_SEGMENT_PARALLEL = os.getenv("VIDEO_SEGMENT_PARALLEL", "true").lower() == "true"
+VIDEO_SEGMENT_MIN_S = float(os.getenv("VIDEO_SEGMENT_MIN_S", "300"))  # Durasi minimal per segmen
+
+# Interval (detik) pengiriman checkpoint task ke proses API untuk resume setelah restart (0 = nonaktif)
+VIDEO_CHECKPOINT_INTERVAL_S = float(os.getenv("VIDEO_CHECKPOINT_INTERVAL_S", "30"))
+
+# ==============================================================================
+# [1] DECODE STRATEGY
+# ==============================================================================
+
+DECODE_MODE_SEQUENTIAL = "sequential"  # grab() semua frame, retrieve() hanya frame sampel
+DECODE_MODE_KEYFRAME = "keyframe"      # Seek hanya ke posisi keyframe (tanpa decode ulang GOP)
+DECODE_MODE_SEEK = "seek"              # Seek ke setiap frame sampel (perilaku lama)
+DECODE_MODES = (DECODE_MODE_SEQUENTIAL, DECODE_MODE_KEYFRAME, DECODE_MODE_SEEK)
+
+
+def probe_gop_size(file_path: str) -> Tuple[Optional[int], bool]:
+    """
+    Mengukur panjang GOP (jarak antar keyframe) dengan membaca paket mentah.
+
+    Capture dibuka dalam mode raw (CAP_PROP_FORMAT = -1) sehingga grab() hanya
+    membaca paket terkompresi tanpa decode. Flag keyframe dibaca dari
+    CAP_PROP_LRF_HAS_KEY_FRAME (khusus backend FFmpeg, OpenCV >= 4.5).
+
+    Args:
+        file_path (str): Path file video.
+
+    Returns:
+        tuple: (gop_size, is_regular). gop_size = None jika backend tidak
+               mendukung probing. is_regular = True jika semua jarak keyframe
+               yang teramati sama.
+    """
+    lrf_prop = getattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME", None)
+    if lrf_prop is None:
+        return None, False
+
+    cap = cv2.VideoCapture(file_path, cv2.CAP_FFMPEG)
+    try:
+        if not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            return None, False
+
+        keyframes = []
+        packet_idx = 0
+        while packet_idx < VIDEO_GOP_PROBE_PACKETS and len(keyframes) < 4:
+            if not cap.grab():
+                break
+            if cap.get(lrf_prop):
+                keyframes.append(packet_idx)
+            packet_idx += 1
+
+        if len(keyframes) >= 2:
+            gaps = np.diff(keyframes)
+            return int(gaps.max()), bool(gaps.min() == gaps.max())
+
+        if len(keyframes) == 1 and packet_idx >= VIDEO_GOP_PROBE_PACKETS:
+            # GOP lebih panjang dari jendela probing (misal rekaman layar)
+            return packet_idx, False
+
+        return None, False
+    except Exception as e:
+        logger.warning(f"Decode: Probing GOP gagal untuk {file_path} - {e}")
+        return None, False
+    finally:
+        cap.release()
+
+
+def select_decode_mode(
+    frame_interval: int,
+    gop_size: Optional[int],
+    gop_regular: bool,
+    requested: str = VIDEO_DECODE_MODE
+) -> str:
+    """
+    Memilih strategi decode berdasarkan interval sampling dan struktur GOP.
+
+    Logic (mode 'auto'):
+    1. GOP tidak diketahui          -> sequential (tidak pernah decode ulang GOP).
+    2. Interval < GOP               -> sequential. Seek akan decode ulang dari
+                                       keyframe sebelumnya, lebih mahal daripada
+                                       grab() frame yang dilewati.
+    3. Interval >= GOP & GOP teratur -> keyframe. Sampel digeser ke posisi
+                                       keyframe sehingga seek tidak decode ulang.
+    4. Interval >= GOP & GOP acak   -> seek.
+
+    Returns:
+        str: Salah satu dari DECODE_MODES.
+    """
+    if requested in DECODE_MODES:
+        return requested
+
+    if not gop_size:
+        return DECODE_MODE_SEQUENTIAL
+    if frame_interval < gop_size:
+        return DECODE_MODE_SEQUENTIAL
+    if gop_regular:
+        return DECODE_MODE_KEYFRAME
+    return DECODE_MODE_SEEK
+
+
+def resolve_decode_strategy(file_path: str, frame_interval: int) -> Tuple[str, int]:
+    """
+    Menentukan mode decode dan interval efektif untuk satu file video.
+
+    Pada mode keyframe, interval dibulatkan ke kelipatan GOP terdekat agar setiap
+    sampel jatuh tepat di keyframe.
+
+    Returns:
+        tuple: (decode_mode, effective_interval)
+    """
+    mode, frame_interval, _, _ = _resolve_decode_strategy(file_path, frame_interval)
+    return mode, frame_interval
+
+
+def _resolve_decode_strategy(file_path: str, frame_interval: int) -> Tuple[str, int, Optional[int], bool]:
+    """resolve_decode_strategy + hasil probe GOP: (mode, interval, gop_size, gop_regular)."""
+    frame_interval = max(1, int(frame_interval))
+    gop_size, gop_regular = (None, False)
+    if VIDEO_DECODE_MODE not in (DECODE_MODE_SEQUENTIAL, DECODE_MODE_SEEK):
+        gop_size, gop_regular = probe_gop_size(file_path)
+
+    mode = select_decode_mode(frame_interval, gop_size, gop_regular)
+
+    if mode == DECODE_MODE_KEYFRAME:
+        gop = gop_size or VIDEO_DEFAULT_GOP
+        frame_interval = max(1, round(frame_interval / gop)) * gop
+
+    logger.debug(
+        f"Decode: mode={mode}, interval={frame_interval}, "
+        f"gop={gop_size or 'unknown'} ({'regular' if gop_regular else 'irregular'})"
+    )
+    return mode, frame_interval, gop_size, gop_regular
+
+
+def plan_video_segments(file_path: str, frame_skip: int, max_segments: int) -> Dict[str, Any]:
+    """
+    Rencana pembagian satu video menjadi segmen untuk diproses paralel.
+
+    Batas segmen dibulatkan ke kelipatan interval sampel (posisi sampel identik
+    dengan pemrosesan sekuensial) dan, jika GOP teratur, juga ke kelipatan GOP
+    sehingga setiap segmen dimulai tepat di keyframe (seek tanpa decode ulang).
+
+    Returns:
+        dict: {'decode_mode', 'frame_interval', 'fps', 'total_frames', 'segments': [(start, end)]}
+    """
+    cap = cv2.VideoCapture(file_path)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+        fps = (cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0) or 30
+    finally:
+        cap.release()
+
+    frame_interval = frame_skip or int(fps * 1.5)
+    mode, frame_interval, gop_size, gop_regular = _resolve_decode_strategy(file_path, frame_interval)
+    plan = {
+        'decode_mode': mode,
+        'frame_interval': frame_interval,
+        'fps': fps,
+        'total_frames': total_frames,
+        'segments': [(0, total_frames)]
+    }
+
+    count = min(max_segments, int(total_frames // max(1, int(fps * VIDEO_SEGMENT_MIN_S))))
+    if total_frames <= 0 or count <= 1:
+        return plan
+
+    align = frame_interval
+    if gop_size and gop_regular:
+        aligned = int(np.lcm(frame_interval, gop_size))
+        # Kelipatan bersama yang terlalu besar membuat segmen timpang; cukup selaras grid sampel
+        if aligned <= total_frames // (count * 4):
+            align = aligned
+
+    bounds = [0]
+    for i in range(1, count):
+        bound = int(round(total_frames * i / count / align)) * align
+        if bounds[-1] < bound < total_frames:
+            bounds.append(bound)
+    bounds.append(total_frames)
+    plan['segments'] = list(zip(bounds[:-1], bounds[1:]))
+    return plan
+
+
+def iter_sampled_frames(
+    cap: cv2.VideoCapture,
+    mode: str,
+    frame_interval: int,
+    total_frames: int,
+    start_frame: int = 0
+) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Generator frame sampel sesuai strategi decode.
+
+    - sequential : grab() setiap frame (paket tetap di-decode karena referensi
+                   inter-frame), retrieve() (konversi warna + copy) hanya untuk
+                   frame sampel. Tidak ada seek sama sekali.
+    - keyframe / seek : set(CAP_PROP_POS_FRAMES) lalu read() per sampel.
+
+    Args:
+        cap: VideoCapture yang sudah terbuka.
+        mode: Salah satu dari DECODE_MODES.
+        frame_interval: Jarak antar frame sampel.
+        total_frames: Jumlah frame (<= 0 berarti tidak diketahui, baca sampai EOF).
+        start_frame: Index frame awal.
+
+    Yields:
+        tuple: (frame_idx, frame_bgr)
+    """
+    frame_interval = max(1, int(frame_interval))
+
+    if mode == DECODE_MODE_SEQUENTIAL:
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_idx = start_frame
+        next_sample = start_frame
+        while total_frames <= 0 or frame_idx < total_frames:
+            if not cap.grab():
+                break
+            if frame_idx == next_sample:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                yield frame_idx, frame
+                next_sample += frame_interval
+            frame_idx += 1
+        return
+
+    # Mode keyframe & seek: lompat langsung ke posisi sampel
+    frame_idx = start_frame
+    while total_frames <= 0 or frame_idx < total_frames:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        ret, frame = cap.read()
+        if not ret:
+            break
+        yield frame_idx, frame
+        frame_idx += frame_interval
+
+
+def upload_marker_path(file_path: str) -> str:
+    """File penanda bahwa `file_path` masih di-upload (dihapus saat upload selesai)."""
+    return f"{file_path}.uploading"
+
+
+def cancel_marker_path(file_path: str) -> str:
+    """File penanda permintaan pembatalan analisis untuk `file_path` (DELETE /analyze/{task_id})."""
+    return f"{file_path}.cancel"
+
+
+class AnalysisCancelled(Exception):
+    """Frame loop dihentikan karena task dibatalkan oleh user."""
+
+
+class AnalysisInterrupted(Exception):
+    """Frame loop dihentikan karena server shutdown; task dilanjutkan dari checkpoint terakhir."""
+
+
+def is_streamable_upload(filename: str, head: bytes) -> bool:
+    """
+    Cek apakah upload bisa dianalisis sebelum file lengkap.
+
+    MKV/WebM/MPEG-TS selalu bisa dibaca parsial. MP4 hanya jika fragmented
+    (box 'mvex'/'moof' di awal file); MP4 biasa menaruh index 'moov' di akhir.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in VIDEO_STREAM_EXTENSIONS:
+        return True
+    return b'moof' in head or b'mvex' in head
+
+
+class StreamingFrameSource:
+    """
+    Iterator frame sampel dari file video yang masih bertambah (upload berjalan).
+
+    Decode sequential (grab/retrieve). Saat decoder mencapai akhir byte yang
+    tersedia, capture ditutup, menunggu data baru, lalu dibuka ulang dan
+    dilanjutkan dari frame terakhir. Selesai ketika penanda upload sudah hilang
+    SEBELUM capture dibuka (berarti seluruh file sudah terbaca).
+
+    Attributes:
+        total_frames: Jumlah frame pada bagian file yang sudah tersedia.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        frame_interval: int,
+        start_frame: int = 0,
+        stop_check: Optional[Callable[[], bool]] = None
+    ):
+        self.file_path = file_path
+        # Dipanggil setiap polling: True = berhenti menunggu data (shutdown / prefetcher ditutup)
+        self.stop_check = stop_check
+        self.marker_path = upload_marker_path(file_path)
+        self.frame_interval = max(1, int(frame_interval))
+        self.start_frame = start_frame
+        self.total_frames = 0
+        self.reopens = 0
+
+    @property
+    def uploading(self) -> bool:
+        return os.path.exists(self.marker_path)
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        frame_idx = self.start_frame
+        next_sample = self.start_frame
+        last_size, last_growth = -1, time.monotonic()
+
+        while True:
+            # Dicek sebelum file: saat dibatalkan, file/penanda upload bisa sudah tidak ada
+            if os.path.exists(cancel_marker_path(self.file_path)):
+                raise AnalysisCancelled("Task dibatalkan saat menunggu upload")
+            if self.stop_check is not None and self.stop_check():
+                raise AnalysisInterrupted("Analisis streaming dihentikan")
+            uploading = self.uploading
+            size = os.path.getsize(self.file_path) if os.path.exists(self.file_path) else -1
+            if size < 0:
+                raise RuntimeError("File video hilang saat upload berlangsung.")
+
+            if size != last_size:
+                last_size, last_growth = size, time.monotonic()
+
+                cap = cv2.VideoCapture(self.file_path)
+                try:
+                    if cap.isOpened():
+                        self.total_frames = max(self.total_frames, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+                        if frame_idx > 0:
+                            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+                        while cap.grab():
+                            if frame_idx == next_sample:
+                                ret, frame = cap.retrieve()
+                                if not ret:
+                                    break
+                                yield frame_idx, frame
+                                next_sample += self.frame_interval
+                            frame_idx += 1
+                    elif not uploading:
+                        raise RuntimeError("Gagal membuka file video. Format mungkin tidak didukung.")
+                finally:
+                    cap.release()
+                self.reopens += 1
+
+            if not uploading:
+                self.total_frames = max(self.total_frames, frame_idx)
+                return
+            if time.monotonic() - last_growth > VIDEO_STREAM_STALL_TIMEOUT_S:
+                raise RuntimeError("Upload video terhenti (tidak ada data baru).")
+            time.sleep(VIDEO_STREAM_POLL_S)
+
+
+class AdaptiveFrameSampler:
+    """
+    Filter frame kandidat berdasarkan perubahan scene.
+
+    Setiap frame kandidat diperkecil ke thumbnail grayscale (lebar 64px) lalu
+    dibandingkan dengan thumbnail frame TERAKHIR YANG DIANALISIS. Frame hanya
+    diteruskan ke deteksi jika selisihnya >= threshold (ada gerakan / orang baru),
+    atau jika jarak dari sampel terakhir sudah mencapai max_interval.
+
+    Karena pembanding adalah frame terakhir yang dianalisis (bukan kandidat
+    sebelumnya), perubahan lambat tetap terakumulasi dan akhirnya memicu sampel.
+    """
+
+    def __init__(self, max_interval: int, threshold: float = VIDEO_SCENE_CHANGE_THRESHOLD):
+        self.max_interval = max(1, int(max_interval))
+        self.threshold = threshold
+        self.candidates = 0
+        self.skipped = 0
+
+    @staticmethod
+    def thumbnail(frame: np.ndarray) -> np.ndarray:
+        h, w = frame.shape[:2]
+        thumb_h = max(1, int(h * VIDEO_SCENE_THUMB_WIDTH / w))
+        small = cv2.resize(frame, (VIDEO_SCENE_THUMB_WIDTH, thumb_h), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+    def filter(self, frame_iter: Iterator[Tuple[int, np.ndarray]]) -> Iterator[Tuple[int, np.ndarray]]:
+        last_thumb: Optional[np.ndarray] = None
+        last_idx = 0
+
+        for frame_idx, frame in frame_iter:
+            self.candidates += 1
+            thumb = self.thumbnail(frame)
+
+            if (
+                last_thumb is None
+                or frame_idx - last_idx >= self.max_interval
+                or float(np.mean(np.abs(thumb - last_thumb))) >= self.threshold
+            ):
+                last_thumb, last_idx = thumb, frame_idx
+                yield frame_idx, frame
+            else:
+                self.skipped += 1
+
+
+# ==============================================================================
+# [2] FACE MODEL FACTORY
+# ==============================================================================
+
+def create_face_app(
+    model_name: str = INSIGHTFACE_MODEL_NAME,
+    providers: Optional[List[str]] = None,
+    det_size: Tuple[int, int] = INSIGHTFACE_DET_SIZE,
+    intra_op_threads: int = 0,
+    allowed_modules: Optional[List[str]] = None,
+    int8_dir: Optional[str] = None
+):
+    """
+    Membuat dan menyiapkan instance InsightFace FaceAnalysis.
+
+    Hanya modul di `allowed_modules` (default INSIGHTFACE_MODULES) yang dimuat,
+    sehingga model yang tidak dipakai tidak memakan memori session maupun
+    panggilan ONNX per wajah. Whitelist/model pack tanpa 'detection' atau
+    'recognition' ditolak (ValueError) agar gagal saat startup, bukan di wajah pertama.
+
+    Jika `int8_dir` berisi file ONNX INT8 untuk modul INSIGHTFACE_INT8_MODULES,
+    session modul tersebut diganti dengan model terkuantisasi. Nama input/output
+    dan preprocessing identik, sehingga kode inferensi tidak berubah.
+
+    FaceAnalysis tidak meneruskan SessionOptions ke ONNX Runtime, sehingga jika
+    intra_op_threads > 0 setiap session dibuat ulang dengan batas thread tersebut.
+    Ini mencegah beberapa worker saling berebut seluruh core CPU.
+
+    Args:
+        model_name (str): Nama model pack (misal 'buffalo_l').
+        providers (list): ONNX Runtime execution providers.
+        det_size (tuple): Ukuran input detektor.
+        intra_op_threads (int): Batas thread intra-op per session (0 = default ORT).
+        allowed_modules (list): Whitelist taskname modul (misal ['detection', 'recognition']).
+        int8_dir (str): Direktori model INT8 (None = INSIGHTFACE_INT8_DIR, "" = paksa FP32).
+
+    Returns:
+        FaceAnalysis: Instance yang siap dipakai (.get()).
+    """
+    providers = providers or INSIGHTFACE_PROVIDERS
+    allowed_modules = allowed_modules or INSIGHTFACE_MODULES
+    missing = [m for m in INSIGHTFACE_REQUIRED_MODULES if m not in allowed_modules]
+    if missing:
+        raise ValueError(
+            f"INSIGHTFACE_MODULES={','.join(allowed_modules)} harus memuat {', '.join(missing)} "
+            f"(wajib: {', '.join(INSIGHTFACE_REQUIRED_MODULES)})"
+        )
+
+    from insightface.app import FaceAnalysis
+    face_app = FaceAnalysis(name=model_name, providers=providers, allowed_modules=allowed_modules)
+    missing = [m for m in INSIGHTFACE_REQUIRED_MODULES if m not in face_app.models]
+    if missing:
+        raise ValueError(f"Model pack '{model_name}' tidak memiliki modul {', '.join(missing)}")
+
+    int8_dir = INSIGHTFACE_INT8_DIR if int8_dir is None else int8_dir
+    model_files = {}
+    if int8_dir:
+        for taskname, model in face_app.models.items():
+            if taskname not in INSIGHTFACE_INT8_MODULES:
+                continue
+            int8_file = os.path.join(int8_dir, os.path.basename(model.model_file))
+            if os.path.exists(int8_file):
+                model_files[taskname] = int8_file
+            else:
+                logger.warning(f"Model INT8 untuk '{taskname}' tidak ditemukan ({int8_file}), tetap FP32")
+
+    if intra_op_threads > 0 or model_files:
+        import onnxruntime as ort
+        sess_options = ort.SessionOptions()
+        if intra_op_threads > 0:
+            sess_options.intra_op_num_threads = intra_op_threads
+            sess_options.inter_op_num_threads = 1
+        for taskname, model in face_app.models.items():
+            model_file = model_files.get(taskname, model.model_file)
+            if intra_op_threads <= 0 and model_file == model.model_file:
+                continue
+            model.session = ort.InferenceSession(model_file, sess_options=sess_options, providers=providers)
+            model.model_file = model_file
+        if model_files:
+            logger.info(f"InsightFace INT8: {', '.join(sorted(model_files))} dari {int8_dir}")
+
+    face_app.prepare(ctx_id=0, det_size=det_size)
+    return face_app
+
+
+def create_light_recognizer(
+    model_name: str = VIDEO_CASCADE_LIGHT_MODEL,
+    providers: Optional[List[str]] = None,
+    intra_op_threads: int = 0
+):
+    """
+    Model recognition ringan untuk cascade (ArcFace dari model pack lain, misal buffalo_sc).
+
+    Alignment memakai kps dari detektor utama, sehingga hanya modul recognition
+    yang dipakai (FaceAnalysis tetap mewajibkan detection ikut dimuat).
+    """
+    face_app = create_face_app(
+        model_name=model_name, providers=providers, intra_op_threads=intra_op_threads,
+        allowed_modules=['detection', 'recognition'], int8_dir=""
+    )
+    rec_model = face_app.models.get('recognition')
+    if rec_model is None:
+        raise RuntimeError(f"Model pack {model_name} tidak memiliki modul recognition")
+    return rec_model
+
+
+def light_face_embedding(rec_model, img: np.ndarray, face: Any) -> np.ndarray:
+    """Embedding model ringan (ter-normalisasi L2) untuk wajah yang sudah dideteksi model utama."""
+    from insightface.utils import face_align
+
+    crop = face_align.norm_crop(img, landmark=face.kps, image_size=rec_model.input_size[0])
+    emb = rec_model.get_feat(crop).flatten()
+    return emb / np.linalg.norm(emb)
+
+
+class FaceSessionPool:
+    """
+    Pool K instance FaceAnalysis untuk inferensi konkuren di satu proses.
+
+    Setiap instance memiliki session ONNX Runtime sendiri dengan batas thread
+    intra-op, sehingga request paralel tidak berebut satu objek / thread pool.
+    Pemakaian:
+
+        with pool.checkout() as face_app:
+            faces = face_app.get(img)
+
+    atau dari coroutine: `await pool.run(lambda app: app.get(img))`.
+    """
+
+    def __init__(
+        self,
+        size: int = FACE_SESSION_POOL_SIZE,
+        intra_op_threads: int = FACE_SESSION_INTRA_OP_THREADS,
+        checkout_timeout: float = FACE_SESSION_CHECKOUT_TIMEOUT_S,
+        **factory_kwargs
+    ):
+        self.size = max(1, int(size))
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // self.size)
+        self.checkout_timeout = checkout_timeout
+        self._idle: "queue.Queue[Any]" = queue.Queue()
+        self.checkouts = 0
+        self.waits = 0
+
+        for _ in range(self.size):
+            self._idle.put(create_face_app(intra_op_threads=self.intra_op_threads, **factory_kwargs))
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        """Pinjam satu instance; dikembalikan ke pool saat keluar dari blok."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        if self._idle.empty():
+            self.waits += 1
+        try:
+            face_app = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Semua session InsightFace sedang dipakai.")
+        self.checkouts += 1
+        try:
+            yield face_app
+        finally:
+            self._idle.put(face_app)
+
+    def _run_checked_out(self, fn, *args):
+        with self.checkout() as face_app:
+            return fn(face_app, *args)
+
+    async def run(self, fn, *args):
+        """Jalankan fn(face_app, *args) di thread terpisah dengan session dari pool."""
+        return await asyncio.to_thread(self._run_checked_out, fn, *args)
+
+    def stats(self) -> Dict[str, int]:
+        idle = self._idle.qsize()
+        return {
+            "size": self.size,
+            "idle": idle,
+            "in_use": self.size - idle,
+            "intra_op_threads": self.intra_op_threads,
+            "checkouts": self.checkouts,
+            "waits": self.waits
+        }
+
+
+def match_embedding(
+    known_matrix: Optional[np.ndarray],
+    known_ids: List[str],
+    embedding: np.ndarray,
+    threshold: float
+) -> Tuple[str, float]:
+    """
+    Vector search: cosine similarity antara satu embedding dan seluruh galeri.
+
+    Args:
+        known_matrix (np.ndarray): Matrix galeri (N, 512), sudah dinormalisasi L2.
+        known_ids (list): NIM untuk setiap baris matrix.
+        embedding (np.ndarray): Embedding wajah input (512,).
+        threshold (float): Ambang batas kemiripan.
+
+    Returns:
+        tuple: (NIM_Found, Similarity_Score) atau ("Unknown", 0.0)
+    """
+    if known_matrix is None or len(known_ids) == 0:
+        return "Unknown", 0.0
+
+    norm_emb = embedding / np.linalg.norm(embedding)
+    scores = np.dot(known_matrix, norm_emb)
+    best_idx = int(np.argmax(scores))
+    max_score = float(scores[best_idx])
+
+    if max_score > threshold:
+        return known_ids[best_idx], max_score
+    return "Unknown", 0.0
+
+
+def identify_for_job(job: Dict[str, Any], embedding: np.ndarray) -> Tuple[str, float]:
+    """
+    Identifikasi terhadap indeks job (biasanya hanya mahasiswa enrolled di jadwal).
+    Jika tidak cocok dan job membawa indeks fallback (galeri global), coba di sana.
+    """
+    nim, score = match_embedding(job['known_matrix'], job['known_ids'], embedding, job['threshold'])
+    if nim == "Unknown" and job.get('fallback_matrix') is not None:
+        return match_embedding(job['fallback_matrix'], job['fallback_ids'], embedding, job['threshold'])
+    return nim, score
+
+
+def cascade_match(
+    embeddings: np.ndarray,
+    light_ids: List[str],
+    light_matrix: np.ndarray,
+    accept_score: float = VIDEO_CASCADE_ACCEPT_SCORE,
+    margin: float = VIDEO_CASCADE_MARGIN,
+    reject_score: float = 0.0
+) -> List[Optional[Tuple[str, float]]]:
+    """
+    Keputusan tahap ringan cascade untuk N embedding sekaligus (satu matmul N x G).
+
+    Returns:
+        list: Per wajah, (NIM, skor) jika diterima, ("Unknown", 0.0) jika ditolak,
+              atau None jika ambigu (harus di-embed ulang dengan model berat).
+    """
+    norm = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scores = norm @ light_matrix.T
+    best = np.argmax(scores, axis=1)
+    top1 = scores[np.arange(len(scores)), best]
+    top2 = np.partition(scores, -2, axis=1)[:, -2] if scores.shape[1] > 1 else np.full(len(scores), -1.0)
+
+    decisions: List[Optional[Tuple[str, float]]] = []
+    for i in range(len(scores)):
+        if top1[i] >= accept_score and top1[i] - top2[i] >= margin:
+            decisions.append((light_ids[int(best[i])], float(top1[i])))
+        elif reject_score > 0 and top1[i] < reject_score:
+            decisions.append(("Unknown", 0.0))
+        else:
+            decisions.append(None)
+    return decisions
+
+
+def identify_face(job: Dict[str, Any], face: Any) -> Tuple[str, float]:
+    """Identitas wajah: hasil tahap ringan cascade jika ada, selain itu embedding model utama."""
+    if face.cascade_match is not None:
+        # Face.__setattr__ menyimpan tuple sebagai list
+        nim, score = face.cascade_match
+        return nim, score
+    return identify_for_job(job, face.embedding)
+
+# ==============================================================================
+# [3] BATCHED INFERENCE
+# ==============================================================================
+
+def iter_frame_batches(
+    frame_iter: Iterable[Tuple[int, np.ndarray]],
+    batch_size: int = FACE_BATCH_SIZE,
+    max_latency_ms: int = FACE_BATCH_MAX_LATENCY_MS
+) -> Iterator[List[Tuple[int, np.ndarray]]]:
+    """
+    Mengelompokkan frame sampel menjadi batch.
+
+    Batch di-flush saat jumlahnya mencapai batch_size ATAU frame tertua sudah
+    menunggu lebih dari max_latency_ms (misal decode lambat pada GOP panjang /
+    upload streaming tersendat), sehingga progress tetap bergerak.
+
+    Dengan FramePrefetcher, batas latency berupa timeout sungguhan: batch parsial
+    di-flush walau frame berikutnya belum tersedia. Tanpa prefetch, decode berjalan
+    di thread yang sama sehingga batas hanya bisa dicek saat frame baru tiba.
+    """
+    max_latency_s = max_latency_ms / 1000.0
+    if isinstance(frame_iter, FramePrefetcher):
+        yield from _iter_prefetched_batches(frame_iter, batch_size, max_latency_s)
+        return
+
+    batch: List[Tuple[int, np.ndarray]] = []
+    batch_started = 0.0
+
+    for item in frame_iter:
+        if not batch:
+            batch_started = time.monotonic()
+        batch.append(item)
+        if len(batch) >= batch_size or (time.monotonic() - batch_started) >= max_latency_s:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _iter_prefetched_batches(
+    prefetcher: "FramePrefetcher",
+    batch_size: int,
+    max_latency_s: float
+) -> Iterator[List[Tuple[int, np.ndarray]]]:
+    """iter_frame_batches untuk FramePrefetcher: menunggu frame dengan queue.get(timeout=sisa latency)."""
+    batch: List[Tuple[int, np.ndarray]] = []
+    deadline = 0.0
+
+    while True:
+        timeout = max(0.0, deadline - time.monotonic()) if batch else None
+        try:
+            item = prefetcher.get(timeout=timeout)
+        except queue.Empty:
+            yield batch
+            batch = []
+            continue
+        if item is None:
+            break
+        if not batch:
+            deadline = time.monotonic() + max_latency_s
+        batch.append(item)
+        if len(batch) >= batch_size or time.monotonic() >= deadline:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+class FramePrefetcher:
+    """
+    Producer-consumer antara decode dan inferensi.
+
+    Thread decoder menjalankan frame_iter (decode + sampling adaptif) dan
+    `prepare` (letterbox ke input detektor) lalu memasukkan frame ke antrian
+    terbatas. Thread utama mengambil frame dan menjalankan inferensi, sehingga
+    decode frame berikutnya berjalan bersamaan dengan inferensi batch saat ini.
+    cv2 melepas GIL saat decode/resize dan ONNX Runtime saat inferensi.
+    Antrian penuh = decoder menunggu (back-pressure).
+    """
+
+    _DONE = object()
+
+    def __init__(
+        self,
+        frame_iter: Iterator[Tuple[int, np.ndarray]],
+        prepare=None,
+        depth: int = VIDEO_PREFETCH_FRAMES,
+        profiler: Optional["StageProfiler"] = None,
+        stop_event: Optional[threading.Event] = None
+    ):
+        self.frame_iter = frame_iter
+        self.prepare = prepare
+        self.profiler = profiler
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, depth))
+        self.prepared: Dict[int, Any] = {}
+        # Di-set oleh close(); sumber frame yang bisa menunggu lama (StreamingFrameSource)
+        # ikut memantau event yang sama lewat stop_check agar thread decoder bisa berhenti
+        self._stop = stop_event or threading.Event()
+        self._finished = False
+        self._thread = threading.Thread(target=self._produce, name="frame-prefetch", daemon=True)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for frame_idx, frame in self.frame_iter:
+                if self.prepare is not None:
+                    self.prepared[frame_idx] = self.prepare(frame)
+                if not self._put((frame_idx, frame)):
+                    return
+            self._put(self._DONE)
+        except BaseException as e:
+            self._put(e)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Ambil frame berikutnya (memulai thread decoder saat pertama dipanggil).
+
+        Returns None jika decoder selesai; raise queue.Empty jika timeout habis,
+        atau exception dari decoder.
+        """
+        if self._finished:
+            return None
+        if not self._thread.is_alive() and self._thread.ident is None:
+            self._thread.start()
+        start = time.perf_counter()
+        try:
+            item = self.queue.get(timeout=timeout)
+        finally:
+            if self.profiler is not None:
+                self.profiler.add('prefetch_wait', time.perf_counter() - start, 0)
+        if item is self._DONE:
+            self._finished = True
+            return None
+        if isinstance(item, BaseException):
+            self._finished = True
+            raise item
+        return item
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        while True:
+            item = self.get()
+            if item is None:
+                return
+            yield item
+
+    def take_prepared(self, frame_indices: List[int]) -> List[Any]:
+        """Ambil (dan buang dari cache) hasil prepare untuk frame dalam satu batch."""
+        return [self.prepared.pop(idx, None) for idx in frame_indices]
+
+    def close(self, timeout: float = VIDEO_PREFETCH_CLOSE_TIMEOUT_S):
+        """
+        Hentikan thread decoder (misal saat early exit / pembatalan) dan tunggu maksimal
+        `timeout` detik. Thread yang belum berhenti (decode/IO macet) dibiarkan sebagai daemon.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"Thread prefetch belum berhenti setelah {timeout:.0f}s, dilepas")
+        self.prepared.clear()
+
+
+def _load_room_rois(raw: str) -> Dict[str, Tuple[float, float, float, float]]:
+    """Parse VIDEO_ROOM_ROI. Entri tidak valid diabaikan dengan warning."""
+    if not raw.strip():
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        logger.warning(f"VIDEO_ROOM_ROI bukan JSON valid, ROI diabaikan - {e}")
+        return {}
+
+    rois = {}
+    for room, box in (data.items() if isinstance(data, dict) else []):
+        try:
+            x0, y0, x1, y1 = (min(max(float(v), 0.0), 1.0) for v in box)
+        except (TypeError, ValueError):
+            logger.warning(f"VIDEO_ROOM_ROI[{room}] harus [x0, y0, x1, y1], diabaikan")
+            continue
+        if x1 <= x0 or y1 <= y0:
+            logger.warning(f"VIDEO_ROOM_ROI[{room}] kosong, diabaikan")
+            continue
+        rois[str(room).strip()] = (x0, y0, x1, y1)
+    return rois
+
+
+VIDEO_ROOM_ROI = _load_room_rois(VIDEO_ROOM_ROI_RAW)
+
+
+def room_roi(kode_ruang: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """ROI deteksi (pecahan frame) untuk ruang tertentu, atau None (seluruh frame)."""
+    if not kode_ruang:
+        return None
+    return VIDEO_ROOM_ROI.get(kode_ruang.strip())
+
+
+def _ceil32(value: float) -> int:
+    return max(32, int(math.ceil(value / 32.0)) * 32)
+
+
+class DetectionLayout:
+    """
+    Jendela deteksi per frame untuk satu job video.
+
+    Setiap jendela (x0, y0, x1, y1) dipotong dari frame, di-letterbox ke
+    input_size, dideteksi, lalu bbox/kps digeser kembali ke koordinat frame.
+    ROI ruang membatasi area deteksi sehingga biaya hanya dipakai di area kursi.
+
+    Pada mode 'tiled', sisi tile yang berada di dalam ROI ditandai 'interior':
+    wajah yang terpotong di sisi tersebut dibuang karena tile tetangga (overlap)
+    atau view penuh sudah memuatnya utuh.
+    """
+
+    def __init__(
+        self,
+        mode: str = VIDEO_DETECT_MODE,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        base_size: Tuple[int, int] = INSIGHTFACE_DET_SIZE,
+        dynamic_input: bool = True,
+        max_size: int = VIDEO_DETECT_MAX_SIZE,
+        tile_size: int = VIDEO_DETECT_TILE_SIZE,
+        tile_overlap: float = VIDEO_DETECT_TILE_OVERLAP
+    ):
+        if mode not in ("fixed", "auto", "tiled"):
+            logger.warning(f"VIDEO_DETECT_MODE '{mode}' tidak dikenal, pakai 'fixed'")
+            mode = "fixed"
+        if mode == "auto" and not dynamic_input:
+            logger.warning("Detektor tidak mendukung ukuran input dinamis, VIDEO_DETECT_MODE=auto -> fixed")
+            mode = "fixed"
+        self.mode = mode
+        self.roi = tuple(roi) if roi else None
+        self.base_size = tuple(base_size)
+        self.max_size = max(max_size, max(self.base_size))
+        self.tile_size = max(tile_size, 64)
+        self.tile_overlap = min(max(tile_overlap, 0.0), 0.5)
+        self._plans: Dict[Tuple[int, int], Tuple[Tuple[int, int], List[Any]]] = {}
+
+    @property
+    def is_default(self) -> bool:
+        """True jika identik dengan FaceAnalysis.get (satu view penuh, det_size default)."""
+        return self.mode == "fixed" and self.roi is None
+
+    def _roi_box(self, width: int, height: int) -> Tuple[int, int, int, int]:
+        if not self.roi:
+            return 0, 0, width, height
+        x0, y0, x1, y1 = self.roi
+        box = (int(x0 * width), int(y0 * height), int(math.ceil(x1 * width)), int(math.ceil(y1 * height)))
+        if box[2] - box[0] < 32 or box[3] - box[1] < 32:
+            return 0, 0, width, height
+        return box
+
+    def _tile_starts(self, lo: int, hi: int) -> List[int]:
+        span = hi - lo
+        if span <= self.tile_size:
+            return [lo]
+        step = self.tile_size * (1.0 - self.tile_overlap)
+        count = int(math.ceil((span - self.tile_size) / step)) + 1
+        return [int(round(v)) for v in np.linspace(lo, hi - self.tile_size, count)]
+
+    def plan(self, width: int, height: int) -> Tuple[Tuple[int, int], List[Any]]:
+        """
+        Returns:
+            tuple: (input_size (w, h), [((x0, y0, x1, y1), (kiri, atas, kanan, bawah) interior), ...])
+        """
+        key = (width, height)
+        if key in self._plans:
+            return self._plans[key]
+
+        rx0, ry0, rx1, ry1 = roi = self._roi_box(width, height)
+        rw, rh = rx1 - rx0, ry1 - ry0
+        full_view = (roi, (False, False, False, False))
+        input_size = self.base_size
+        windows = [full_view]
+
+        if self.mode == "auto":
+            # Sisi panjang ROI dipertahankan (tanpa downscale) hingga max_size
+            target = min(max(rw, rh, max(self.base_size)), self.max_size)
+            scale = target / float(max(rw, rh))
+            input_size = (_ceil32(rw * scale), _ceil32(rh * scale))
+        elif self.mode == "tiled" and max(rw, rh) > self.tile_size * 1.25:
+            tiles = []
+            for ty in self._tile_starts(ry0, ry1):
+                for tx in self._tile_starts(rx0, rx1):
+                    tx1, ty1 = min(tx + self.tile_size, rx1), min(ty + self.tile_size, ry1)
+                    tiles.append(((tx, ty, tx1, ty1), (tx > rx0, ty > ry0, tx1 < rx1, ty1 < ry1)))
+            # View penuh tetap ikut untuk wajah besar (dekat kamera) yang melebihi satu tile
+            windows = [full_view] + tiles
+
+        logger.info(
+            f"Detection layout {width}x{height}: mode={self.mode}, roi={roi}, "
+            f"input={input_size[0]}x{input_size[1]}, {len(windows)} view/frame"
+        )
+        self._plans[key] = (input_size, windows)
+        return self._plans[key]
+
+
+class BatchedFaceAnalyzer:
+    """
+    Jalur inferensi batch di atas model yang sudah dimuat oleh FaceAnalysis.
+
+    Alur per batch:
+    1. Deteksi (SCRFD) atas N frame sekaligus dalam satu session.run.
+    2. Alignment (norm_crop 112x112) semua wajah dari N frame tersebut.
+    3. Recognition (ArcFace) atas seluruh crop dalam satu session.run.
+
+    Hanya bbox, kps, det_score, dan embedding yang dihasilkan. Model lain di pack
+    (landmark, genderage) tidak dijalankan karena tidak dipakai oleh analyzer.
+
+    Jika model ONNX tidak mendukung batch dinamis, analyzer otomatis kembali ke
+    inferensi per frame / per wajah.
+
+    Dengan DetectionLayout, satu frame bisa menjadi beberapa view (ROI, tile,
+    atau det_size lebih besar). Semua view dari satu batch frame dijalankan
+    bersama (chunk batch_size gambar per session.run) lalu digabung per frame
+    dengan NMS.
+    """
+
+    def __init__(self, face_app, batch_size: int = FACE_BATCH_SIZE, light_rec_model=None):
+        self.face_app = face_app
+        self.det_model = face_app.det_model
+        self.rec_model = face_app.models.get('recognition')
+        # Model recognition ringan untuk cascade (None = cascade nonaktif)
+        self.light_rec_model = light_rec_model
+        self.batch_size = max(1, batch_size)
+        self.input_size = tuple(self.det_model.input_size or INSIGHTFACE_DET_SIZE)
+        # Input SCRFD dinamis (buffalo_l) -> det_size bisa diubah per job (VIDEO_DETECT_MODE=auto)
+        det_shape = self.det_model.session.get_inputs()[0].shape
+        self.dynamic_input = not isinstance(det_shape[2], int)
+        self._det_batchable = True
+        self._rec_batchable = True
+        self._center_cache: Dict[Tuple[int, int, int], np.ndarray] = {}
+
+    # --- Deteksi ---
+    def create_layout(self, roi: Optional[Tuple[float, float, float, float]] = None) -> DetectionLayout:
+        """DetectionLayout untuk satu job (mode dari VIDEO_DETECT_MODE)."""
+        return DetectionLayout(roi=roi, base_size=self.input_size, dynamic_input=self.dynamic_input)
+
+    def _letterbox(self, img: np.ndarray, input_size: Optional[Tuple[int, int]] = None) -> Tuple[np.ndarray, float]:
+        """Resize dengan rasio tetap + padding ke input_size (identik dengan SCRFD.detect)."""
+        in_w, in_h = input_size or self.input_size
+        im_ratio = float(img.shape[0]) / img.shape[1]
+        model_ratio = float(in_h) / in_w
+        if im_ratio > model_ratio:
+            new_h = in_h
+            new_w = int(new_h / im_ratio)
+        else:
+            new_w = in_w
+            new_h = int(new_w * im_ratio)
+        det_scale = float(new_h) / img.shape[0]
+        det_img = np.zeros((in_h, in_w, 3), dtype=np.uint8)
+        det_img[:new_h, :new_w, :] = cv2.resize(img, (new_w, new_h))
+        return det_img, det_scale
+
+    def _anchor_centers(self, height: int, width: int, stride: int) -> np.ndarray:
+        key = (height, width, stride)
+        if key not in self._center_cache:
+            centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            centers = (centers * stride).reshape((-1, 2))
+            num_anchors = self.det_model._num_anchors
+            if num_anchors > 1:
+                centers = np.stack([centers] * num_anchors, axis=1).reshape((-1, 2))
+            self._center_cache[key] = centers
+        return self._center_cache[key]
+
+    @staticmethod
+    def _slice_output(out: np.ndarray, b: int, n: int) -> np.ndarray:
+        """Ambil output milik gambar ke-b. Model non-batched menumpuk batch di dimensi 0."""
+        if out.ndim == 3:
+            return out[b]
+        return out.reshape(n, -1, out.shape[-1])[b]
+
+    def _decode_detections(self, net_outs, b: int, n: int, det_scale: float, input_size: Tuple[int, int]):
+        det = self.det_model
+        in_w, in_h = input_size
+        fmc = det.fmc
+        scores_list, bboxes_list, kpss_list = [], [], []
+
+        for idx, stride in enumerate(det._feat_stride_fpn):
+            scores = self._slice_output(net_outs[idx], b, n)
+            bbox_preds = self._slice_output(net_outs[idx + fmc], b, n) * stride
+            centers = self._anchor_centers(in_h // stride, in_w // stride, stride)
+
+            pos_inds = np.where(scores >= det.det_thresh)[0]
+            bboxes = np.hstack([centers - bbox_preds[:, 0:2], centers + bbox_preds[:, 2:4]])
+            scores_list.append(scores[pos_inds])
+            bboxes_list.append(bboxes[pos_inds])
+
+            if det.use_kps:
+                kps_preds = self._slice_output(net_outs[idx + fmc * 2], b, n) * stride
+                kpss = np.tile(centers, (1, kps_preds.shape[1] // 2)) + kps_preds
+                kpss_list.append(kpss.reshape((kpss.shape[0], -1, 2))[pos_inds])
+
+        scores = np.vstack(scores_list)
+        order = scores.ravel().argsort()[::-1]
+        bboxes = np.vstack(bboxes_list) / det_scale
+        pre_det = np.hstack((bboxes, scores)).astype(np.float32, copy=False)[order, :]
+        keep = det.nms(pre_det)
+        kpss = None
+        if det.use_kps:
+            kpss = (np.vstack(kpss_list) / det_scale)[order, :, :][keep, :, :]
+        return pre_det[keep, :], kpss
+
+    def _plan(self, frame: np.ndarray, layout: Optional[DetectionLayout]):
+        if layout is None:
+            h, w = frame.shape[:2]
+            return self.input_size, [((0, 0, w, h), (False, False, False, False))]
+        return layout.plan(frame.shape[1], frame.shape[0])
+
+    def _prepare_views(self, frame: np.ndarray, layout: Optional[DetectionLayout]) -> List[Any]:
+        input_size, windows = self._plan(frame, layout)
+        views = []
+        for (x0, y0, x1, y1), interior in windows:
+            det_img, det_scale = self._letterbox(frame[y0:y1, x0:x1], input_size)
+            views.append((det_img, det_scale, (x0, y0, x1, y1), interior))
+        return views
+
+    def prepare_frame(self, frame: np.ndarray, layout: Optional[DetectionLayout] = None) -> Optional[List[Any]]:
+        """Crop + letterbox semua view ke input detektor (dipanggil lebih awal oleh FramePrefetcher)."""
+        if self.batch_size <= 1 or not self._det_batchable:
+            return None
+        return self._prepare_views(frame, layout)
+
+    def _merge_views(self, parts: List[Any]):
+        """
+        Gabungkan deteksi dari beberapa view satu frame ke koordinat frame.
+        parts: [((bboxes, kpss), window, interior), ...]
+        """
+        if len(parts) == 1 and parts[0][1][:2] == (0, 0):
+            return parts[0][0]
+
+        dets_list, kpss_list = [], []
+        for (bboxes, kpss), (x0, y0, x1, y1), interior in parts:
+            bboxes = bboxes.copy()
+            if any(interior):
+                # Wajah terpotong di sisi tile yang berbatasan dengan tile lain
+                w, h = x1 - x0, y1 - y0
+                cut = (
+                    (interior[0] & (bboxes[:, 0] <= 2)) | (interior[1] & (bboxes[:, 1] <= 2)) |
+                    (interior[2] & (bboxes[:, 2] >= w - 2)) | (interior[3] & (bboxes[:, 3] >= h - 2))
+                )
+                bboxes = bboxes[~cut]
+                if kpss is not None:
+                    kpss = kpss[~cut]
+            bboxes[:, [0, 2]] += x0
+            bboxes[:, [1, 3]] += y0
+            dets_list.append(bboxes)
+            if kpss is not None:
+                kpss_list.append(kpss + np.array([x0, y0], dtype=kpss.dtype))
+
+        pre_det = np.vstack(dets_list)
+        kpss = np.vstack(kpss_list) if kpss_list else None
+        if len(parts) == 1:
+            return pre_det, kpss
+
+        # NMS antar view (wajah di area overlap terdeteksi lebih dari sekali)
+        order = pre_det[:, 4].argsort()[::-1]
+        pre_det = pre_det[order]
+        keep = self.det_model.nms(pre_det)
+        return pre_det[keep], (kpss[order][keep] if kpss is not None else None)
+
+    def _detect_batched(
+        self,
+        frames: List[np.ndarray],
+        prepped: Optional[List[Any]] = None,
+        layout: Optional[DetectionLayout] = None
+    ):
+        det = self.det_model
+        views_per_frame = [
+            p if p is not None else self._prepare_views(f, layout)
+            for f, p in zip(frames, prepped or [None] * len(frames))
+        ]
+        flat = [v for views in views_per_frame for v in views]
+        input_size = (flat[0][0].shape[1], flat[0][0].shape[0])
+
+        results = []
+        for start in range(0, len(flat), self.batch_size):
+            chunk = flat[start:start + self.batch_size]
+            blob = cv2.dnn.blobFromImages(
+                [v[0] for v in chunk], 1.0 / det.input_std, input_size,
+                (det.input_mean, det.input_mean, det.input_mean), swapRB=True
+            )
+            net_outs = det.session.run(det.output_names, {det.input_name: blob})
+            results.extend(
+                self._decode_detections(net_outs, b, len(chunk), v[1], input_size) for b, v in enumerate(chunk)
+            )
+
+        merged, pos = [], 0
+        for views in views_per_frame:
+            parts = [(res, v[2], v[3]) for res, v in zip(results[pos:pos + len(views)], views)]
+            merged.append(self._merge_views(parts))
+            pos += len(views)
+        return merged
+
+    def _detect_single(self, frame: np.ndarray, layout: Optional[DetectionLayout]):
+        input_size, windows = self._plan(frame, layout)
+        parts = [
+            (self.det_model.detect(frame[y0:y1, x0:x1], input_size=input_size, max_num=0, metric='default'),
+             (x0, y0, x1, y1), interior)
+            for (x0, y0, x1, y1), interior in windows
+        ]
+        return self._merge_views(parts)
+
+    def detect_batch(
+        self,
+        frames: List[np.ndarray],
+        prepped: Optional[List[Any]] = None,
+        layout: Optional[DetectionLayout] = None
+    ):
+        """
+        Deteksi wajah pada beberapa frame. Returns list of (bboxes_with_score, kpss).
+        `prepped` (opsional): hasil prepare_frame per frame yang sudah dihitung thread decoder.
+        `layout` (opsional): ROI / tiling / det_size; None = seluruh frame pada det_size default.
+        """
+        if self._det_batchable and (len(frames) > 1 or prepped):
+            try:
+                return self._detect_batched(frames, prepped, layout)
+            except Exception as e:
+                logger.warning(f"Batch: Detektor tidak mendukung batch dinamis, fallback per frame - {e}")
+                self._det_batchable = False
+        return [self._detect_single(f, layout) for f in frames]
+
+    # --- Recognition ---
+    def embed_crops(self, crops: List[np.ndarray], rec_model=None) -> np.ndarray:
+        """ArcFace atas crop 112x112 yang sudah di-align. Satu session.run per chunk."""
+        rec_model = rec_model or self.rec_model
+        if self._rec_batchable:
+            try:
+                chunks = [
+                    rec_model.get_feat(crops[i:i + FACE_REC_MAX_BATCH])
+                    for i in range(0, len(crops), FACE_REC_MAX_BATCH)
+                ]
+                return np.vstack(chunks)
+            except Exception as e:
+                logger.warning(f"Batch: Model recognition tidak mendukung batch dinamis, fallback per wajah - {e}")
+                self._rec_batchable = False
+        return np.vstack([rec_model.get_feat(c) for c in crops])
+
+    def align(self, frames: List[np.ndarray], faces_per_frame: List[List[Any]]) -> Tuple[List[np.ndarray], List[Any]]:
+        """Crop 112x112 ter-align (norm_crop) untuk semua wajah. Returns (crops, faces)."""
+        from insightface.utils import face_align
+
+        crops: List[np.ndarray] = []
+        owners: List[Any] = []
+        for frame, faces in zip(frames, faces_per_frame):
+            for face in faces:
+                crops.append(face_align.norm_crop(frame, landmark=face.kps, image_size=self.rec_model.input_size[0]))
+                owners.append(face)
+        return crops, owners
+
+    def detect(
+        self,
+        frames: List[np.ndarray],
+        prepped: Optional[List[Any]] = None,
+        layout: Optional[DetectionLayout] = None
+    ) -> List[List[Any]]:
+        """
+        Tahap 1: deteksi saja (tanpa embedding).
+
+        Returns:
+            list: Untuk setiap frame, list objek Face (bbox, kps, det_score).
+        """
+        from insightface.app.common import Face
+
+        faces_per_frame: List[List[Any]] = []
+        for bboxes, kpss in self.detect_batch(frames, prepped, layout):
+            faces = []
+            for i in range(bboxes.shape[0]):
+                if kpss is None:
+                    continue
+                faces.append(Face(bbox=bboxes[i, 0:4], kps=kpss[i], det_score=bboxes[i, 4]))
+            faces_per_frame.append(faces)
+        return faces_per_frame
+
+    def embed(self, frames: List[np.ndarray], faces_per_frame: List[List[Any]]):
+        """
+        Tahap 2: alignment + ArcFace untuk semua wajah yang diberikan (in-place).
+        Seluruh crop dari semua frame di-embed dalam satu panggilan ONNX.
+        """
+        crops, owners = self.align(frames, faces_per_frame)
+        if crops:
+            embeddings = self.embed_crops(crops)
+            for face, emb in zip(owners, embeddings):
+                face.embedding = emb.flatten()
+
+    def analyze(self, frames: List[np.ndarray], layout: Optional[DetectionLayout] = None) -> List[List[Any]]:
+        """
+        Deteksi + recognition untuk satu batch frame.
+
+        Returns:
+            list: Untuk setiap frame, list objek Face (bbox, kps, det_score, embedding).
+        """
+        if self.rec_model is None or (self.batch_size <= 1 and (layout is None or layout.is_default)):
+            return [self.face_app.get(f) for f in frames]
+
+        faces_per_frame = self.detect(frames, layout=layout)
+        self.embed(frames, faces_per_frame)
+        return faces_per_frame
+
+
+class FaceTracker:
+    """
+    Tracker IoU/centroid ringan untuk melewati recognition pada wajah yang sama.
+
+    Mirip tracker di helpers/fc detection.py, tetapi asosiasi dihitung secara
+    vektor (matrix IoU & jarak centroid D x T) dan menyimpan identitas per track.
+
+    Aturan:
+    - Track 'confirmed' jika skor kemiripan >= TRACK_CONFIRM_SCORE atau NIM yang
+      sama muncul TRACK_CONFIRM_HITS kali berturut-turut.
+    - Deteksi pada track confirmed TIDAK di-embed ulang, kecuali sudah
+      TRACK_REVERIFY_INTERVAL frame sampel sejak verifikasi terakhir.
+    - Verifikasi ulang yang gagal/berbeda membatalkan status confirmed.
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = TRACK_IOU_THRESHOLD,
+        max_centroid_shift: float = TRACK_MAX_CENTROID_SHIFT,
+        max_misses: int = TRACK_MAX_MISSES,
+        reverify_interval: int = TRACK_REVERIFY_INTERVAL,
+        confirm_score: float = TRACK_CONFIRM_SCORE,
+        confirm_hits: int = TRACK_CONFIRM_HITS
+    ):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_shift = max_centroid_shift
+        self.max_misses = max_misses
+        self.reverify_interval = reverify_interval
+        self.confirm_score = confirm_score
+        self.confirm_hits = confirm_hits
+
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.tracks: List[Dict[str, Any]] = []
+        self.next_id = 0
+        self.sample_no = 0
+
+        # Statistik
+        self.recognition_calls = 0
+        self.recognition_skipped = 0
+
+    def _affinity(self, bboxes: np.ndarray) -> np.ndarray:
+        """Matrix afinitas (D, T). Nilai < 0 berarti pasangan tidak boleh di-match."""
+        det = bboxes[:, None, :]
+        trk = self.boxes[None, :, :]
+
+        # IoU
+        ix1 = np.maximum(det[..., 0], trk[..., 0])
+        iy1 = np.maximum(det[..., 1], trk[..., 1])
+        ix2 = np.minimum(det[..., 2], trk[..., 2])
+        iy2 = np.minimum(det[..., 3], trk[..., 3])
+        inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+        area_d = (det[..., 2] - det[..., 0]) * (det[..., 3] - det[..., 1])
+        area_t = (trk[..., 2] - trk[..., 0]) * (trk[..., 3] - trk[..., 1])
+        iou = inter / np.maximum(area_d + area_t - inter, 1e-6)
+
+        # Jarak centroid dinormalisasi lebar wajah track
+        cd = (det[..., 0:2] + det[..., 2:4]) / 2.0
+        ct = (trk[..., 0:2] + trk[..., 2:4]) / 2.0
+        width_t = np.maximum(trk[..., 2] - trk[..., 0], 1.0)
+        shift = np.linalg.norm(cd - ct, axis=-1) / width_t
+
+        centroid_aff = self.iou_threshold * (1.0 - shift / self.max_centroid_shift)
+        valid = (iou >= self.iou_threshold) | (shift < self.max_centroid_shift)
+        return np.where(valid, np.maximum(iou, centroid_aff), -1.0)
+
+    def update(self, bboxes: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Asosiasikan deteksi satu frame sampel ke track (greedy, afinitas tertinggi dulu).
+
+        Args:
+            bboxes (np.ndarray): Bounding box deteksi (D, 4).
+
+        Returns:
+            list: Track (dict) untuk setiap deteksi, urutan sama dengan bboxes.
+        """
+        self.sample_no += 1
+        bboxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4)
+        n_det, n_trk = len(bboxes), len(self.tracks)
+        det_to_trk = [-1] * n_det
+
+        if n_det and n_trk:
+            aff = self._affinity(bboxes)
+            used_det, used_trk = set(), set()
+            for flat in np.argsort(-aff, axis=None):
+                d, t = divmod(int(flat), n_trk)
+                if aff[d, t] < 0:
+                    break
+                if d in used_det or t in used_trk:
+                    continue
+                det_to_trk[d] = t
+                used_det.add(d)
+                used_trk.add(t)
+
+        matched_trk = set(t for t in det_to_trk if t >= 0)
+        for t, track in enumerate(self.tracks):
+            track['misses'] = 0 if t in matched_trk else track['misses'] + 1
+
+        assigned: List[Dict[str, Any]] = []
+        for d, t in enumerate(det_to_trk):
+            if t >= 0:
+                track = self.tracks[t]
+                self.boxes[t] = bboxes[d]
+            else:
+                track = {
+                    'track_id': self.next_id, 'nim': None, 'confirmed': False,
+                    'agree': 0, 'last_verified': 0, 'misses': 0
+                }
+                self.next_id += 1
+                self.tracks.append(track)
+                self.boxes = np.vstack([self.boxes, bboxes[d:d + 1]])
+            assigned.append(track)
+
+        # Buang track yang sudah lama tidak terlihat
+        keep = [i for i, tr in enumerate(self.tracks) if tr['misses'] <= self.max_misses]
+        if len(keep) != len(self.tracks):
+            self.tracks = [self.tracks[i] for i in keep]
+            self.boxes = self.boxes[keep]
+
+        return assigned
+
+    def needs_recognition(self, track: Dict[str, Any], last_verified: Optional[int] = None) -> bool:
+        """
+        True jika wajah pada track ini harus di-embed (belum confirmed / jatuh tempo verifikasi).
+        last_verified menggantikan track['last_verified'] untuk verifikasi yang sudah dijadwalkan
+        tetapi belum di-observe (perencanaan satu batch frame).
+        """
+        if not track['confirmed']:
+            return True
+        if last_verified is None:
+            last_verified = track['last_verified']
+        return (self.sample_no - last_verified) >= self.reverify_interval
+
+    def observe(self, track: Dict[str, Any], nim: str, score: float, sample_no: int):
+        """Perbarui identitas track dengan hasil recognition terbaru."""
+        self.recognition_calls += 1
+        track['last_verified'] = sample_no
+
+        if nim == "Unknown":
+            track.update(nim=None, agree=0, confirmed=False)
+            return
+
+        if nim == track['nim']:
+            track['agree'] += 1
+        else:
+            track.update(nim=nim, agree=1, confirmed=False)
+
+        if score >= self.confirm_score or track['agree'] >= self.confirm_hits:
+            track['confirmed'] = True
+
+# ==============================================================================
+# [4] WORKER PROCESS (PROCESS POOL)
+# ==============================================================================
+
+# State per-proses worker (diisi oleh init_analysis_worker)
+_worker_face_app = None
+_worker_analyzer: Optional[BatchedFaceAnalyzer] = None
+_worker_progress_queue = None
+# multiprocessing.Event dari proses API: di-set saat shutdown agar job berjalan berhenti di batas batch
+_worker_stop_event = None
+_worker_emotion_backend = None
+_worker_crop_sink: Optional["CropSink"] = None
+
+
+def init_analysis_worker(progress_queue, intra_op_threads: int = 0, stop_event=None):
+    """
+    Initializer ProcessPoolExecutor. Dijalankan SEKALI di setiap worker process.
+
+    Setiap worker memuat session InsightFace miliknya sendiri sehingga inferensi
+    tidak berebut objek/thread pool dengan proses API.
+
+    Args:
+        progress_queue: multiprocessing.Queue untuk mengirim progress ke proses API.
+        intra_op_threads (int): Batas thread ONNX Runtime per session.
+        stop_event: multiprocessing.Event; jika di-set, job berjalan dihentikan (AnalysisInterrupted)
+            tanpa checkpoint baru, sehingga resume memakai checkpoint terakhir.
+    """
+    global _worker_face_app, _worker_analyzer, _worker_progress_queue, _worker_emotion_backend, _worker_crop_sink
+    global _worker_stop_event
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s::%(funcName)s - %(message)s"
+    )
+    _worker_progress_queue = progress_queue
+    _worker_stop_event = stop_event
+    # PID dicatat proses API untuk terminate paksa saat shutdown melewati batas waktu
+    progress_queue.put((WORKER_MSG_STARTED, None, os.getpid()))
+
+    logger.info(f"Worker {os.getpid()}: Memuat model InsightFace ({INSIGHTFACE_MODEL_NAME})...")
+    _worker_face_app = create_face_app(intra_op_threads=intra_op_threads)
+    light_rec_model = None
+    if VIDEO_CASCADE_ENABLED:
+        logger.info(f"Worker {os.getpid()}: Memuat model cascade ringan ({VIDEO_CASCADE_LIGHT_MODEL})...")
+        light_rec_model = create_light_recognizer(intra_op_threads=intra_op_threads)
+    _worker_analyzer = BatchedFaceAnalyzer(_worker_face_app, light_rec_model=light_rec_model)
+    # Backend emosi lokal (ONNX) jika dikonfigurasi; backend remote tetap di proses API
+    _worker_emotion_backend = create_emotion_backend(in_worker=True)
+    _worker_crop_sink = CropSink()
+    logger.info(f"Worker {os.getpid()}: Model siap.")
+
+
+def _worker_stopping() -> bool:
+    return _worker_stop_event is not None and _worker_stop_event.is_set()
+
+
+class StageProfiler:
+    """
+    Akumulator durasi (detik) dan jumlah item per tahap pipeline.
+
+    Tahap standar: decode, detection, quality_gate, recognition_light, recognition, crop_write, emotion, db_commit.
+    Snapshot berupa dict JSON-serializable sehingga bisa dikirim dari worker
+    dan disimpan ke VideoTask.profile_data.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        # 'decode' dicatat dari thread FramePrefetcher
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float, count: int = 1):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'count': 0})
+            stage['seconds'] += seconds
+            stage['count'] += count
+
+    @contextmanager
+    def stage(self, name: str, count: int = 1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, count)
+
+    def timed_iter(self, name: str, iterable):
+        """Bungkus iterator; waktu menunggu item berikutnya dicatat ke tahap `name`."""
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start, 0)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def merge(self, snapshot: Optional[Dict[str, Dict[str, float]]]):
+        for name, stage in (snapshot or {}).items():
+            self.add(name, stage.get('seconds', 0.0), int(stage.get('count', 0)))
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {'seconds': round(stage['seconds'], 3), 'count': int(stage['count'])}
+            for name, stage in self.stages.items()
+        }
+
+
+def face_sharpness(crop: np.ndarray) -> float:
+    """Varians Laplacian crop wajah yang dinormalisasi ke 64x64 grayscale (independen ukuran wajah)."""
+    gray = cv2.cvtColor(cv2.resize(crop, (64, 64), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def gate_faces(
+    frames: List[np.ndarray],
+    faces_per_frame: List[List[Any]],
+    min_size: int = VIDEO_GATE_MIN_FACE_PX,
+    min_det_score: float = VIDEO_GATE_MIN_DET_SCORE,
+    min_sharpness: float = VIDEO_GATE_MIN_SHARPNESS
+) -> Tuple[List[List[Any]], int]:
+    """
+    Quality gate setelah deteksi: hanya wajah yang lolos yang masuk recognition.
+
+    Urutan cek dari yang termurah: ukuran bbox -> det_score -> blur (hanya untuk
+    wajah yang lolos dua cek pertama, karena butuh crop + Laplacian).
+
+    Returns:
+        tuple: (faces_per_frame yang lolos, jumlah wajah yang dibuang)
+    """
+    kept_per_frame: List[List[Any]] = []
+    rejected = 0
+    for frame, faces in zip(frames, faces_per_frame):
+        kept = []
+        for face in faces:
+            x1, y1, x2, y2 = face.bbox.astype(int)
+            if min(x2 - x1, y2 - y1) < min_size:
+                rejected += 1
+                continue
+            if face.det_score is not None and float(face.det_score) < min_det_score:
+                rejected += 1
+                continue
+            if min_sharpness > 0:
+                crop = frame[max(0, y1):max(0, y2), max(0, x1):max(0, x2)]
+                if crop.size == 0 or face_sharpness(crop) < min_sharpness:
+                    rejected += 1
+                    continue
+            kept.append(face)
+        kept_per_frame.append(kept)
+    return kept_per_frame, rejected
+
+
+def score_face_sample(face: Any, crop: np.ndarray) -> float:
+    """
+    Skor kualitas (0..1) crop wajah sebagai foto bukti, dari data yang sudah ada:
+
+    - ukuran    : sisi wajah relatif terhadap VIDEO_SAMPLE_REF_SIZE
+    - det_score : keyakinan detektor
+    - ketajaman : varians Laplacian pada crop yang dinormalisasi ke 64x64
+    - frontal   : posisi hidung terhadap mata & mulut dari 5 landmark (yaw/pitch)
+    """
+    h, w = crop.shape[:2]
+    size_term = min(1.0, np.sqrt(h * w) / VIDEO_SAMPLE_REF_SIZE)
+    det_term = float(face.det_score) if face.det_score is not None else 0.5
+    sharp_term = min(1.0, face_sharpness(crop) / VIDEO_SAMPLE_SHARPNESS_REF)
+
+    frontal_term = 0.5
+    kps = face.kps
+    if kps is not None and len(kps) >= 5:
+        eye_mid = (kps[0] + kps[1]) / 2
+        mouth_mid = (kps[3] + kps[4]) / 2
+        eye_dist = float(np.linalg.norm(kps[1] - kps[0])) + 1e-6
+        face_len = float(mouth_mid[1] - eye_mid[1]) + 1e-6
+        yaw = abs(float(kps[2][0] - eye_mid[0])) / eye_dist
+        # Hidung wajah frontal berada kira-kira di tengah antara mata dan mulut
+        pitch = abs(float(kps[2][1] - eye_mid[1]) / face_len - 0.55)
+        frontal_term = float(np.clip(1.0 - 2.0 * yaw - 2.0 * pitch, 0.0, 1.0))
+
+    return 0.25 * (size_term + det_term + sharp_term + frontal_term)
+
+
+class CropSink:
+    """
+    Penyimpanan crop wajah tanpa memblokir frame loop.
+
+    submit() meng-encode crop ke JPEG satu kali dan mengembalikan bytes-nya
+    (dipakai ulang untuk Emotion API). Penulisan ke disk dilakukan thread writer
+    dari antrian terbatas; jika antrian penuh, submit() menunggu (back-pressure).
+    """
+
+    def __init__(self, max_pending: int = VIDEO_CROP_WRITE_QUEUE):
+        self.queue: "queue.Queue[Optional[Tuple[str, bytes]]]" = queue.Queue(maxsize=max(1, max_pending))
+        self.written = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._writer, name="crop-writer", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def encode(crop: np.ndarray) -> bytes:
+        return compress_image_to_bytes(crop, max_size=VIDEO_CROP_MAX_SIZE, quality=VIDEO_CROP_JPEG_QUALITY)
+
+    def submit(self, path: str, crop: np.ndarray) -> bytes:
+        payload = self.encode(crop)
+        if payload:
+            self.queue.put((path, payload))
+        return payload
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                path, payload = item
+                with open(path, 'wb') as f:
+                    f.write(payload)
+                self.written += 1
+            except Exception as e:
+                # Thread writer tidak boleh mati: antrian terbatas + flush()/close() menunggu join()
+                self.errors += 1
+                logger.warning(f"CropSink: Gagal menulis {item[0] if isinstance(item, tuple) else item!r} - {e}")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Tunggu sampai semua crop yang di-submit sudah tertulis ke disk."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+
+# Jenis pesan pada progress queue: (kind, task_id, payload)
+WORKER_MSG_PROGRESS = "progress"      # payload: (status, progress_pct)
+WORKER_MSG_CHECKPOINT = "checkpoint"  # payload: dict checkpoint (lihat build_checkpoint)
+WORKER_MSG_STARTED = "started"        # payload: PID worker (dikirim initializer, task_id None)
+
+
+def report_progress(task_id: str, status: str, progress: int, segment: Optional[int] = None):
+    """Kirim update progress task (atau satu segmennya) ke proses API (non-blocking untuk worker)."""
+    if _worker_progress_queue is not None:
+        _worker_progress_queue.put((WORKER_MSG_PROGRESS, task_id, (status, progress, segment)))
+
+
+def report_checkpoint(task_id: str, checkpoint: Dict[str, Any]):
+    """Kirim checkpoint task ke proses API untuk disimpan di VideoTask.checkpoint_data."""
+    if _worker_progress_queue is not None:
+        _worker_progress_queue.put((WORKER_MSG_CHECKPOINT, task_id, checkpoint))
+
+
+def build_checkpoint(
+    next_frame: int,
+    frames_sampled: int,
+    progress: int,
+    detected: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Snapshot ringkas (JSON-serializable) dari state frame loop.
+    Crop wajah tidak ikut disimpan; file sample di crop_dir dibaca ulang saat resume
+    (sample terbaik ditulis ke disk sebelum checkpoint dibuat).
+    """
+    return {
+        'next_frame': int(next_frame),
+        'frames_sampled': frames_sampled,
+        'progress': max(progress, 0),
+        'detected': {
+            nim: {'count': entry['count'], 'sample': entry['sample'], 'score': round(entry['score'], 4)}
+            for nim, entry in detected.items()
+        }
+    }
+
+
+def restore_checkpoint(checkpoint: Dict[str, Any], crop_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Bangun ulang agregat `detected` dari checkpoint, termasuk JPEG & crop sample
+    (dibaca dari disk) yang dibutuhkan untuk analisis emosi.
+    """
+    detected: Dict[str, Dict[str, Any]] = {}
+    for nim, saved in (checkpoint.get('detected') or {}).items():
+        payload, crop = None, None
+        path = os.path.join(crop_dir, os.path.basename(saved['sample'])) if saved.get('sample') else None
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                payload = f.read()
+            crop = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+        # Sample yang hilang dari disk akan diambil ulang dari frame berikutnya
+        detected[nim] = {
+            'count': int(saved.get('count', 0)),
+            'sample': saved.get('sample') if crop is not None else None,
+            'jpeg': payload if crop is not None else None,
+            'crop': crop,
+            'score': float(saved.get('score', 0.0)) if crop is not None else -1.0,
+            'dirty': False
+        }
+    return detected
+
+
+def _detect_and_gate(
+    frames: List[np.ndarray],
+    profiler: StageProfiler,
+    prepped: Optional[List[Any]] = None,
+    layout: Optional[DetectionLayout] = None
+) -> List[List[Any]]:
+    """Tahap 1 (deteksi) + quality gate. Wajah yang tidak lolos tidak pernah sampai ke ArcFace."""
+    with profiler.stage('detection', len(frames)):
+        faces_per_frame = _worker_analyzer.detect(frames, prepped, layout)
+    with profiler.stage('quality_gate', sum(len(faces) for faces in faces_per_frame)):
+        faces_per_frame, rejected = gate_faces(frames, faces_per_frame)
+    profiler.add('quality_rejected', 0.0, rejected)
+    return faces_per_frame
+
+
+def _embed_faces(
+    frames: List[np.ndarray],
+    faces_per_frame: List[List[Any]],
+    job: Dict[str, Any],
+    profiler: StageProfiler
+):
+    """
+    Tahap 2: recognition (in-place). Dengan cascade, semua crop di-embed model ringan
+    dulu; hanya wajah ambigu yang di-embed ulang model berat dari crop yang sama.
+    Wajah yang diputuskan tahap ringan mendapat `face.cascade_match` (tanpa embedding).
+
+    Cascade hanya aktif jika galeri ringan job lengkap (light_complete): kandidat tanpa
+    embedding ringan tidak bisa dibedakan di tahap ringan dan wajahnya bisa diterima
+    sebagai mahasiswa lain. Galeri tidak lengkap -> seluruh wajah lewat model berat.
+    """
+    light_matrix = job.get('light_matrix')
+    cascade_ready = (
+        _worker_analyzer.light_rec_model is not None
+        and light_matrix is not None and len(light_matrix) > 0
+        and job.get('light_complete')
+    )
+    if not cascade_ready:
+        with profiler.stage('recognition', sum(len(faces) for faces in faces_per_frame)):
+            _worker_analyzer.embed(frames, faces_per_frame)
+        return
+
+    crops, owners = _worker_analyzer.align(frames, faces_per_frame)
+    if not crops:
+        return
+
+    with profiler.stage('recognition_light', len(crops)):
+        light_embeddings = _worker_analyzer.embed_crops(crops, _worker_analyzer.light_rec_model)
+        # Tolak cepat tidak dipakai jika ada galeri fallback (wajah bisa milik mahasiswa di luar indeks)
+        reject_score = VIDEO_CASCADE_REJECT_SCORE if job.get('fallback_matrix') is None else 0.0
+        decisions = cascade_match(light_embeddings, job['light_ids'], light_matrix, reject_score=reject_score)
+
+    escalate = [i for i, decision in enumerate(decisions) if decision is None]
+    for face, decision in zip(owners, decisions):
+        face.cascade_match = decision
+    profiler.add('cascade_accepted', 0.0, sum(1 for d in decisions if d is not None and d[0] != "Unknown"))
+    profiler.add('cascade_rejected', 0.0, sum(1 for d in decisions if d is not None and d[0] == "Unknown"))
+
+    with profiler.stage('recognition', len(escalate)):
+        if escalate:
+            embeddings = _worker_analyzer.embed_crops([crops[i] for i in escalate])
+            for i, emb in zip(escalate, embeddings):
+                owners[i].embedding = emb.flatten()
+
+
+def _identify_with_tracker(
+    frames: List[np.ndarray],
+    tracker: FaceTracker,
+    job: Dict[str, Any],
+    profiler: StageProfiler,
+    prepped: Optional[List[Any]] = None,
+    layout: Optional[DetectionLayout] = None
+) -> Tuple[List[List[Any]], List[List[str]]]:
+    """
+    Deteksi -> quality gate -> asosiasi track -> embedding HANYA untuk wajah yang perlu -> identifikasi.
+
+    Asosiasi track (update) tidak bergantung pada identitas, sehingga seluruh frame batch
+    diasosiasikan dulu lalu wajah yang perlu recognition di-embed dalam SATU panggilan
+    (per model), kemudian identifikasi & observe() dijalankan per frame secara berurutan.
+
+    Keputusan embed dibuat dengan status track di awal batch: track yang belum confirmed
+    di-embed di setiap frame batch (track yang confirmed di tengah batch mendapat paling
+    banyak batch_size - 1 embedding ekstra, tetap dipakai sebagai bukti), dan jadwal
+    verifikasi ulang track confirmed disimulasikan per frame. Verifikasi ulang yang gagal
+    di tengah batch baru memicu recognition mulai batch berikutnya.
+
+    Returns:
+        tuple: (faces_per_frame, nims_per_frame)
+    """
+    faces_per_frame = _detect_and_gate(frames, profiler, prepped, layout)
+
+    # 1. Asosiasi track per frame (berurutan) & tentukan wajah yang perlu di-embed
+    tracks_per_frame, sample_nos, to_embed = [], [], []
+    planned_verify: Dict[int, int] = {}
+    for faces in faces_per_frame:
+        tracks = tracker.update(np.array([f.bbox for f in faces]))
+        tracks_per_frame.append(tracks)
+        sample_nos.append(tracker.sample_no)
+        selected = []
+        for face, track in zip(faces, tracks):
+            if tracker.needs_recognition(track, planned_verify.get(track['track_id'])):
+                planned_verify[track['track_id']] = tracker.sample_no
+                selected.append(face)
+        to_embed.append(selected)
+
+    # 2. Satu panggilan ONNX (per model) untuk semua wajah batch yang perlu recognition
+    _embed_faces(frames, to_embed, job, profiler)
+
+    # 3. Identifikasi & update identitas track, per frame berurutan
+    nims_per_frame: List[List[str]] = []
+    for faces, tracks, sample_no in zip(faces_per_frame, tracks_per_frame, sample_nos):
+        nims = []
+        for face, track in zip(faces, tracks):
+            if face.embedding is None and face.cascade_match is None:
+                tracker.recognition_skipped += 1
+                nims.append(track['nim'] or "Unknown")
+                continue
+            nim, score = identify_face(job, face)
+            tracker.observe(track, nim, score, sample_no)
+            nims.append(nim)
+        nims_per_frame.append(nims)
+
+    return faces_per_frame, nims_per_frame
+
+
+def merge_segment_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Gabungkan hasil run_video_analysis_job per segmen menjadi satu hasil task.
+
+    - count    : dijumlahkan
+    - emotions : label emosi (backend lokal) dari setiap segmen dikumpulkan untuk tally
+    - sample   : crop dengan skor kualitas tertinggi; sample segmen lain dikembalikan
+                 di 'discarded_samples' agar file-nya bisa dihapus
+    """
+    detected: Dict[str, Dict[str, Any]] = {}
+    discarded: List[str] = []
+    profiler = StageProfiler()
+
+    for result in results:
+        profiler.merge(result.get('profile'))
+        for nim, entry in result['detected'].items():
+            merged = detected.setdefault(nim, {
+                'count': 0, 'sample': None, 'jpeg': None, 'score': -1.0, 'emotions': []
+            })
+            merged['count'] += entry['count']
+            if entry.get('emotion'):
+                merged['emotions'].append(entry['emotion'])
+            if entry.get('sample') and entry.get('score', -1.0) > merged['score']:
+                if merged['sample']:
+                    discarded.append(merged['sample'])
+                merged.update(
+                    sample=entry['sample'], jpeg=entry.get('jpeg'),
+                    score=entry['score'], emotion=entry.get('emotion')
+                )
+            elif entry.get('sample'):
+                discarded.append(entry['sample'])
+
+    profiler.add('segments', 0.0, len(results))
+    return {
+        'detected': detected,
+        'frames_sampled': sum(r['frames_sampled'] for r in results),
+        'decode_mode': results[0]['decode_mode'] if results else None,
+        'emotion_in_worker': all(r.get('emotion_in_worker') for r in results),
+        'recognition_skipped': sum(r.get('recognition_skipped', 0) for r in results),
+        'profile': profiler.snapshot(),
+        'early_exit': None,
+        'discarded_samples': discarded
+    }
+
+
+def _write_best_samples(
+    detected: Dict[str, Dict[str, Any]],
+    task_id: str,
+    job: Dict[str, Any],
+    profiler: StageProfiler
+):
+    """Encode & antrikan penulisan sample terbaik yang berubah sejak penulisan terakhir."""
+    for nim, entry in detected.items():
+        if not entry.get('dirty') or entry['crop'] is None:
+            continue
+        # Nama file stabil per mahasiswa: checkpoint berikutnya menimpa file yang sama
+        filename = f"{task_id}_{nim}{job.get('sample_suffix', '')}.jpg"
+        with profiler.stage('crop_write'):
+            payload = _worker_crop_sink.submit(os.path.join(job['crop_dir'], filename), entry['crop'])
+        if payload:
+            entry['sample'] = f"{job['crop_url_prefix']}/{filename}"
+            entry['jpeg'] = payload
+        entry['dirty'] = False
+
+
+def run_video_analysis_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Frame loop analisis video. Dijalankan di worker process.
+
+    Args:
+        job (dict): Parameter task dengan keys:
+            - task_id, file_path, frame_skip
+            - known_ids, known_matrix, threshold : galeri wajah untuk identifikasi
+            - fallback_ids, fallback_matrix      : (opsional) galeri global jika tidak cocok
+            - crop_dir, crop_url_prefix          : lokasi penyimpanan sample wajah
+            - resume (opsional)                  : checkpoint dari run sebelumnya
+            - streaming (opsional)               : file masih di-upload (StreamingFrameSource)
+            - early_exit (opsional)              : {'roster': [NIM], 'min_sightings': int, 'idle_s': float}
+            - segment, decode_plan, sample_suffix: (opsional) satu segmen dari plan_video_segments
+            - detect_roi (opsional)              : ROI deteksi ruang [x0, y0, x1, y1] (pecahan frame)
+            - light_ids, light_matrix, light_complete (opsional): galeri model ringan untuk cascade
+
+    Returns:
+        dict: {
+            'detected': { NIM: {'count': int, 'sample': str_url, 'jpeg': bytes, 'score': float, 'emotion': str} },
+            'frames_sampled': int,
+            'decode_mode': str,
+            'profile': StageProfiler.snapshot(),
+            'early_exit': {'reason', 'frame', 'time_s', 'progress'} | None
+        }
+    """
+    task_id = job['task_id']
+    file_path = job['file_path']
+
+    if _worker_analyzer is None:
+        raise RuntimeError("Worker belum memuat model InsightFace.")
+
+    profiler = StageProfiler()
+    prefetcher: Optional[FramePrefetcher] = None
+
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        raise RuntimeError("Gagal membuka file video. Format mungkin tidak didukung.")
+
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+
+        # Interval kandidat = VIDEO_PROCESSING_FRAME_SKIP (fallback: 1 frame setiap 1.5 detik)
+        frame_interval = job.get('frame_skip') or int(fps * 1.5)
+        streaming = bool(job.get('streaming')) and os.path.exists(upload_marker_path(file_path))
+        if streaming:
+            # GOP belum bisa diprobe dari file parsial; decode sequential sambil menunggu data
+            decode_mode = "streaming"
+        elif job.get('decode_plan'):
+            # Segmen: strategi decode sudah ditentukan sekali oleh plan_video_segments
+            decode_mode, frame_interval = job['decode_plan']
+        else:
+            decode_mode, frame_interval = resolve_decode_strategy(file_path, frame_interval)
+        logger.info(f"[Task {task_id}] Decode mode: {decode_mode}, interval {frame_interval} frame")
+
+        detected: Dict[str, Dict[str, Any]] = {}
+        frames_sampled = 0
+        last_progress = -1
+        start_frame = 0
+
+        # Rentang frame yang dianalisis job ini (seluruh video, atau satu segmen)
+        segment = job.get('segment')
+        span_start = 0
+        if segment:
+            span_start = start_frame = int(segment['start'])
+            total_frames = min(total_frames, int(segment['end'])) if total_frames > 0 else int(segment['end'])
+
+        resume = job.get('resume')
+        if resume:
+            detected = restore_checkpoint(resume, job['crop_dir'])
+            frames_sampled = int(resume.get('frames_sampled', 0))
+            last_progress = int(resume.get('progress', -1))
+            start_frame = int(resume.get('next_frame', 0))
+            logger.info(
+                f"[Task {task_id}] Resume dari frame {start_frame} "
+                f"({len(detected)} mahasiswa sudah terdeteksi)"
+            )
+
+        # Di-set saat prefetcher ditutup: StreamingFrameSource berhenti menunggu data upload
+        source_stop = threading.Event()
+        stream_source = None
+        if streaming:
+            stream_source = StreamingFrameSource(
+                file_path, frame_interval, start_frame=start_frame,
+                stop_check=lambda: source_stop.is_set() or _worker_stopping()
+            )
+            frame_iter = iter(stream_source)
+        else:
+            frame_iter = iter_sampled_frames(cap, decode_mode, frame_interval, total_frames, start_frame=start_frame)
+
+        frame_iter = profiler.timed_iter('decode', frame_iter)
+
+        sampler = None
+        if VIDEO_ADAPTIVE_SAMPLING:
+            sampler = AdaptiveFrameSampler(max(frame_interval, int(fps * VIDEO_SAMPLE_MAX_INTERVAL_S)))
+            frame_iter = sampler.filter(frame_iter)
+
+        # ROI ruang + mode deteksi (fixed / auto / tiled)
+        layout = _worker_analyzer.create_layout(job.get('detect_roi'))
+
+        # Decode + sampling + letterbox di thread terpisah, overlap dengan inferensi
+        if VIDEO_PREFETCH_FRAMES > 0:
+            prefetcher = FramePrefetcher(
+                frame_iter, lambda frame: _worker_analyzer.prepare_frame(frame, layout),
+                profiler=profiler, stop_event=source_stop
+            )
+            frame_iter = prefetcher
+
+        use_tracking = VIDEO_TRACKING_ENABLED and _worker_analyzer.rec_model is not None
+        tracker = FaceTracker() if use_tracking else None
+
+        last_checkpoint = time.monotonic()
+        cancel_path = cancel_marker_path(file_path)
+
+        early_exit = job.get('early_exit')
+        stop_info = None
+        roster = set(early_exit.get('roster') or []) if early_exit else set()
+        min_sightings = int(early_exit.get('min_sightings', VIDEO_EARLY_EXIT_SIGHTINGS)) if early_exit else 0
+        idle_frames = int(fps * float(early_exit.get('idle_s', VIDEO_EARLY_EXIT_IDLE_S))) if early_exit else 0
+        last_new_identity = start_frame
+
+        for batch in iter_frame_batches(frame_iter):
+            # Pembatalan kooperatif: dicek sebelum setiap batch inferensi
+            if os.path.exists(cancel_path):
+                raise AnalysisCancelled(f"Task {task_id} dibatalkan")
+            # Shutdown server: berhenti tanpa checkpoint baru, resume dari checkpoint terakhir
+            if _worker_stopping():
+                raise AnalysisInterrupted(f"Task {task_id} dihentikan (server shutdown)")
+
+            frames = [frame for _, frame in batch]
+            prepped = prefetcher.take_prepared([idx for idx, _ in batch]) if prefetcher else None
+
+            if tracker is None:
+                # Deteksi -> quality gate -> recognition (batch) hanya untuk wajah yang lolos
+                if _worker_analyzer.rec_model is None:
+                    # FaceAnalysis.get: deteksi & recognition tidak bisa dipisah, dicatat sebagai detection
+                    with profiler.stage('detection', len(frames)):
+                        faces_per_frame = _worker_analyzer.analyze(frames, layout)
+                else:
+                    faces_per_frame = _detect_and_gate(frames, profiler, prepped, layout)
+                    _embed_faces(frames, faces_per_frame, job, profiler)
+                identities = [
+                    [identify_face(job, f)[0] for f in faces]
+                    for faces in faces_per_frame
+                ]
+            else:
+                faces_per_frame, identities = _identify_with_tracker(frames, tracker, job, profiler, prepped, layout)
+
+            for (frame_idx, frame), faces, nims in zip(batch, faces_per_frame, identities):
+                frames_sampled += 1
+
+                if stream_source is not None:
+                    # Progress relatif terhadap bagian file yang sudah diterima;
+                    # proses API mengalikannya dengan progress upload
+                    total_frames = stream_source.total_frames
+                if total_frames > span_start:
+                    progress_pct = min(int(((frame_idx - span_start) / (total_frames - span_start)) * 100), 99)
+                    if progress_pct != last_progress:
+                        report_progress(task_id, "processing", progress_pct, segment['index'] if segment else None)
+                        last_progress = progress_pct
+
+                for face, nim in zip(faces, nims):
+                    if nim == "Unknown":
+                        continue
+
+                    if nim not in detected:
+                        last_new_identity = frame_idx
+                    entry = detected.setdefault(nim, {
+                        'count': 0, 'sample': None, 'jpeg': None, 'crop': None, 'score': -1.0, 'dirty': False
+                    })
+                    entry['count'] += 1
+
+                    # Kandidat sample bukti: hanya crop dengan skor kualitas terbaik yang disimpan di memori
+                    b = face.bbox.astype(int)
+                    x1, y1 = max(0, b[0]), max(0, b[1])
+                    x2, y2 = min(frame.shape[1], b[2]), min(frame.shape[0], b[3])
+                    face_crop = frame[y1:y2, x1:x2]
+                    if face_crop.size == 0:
+                        continue
+
+                    with profiler.stage('sample_quality'):
+                        score = score_face_sample(face, face_crop)
+                    if score > entry['score']:
+                        # Copy agar frame penuh tidak tertahan di memori
+                        entry.update(crop=face_crop.copy(), score=score, dirty=True)
+
+            # Checkpoint hanya di batas batch: seluruh frame sebelum next_frame sudah teragregasi
+            # (tidak untuk segmen: task segmented diulang dari awal jika terputus)
+            if (
+                not segment
+                and VIDEO_CHECKPOINT_INTERVAL_S > 0
+                and time.monotonic() - last_checkpoint >= VIDEO_CHECKPOINT_INTERVAL_S
+            ):
+                _write_best_samples(detected, task_id, job, profiler)
+                next_frame = batch[-1][0] + frame_interval
+                report_checkpoint(task_id, build_checkpoint(next_frame, frames_sampled, last_progress, detected))
+                last_checkpoint = time.monotonic()
+
+            # Early exit (opt-in): sisa video tidak menambah informasi kehadiran
+            if early_exit:
+                last_idx = batch[-1][0]
+                reason = None
+                if roster and all(detected.get(nim, {}).get('count', 0) >= min_sightings for nim in roster):
+                    reason = "roster_complete"
+                elif idle_frames > 0 and detected and last_idx - last_new_identity >= idle_frames:
+                    reason = "no_new_identities"
+                if reason:
+                    stop_info = {
+                        'reason': reason,
+                        'frame': int(last_idx),
+                        'time_s': round(last_idx / fps, 1),
+                        'progress': max(last_progress, 0)
+                    }
+                    logger.info(f"[Task {task_id}] Early exit ({reason}) di frame {last_idx} ({stop_info['time_s']} s)")
+                    break
+
+        # Sample terbaik ditulis SEKALI di akhir (encode JPEG dipakai ulang untuk Emotion API)
+        _write_best_samples(detected, task_id, job, profiler)
+        # Pastikan seluruh sample sudah ada di disk sebelum URL-nya disimpan ke DB
+        with profiler.stage('crop_write', 0):
+            _worker_crop_sink.flush()
+
+        # Emosi dengan backend lokal: satu batch untuk seluruh sample wajah
+        emotion_in_worker = _worker_emotion_backend is not None
+        if emotion_in_worker:
+            sample_nims = [nim for nim, entry in detected.items() if entry['crop'] is not None]
+            with profiler.stage('emotion', len(sample_nims)):
+                labels = _worker_emotion_backend.predict_batch([detected[nim]['crop'] for nim in sample_nims])
+            for nim, label in zip(sample_nims, labels):
+                detected[nim]['emotion'] = label
+        # Crop mentah tidak dikirim ke proses API (cukup bytes JPEG)
+        for entry in detected.values():
+            entry.pop('crop', None)
+            entry.pop('dirty', None)
+
+        if sampler is not None:
+            logger.info(
+                f"[Task {task_id}] Sampling adaptif: {sampler.skipped}/{sampler.candidates} frame statis dilewati"
+            )
+        if tracker is not None:
+            logger.info(
+                f"[Task {task_id}] Tracking: {tracker.recognition_calls} recognition, "
+                f"{tracker.recognition_skipped} dilewati"
+            )
+
+        return {
+            'detected': detected,
+            'frames_sampled': frames_sampled,
+            'decode_mode': decode_mode,
+            'emotion_in_worker': emotion_in_worker,
+            'recognition_skipped': tracker.recognition_skipped if tracker else 0,
+            'profile': profiler.snapshot(),
+            'early_exit': stop_info
+        }
+    finally:
+        # Thread decoder harus berhenti sebelum VideoCapture dilepas
+        if prefetcher is not None:
+            prefetcher.close()
+        cap.release()
+        # Crop yang sudah diantrikan harus tertulis sebelum proses API membersihkan/menyimpannya
+        if _worker_crop_sink is not None:
+            _worker_crop_sink.flush()